@@ -1,11 +1,27 @@
-import pyautogui as pa
-import win32gui
-import tkinter
 import tkinter as tk
-from tkinter import *
 import re
-from queue import Queue
+from queue import Queue, Empty
 import os
+import argparse
+import getpass
+import time
+import sys
+import csv
+import ctypes
+from contextlib import contextmanager
+import functools
+import threading
+import bisect
+import json
+import sqlite3
+import hashlib
+import math
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from receiving_query import ReceivedIndex, LINE_PATTERN
+from terminal_driver import TerminalDriver, WindowSystem
 
 """
 RMA Receiving Program
@@ -31,6 +47,9 @@ Key Features:
 Frameworks/Libraries Used:  
 - PyAutoGUI: Automates keyboard and mouse interactions to navigate the AS400 system.  
 - Win32GUI: Retrieves and interacts with open windows in the operating system.  
+  (PyAutoGUI and Win32GUI are only needed for the real AS400 window and are imported the first time it is used,
+  `as400_simulator.py` runs anywhere.)
+- EHLLAPI (through ctypes): Reads the emulator's screen directly, the clipboard is only used when it is not available.
 - Tkinter: Builds the user interface for the program.  
 - OS: Manages file paths and folder creations.  
 - Regex: Used to extract barcodes for RMA.  
@@ -40,6 +59,21 @@ Usage Instructions:
 2. Enter the RMA number and start the process using the "Start" button.  
 3. Navigate through individual serial numbers using the "Next Serial Number" button or the space bar.  
 4. Follow on-screen messages for progress and errors.  
+5. Run with `--simulate` to drive the simulated AS400 from `as400_simulator.py` instead of the real window.  
+6. Run with `--tn5250 HOST[:PORT]` to talk to the AS400 over TN5250 (`tn5250.py`) instead of the real window.  
+   Add `--user USER` to sign on, the password is taken from `AS400_PASSWORD` or asked for.  
+7. Run with `--batch FILE` (or `--batch -` for stdin) to process a list of RMAs unattended without the GUI.
+   Add `--sessions N` (with `--simulate` or `--tn5250`) to spread the RMAs over N AS400 sessions.  
+8. The time spent in every stage of an RMA (p50/p95/max) is shown at the end of the RMA and appended as a JSON line
+   to `~/RmaReceiving/stage_timings.jsonl`.  
+9. Day file lines and folders are spooled locally (`~/RmaReceiving/share_spool.sqlite3`) and written to the share in
+   the background, receiving carries on while `\\panther` is unreachable. The GUI shows how many writes are waiting.  
+10. An RMA that was interrupted (crash, lost session, Quit) resumes at its first serial not done when it is started
+    again, the serials are checkpointed in `~/RmaReceiving/rma_checkpoints.sqlite3`.  
+11. Serials received before (on any day, by any station) are flagged in the information box before they are opened on
+    the AS400, press Next again to receive them anyway.  
+12. Run with `--share-root FOLDER` to use another folder than `\\\\panther\\RMA\\RMA_Repairs` (`benchmark.py` uses a temporary one).  
+13. Run the tests with `python -m pytest` (they drive `as400_simulator.py` and the TN5250 test server in `tests/`).  
 
 Developed in collaboration with:  
 - Majority of the AccessAS400 class functionality written by Deivy Munoz.  
@@ -48,127 +82,1966 @@ Developed in collaboration with:
 """
 
 
+SERIAL_PATTERN = re.compile(r'\b\d{10}\b')  # Serial numbers on the FA02 list are 10 digits
+SHARE_ROOT = r"\\panther\RMA\RMA_Repairs"  # RMAs_Received, RMA_Received_Pictures and RMA_Damage are under it
+LOCAL_DIR = os.path.join(os.path.expanduser("~"), "RmaReceiving")  # Spool, ledger and timings kept on this PC
+
+pa = None        # pyautogui, imported by load_automation() the first time the AS400 window is needed
+win32gui = None  # pywin32's win32gui, imported with it
+automationLock = threading.Lock()
+
+
+def load_automation():
+    """
+    Imports pyautogui and win32gui the first time the AS400 window is driven. pyautogui pulls in its screenshot and
+    image stack, so they are not imported with the program and the window shows up without waiting for them. The GUI
+    starts loading them in the background as soon as its window is up.
+
+    Returns:
+        bool: True if both are available (only on a Windows desktop)
+    """
+    global pa, win32gui
+    with automationLock:
+        if pa is None or win32gui is None:
+            try:
+                import pyautogui
+                import win32gui as windows
+            except ImportError:  # Not on a Windows desktop, only the simulated terminal can be used
+                return False
+            pa, win32gui = pyautogui, windows
+        return True
+
+
 class AccessAS400:  # Majority written by Deivy Munoz
     """
-    Class to identify the AS400 application window.
+    Class to identify the AS400 application window.
+    """
+
+    def as400_main_screen(self, data):
+        """
+        Checks whether the AS400 is in the main menu for Failure analysis.
+
+        Args:
+            data (str): The screen data that it takes in
+
+        Returns:
+            bool: `True` if the content contains "Failure Analysis Menu",
+                  otherwise `False`.
+        """
+        if "Failure Analysis Menu" in data:
+            return True 
+        else:
+            return False  
+
+class Win32WindowSystem(WindowSystem):
+    """
+    The real desktop, through win32gui.
+    """
+
+    def is_window(self, hwnd):
+        return bool(win32gui.IsWindow(hwnd))
+
+    def title(self, hwnd):
+        return win32gui.GetWindowText(hwnd)
+
+    def find(self, match):
+        found = []
+
+        def win_enum_handler(hwnd, ctx):
+            if win32gui.IsWindowVisible(hwnd) and match(win32gui.GetWindowText(hwnd)):
+                found.append(hwnd)
+                return False  # Stop enumerating
+            return True
+
+        try:
+            win32gui.EnumWindows(win_enum_handler, None)
+        except win32gui.error:
+            if not found:  # EnumWindows reports the early stop as an error
+                raise
+        return found[0] if found else None
+
+class WindowLocator:
+    """
+    Finds the AS400 window once and keeps its handle. On reuse the handle is only checked (still a window, title
+    still contains the marker), the windows are enumerated again only when that check fails.
+    """
+
+    def __init__(self, windows=None, marker="as400"):
+        """
+        Args:
+            windows (WindowSystem): The desktop to search, the real one (Win32WindowSystem) if not given
+            marker (str): Text the window title contains (case insensitive)
+
+        Returns: Nothing
+        """
+        self.windows = windows if windows is not None else Win32WindowSystem()
+        self.marker = marker.lower()
+        self.hwnd = None
+        self.lock = threading.Lock()
+
+    def matches(self, title):
+        return self.marker in title.lower()
+
+    def locate(self):
+        """
+        Returns:
+            int: The handle of the AS400 window
+
+        Raises:
+            RuntimeError: If there is no AS400 window
+        """
+        with self.lock:
+            hwnd = self.hwnd
+            if hwnd is not None and self.windows.is_window(hwnd) and self.matches(self.windows.title(hwnd)):
+                return hwnd
+
+            self.hwnd = self.windows.find(self.matches)
+            if self.hwnd is None:
+                raise RuntimeError("No AS400 window found, open the AS400 session first")
+            return self.hwnd
+
+    def invalidate(self):
+        """
+        Forgets the handle, the next locate() enumerates the windows again.
+        """
+        with self.lock:
+            self.hwnd = None
+
+class ScreenSource:
+    """
+    Where the text of the AS400 emulator's screen is read from.
+    """
+
+    ROWS = 24
+    COLS = 80
+
+    def read(self):
+        """
+        Returns:
+            str: The screen as a 24x80 grid, rows separated by newlines
+
+        Raises:
+            OSError: If the screen can't be read
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def grid(cls, text):
+        """
+        Pads or cuts screen text to exactly 24 rows of 80 characters.
+        """
+        rows = [row.rstrip("\r")[:cls.COLS].ljust(cls.COLS) for row in text.split("\n")[:cls.ROWS]]
+        rows += [" " * cls.COLS] * (cls.ROWS - len(rows))
+        return "\n".join(rows)
+
+class EhllapiScreenSource(ScreenSource):
+    """
+    Reads the emulator's presentation space directly through its EHLLAPI DLL (IBM Personal Communications and
+    compatible emulators): no keystrokes, no clipboard, a read takes microseconds.
+    """
+
+    DLLS = ("pcshll32.dll", "ehlapi32.dll")
+    CONNECT, DISCONNECT, COPY_PRESENTATION_SPACE = 1, 2, 5
+    COPIED = (0, 4, 5)  # Copied (4 = host busy, 5 = keyboard locked, the copy is still valid)
+
+    def __init__(self, session="A", dll=None):
+        """
+        Connects to the emulator session.
+
+        Args:
+            session (str): Short name of the emulator session (the letter in its title bar)
+            dll (str): Path of the EHLLAPI DLL, the usual ones are tried if not given
+
+        Returns: Nothing
+
+        Raises:
+            OSError: If there is no EHLLAPI DLL or the session can't be connected to
+        """
+        if not hasattr(ctypes, "WinDLL"):
+            raise OSError("EHLLAPI is only available on Windows")
+        library = None
+        for name in ((dll,) if dll else self.DLLS):
+            try:
+                library = ctypes.WinDLL(name)
+                break
+            except OSError:
+                continue
+        if library is None:
+            raise OSError("No EHLLAPI DLL found")
+        self.hllapi = library.hllapi
+        self.buffer = ctypes.create_string_buffer(self.ROWS * self.COLS)
+
+        rc = self.call(self.CONNECT, ctypes.create_string_buffer(session.encode("ascii")), 1)
+        if rc != 0:
+            raise OSError(f"EHLLAPI could not connect to session {session} (return code {rc})")
+
+    def call(self, function, data, length):
+        function, length, rc = ctypes.c_int(function), ctypes.c_int(length), ctypes.c_int(0)
+        self.hllapi(ctypes.byref(function), data, ctypes.byref(length), ctypes.byref(rc))
+        return rc.value
+
+    def read(self):
+        rc = self.call(self.COPY_PRESENTATION_SPACE, self.buffer, len(self.buffer))
+        if rc not in self.COPIED:
+            raise OSError(f"EHLLAPI could not copy the presentation space (return code {rc})")
+        text = self.buffer.raw.decode("cp1252", errors="replace")
+        text = "".join(char if char >= " " else " " for char in text)  # Field attributes show up as control bytes
+        return "\n".join(text[row * self.COLS:(row + 1) * self.COLS] for row in range(self.ROWS))
+
+    def close(self):
+        self.call(self.DISCONNECT, ctypes.create_string_buffer(1), 0)
+
+class ClipboardScreenSource(ScreenSource):
+    """
+    Reads the screen by selecting everything in the emulator window and copying it (ctrl+A, ctrl+C). Slow and it
+    goes through the operator's clipboard, so it is only the fallback when the emulator has no EHLLAPI. Whatever
+    the operator had copied is put back afterwards.
+
+    tkinter can only be used from the thread its root runs on, so a read from any other thread (the GUI's AS400
+    worker) is handed to that thread with `after` and waited for.
+    """
+
+    def __init__(self, root=None, timeout=10.0):
+        """
+        Args:
+            root (tk.Tk): The program's tkinter root (running on the main thread) to read the clipboard with, a
+                hidden one is created on this thread if not given
+            timeout (float): Seconds a read from another thread waits for the root's thread
+
+        Returns: Nothing
+        """
+        if root is None:
+            root = tk.Tk()
+            root.withdraw()
+            self.thread = threading.current_thread()
+        else:
+            self.thread = threading.main_thread()
+        self.root = root
+        self.timeout = timeout
+
+    def read(self):
+        if threading.current_thread() is self.thread:
+            return self.copy()
+
+        result = Future()
+
+        def copying():
+            try:
+                result.set_result(self.copy())
+            except Exception as e:
+                result.set_exception(e)
+
+        self.root.after(0, copying)
+        return result.result(self.timeout)  # TimeoutError (an OSError) if the root's thread is busy
+
+    def copy(self):
+        try:
+            saved = self.root.clipboard_get()
+        except tk.TclError:  # Nothing (or no text) copied
+            saved = None
+
+        pa.hotkey('ctrl', 'a')
+        pa.hotkey('ctrl', 'c')
+        text = self.root.clipboard_get()
+
+        if saved is not None:
+            self.root.clipboard_clear()
+            self.root.clipboard_append(saved)
+        return self.grid(text)
+
+class PyAutoGuiTerminal(AccessAS400, TerminalDriver):
+    """
+    Drives the real AS400 emulator window with pyautogui keystrokes. The screen is read straight from the
+    emulator through EHLLAPI when it can be, through the clipboard otherwise.
+    """
+
+    locator = WindowLocator()  # Shared by every terminal, the AS400 window is found once per program run
+    instance = None            # The terminal of the AS400 window, see shared()
+    instanceLock = threading.Lock()
+
+    @classmethod
+    def shared(cls, root=None):
+        """
+        Gets the one terminal of the AS400 window, creating it the first time. Every RMA uses the same terminal, so
+        the screen source (and the tkinter root of the clipboard fallback) is set up once per program run.
+
+        Args:
+            root (tk.Tk): The program's tkinter root for the clipboard fallback, only used the first time
+
+        Returns:
+            PyAutoGuiTerminal: The same instance for every call
+        """
+        with cls.instanceLock:
+            if cls.instance is None:
+                cls.instance = cls(root)
+            return cls.instance
+
+    def __init__(self, root=None, pause=0.02, aidPause=0.1, locator=None, screen=None):
+        """
+        Sets up the keyboard and the screen source.
+
+        Args:
+            root (tk.Tk): An existing tkinter root for the clipboard fallback, a hidden one is created if needed
+            pause (float): Seconds pyautogui waits after every call, only paces plain typing and cursor keys
+            aidPause (float): Seconds to wait after an attention key (Enter, Page Down, ...) before anything else is
+                sent, the emulator locks the keyboard until the host answers (pyautogui's own default pause)
+            locator (WindowLocator): Finds the AS400 window, the shared one if not given
+            screen (ScreenSource): Where the screen is read from, EHLLAPI (falling back to the clipboard) if not given
+
+        Returns: Nothing
+        """
+        if not load_automation():
+            raise RuntimeError("pyautogui and pywin32 are required to drive the AS400 window, use --simulate instead")
+        pa.PAUSE = pause
+        self.aidPause = aidPause
+
+        self.root = root
+        if screen is None:
+            try:
+                screen = EhllapiScreenSource()
+            except OSError:
+                screen = ClipboardScreenSource(root)
+        self.screen = screen
+        if locator is not None:
+            self.locator = locator
+
+    def focus(self):
+        try:
+            win32gui.SetForegroundWindow(self.locator.locate())
+        except win32gui.error:
+            # The window went away between the check and the call, find it again once
+            self.locator.invalidate()
+            win32gui.SetForegroundWindow(self.locator.locate())
+
+    def send_keys(self, *keys):
+        for key in keys:
+            pa.hotkey(key)
+            if key in Macro.AID_KEYS:
+                time.sleep(self.aidPause)
+
+    def type_text(self, text, interval=0.0):
+        pa.typewrite(text, interval=interval)
+
+    def send_input(self, events):
+        # Runs of plain text with the same interval are typed in one call and runs of cursor keys are pressed in one
+        # call, pyautogui pauses once per call instead of once per key. Only an attention key gets its own call, and
+        # its own pause while the host answers.
+        run, runKind = [], None
+        for event in events:
+            if event[0] == "text":
+                kind = ("text", event[2])
+            elif event[1] in Macro.AID_KEYS:
+                kind = None
+            else:
+                kind = ("keys",)
+            if run and kind != runKind:
+                self.send_run(run, runKind)
+                run = []
+            if kind is None:
+                self.send_keys(event[1])
+            else:
+                run.append(event[1])
+                runKind = kind
+        if run:
+            self.send_run(run, runKind)
+
+    def send_run(self, run, kind):
+        if kind[0] == "text":
+            self.type_text("".join(run), kind[1])
+        else:
+            pa.press(run)
+
+    def read_screen(self):
+        try:
+            return self.screen.read()
+        except OSError:
+            if isinstance(self.screen, ClipboardScreenSource):
+                raise
+            # The emulator stopped answering EHLLAPI (e.g. the session was restarted), use the clipboard from now on
+            self.screen = ClipboardScreenSource(self.root)
+            return self.screen.read()
+
+class SessionStats:
+    """
+    Durations of every stage (focus, keys, read screen, navigate, day file, folders, ...) and counters (keystrokes,
+    screen reads) of an RMA session. Stages are timed from any thread with timed() or the timed_stage decorator.
+    """
+
+    STATS_PATH = os.path.join(LOCAL_DIR, "stage_timings.jsonl")
+
+    def __init__(self):
+        self.times = {}     # Stage name -> list of durations in seconds
+        self.counters = {}  # Counter name -> count
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Context manager that adds how long the block took to the stage.
+
+        Args:
+            stage (str): Name of the stage (e.g. "navigate", "day file", "folders")
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.times.setdefault(stage, []).append(seconds)
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def merge(self, other):
+        """
+        Adds the durations and counters of another session (used to total a batch of RMAs).
+
+        Args:
+            other (SessionStats): The session to add
+        """
+        with self.lock:
+            for stage, times in other.times.items():
+                self.times.setdefault(stage, []).extend(times)
+            for counter, n in other.counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + n
+
+    @staticmethod
+    def percentile(ordered, p):
+        """
+        Nearest-rank percentile.
+
+        Args:
+            ordered (list): Sorted durations
+            p (float): Percentile between 0 and 100
+
+        Returns:
+            float: The duration at that percentile
+        """
+        rank = max(1, -(-len(ordered) * p // 100))  # ceil without floats
+        return ordered[int(rank) - 1]
+
+    def report(self):
+        """
+        Returns:
+            dict: Stage -> {"count", "total", "p50", "p95", "max"} in seconds, stages in the order they first ran
+        """
+        with self.lock:
+            stages = {stage: sorted(times) for stage, times in self.times.items() if times}
+        return {
+            stage: {
+                "count": len(times),
+                "total": sum(times),
+                "p50": self.percentile(times, 50),
+                "p95": self.percentile(times, 95),
+                "max": times[-1],
+            }
+            for stage, times in stages.items()
+        }
+
+    def table(self):
+        """
+        Returns:
+            str: The report as a text table, durations in milliseconds
+        """
+        lines = ["Stage           Count    Total (s)   p50 (ms)   p95 (ms)   Max (ms)"]
+        for stage, row in self.report().items():
+            lines.append(f"{stage:<15} {row['count']:>5} {row['total']:>12.3f} {1000 * row['p50']:>10.1f} "
+                         f"{1000 * row['p95']:>10.1f} {1000 * row['max']:>10.1f}")
+        for counter, n in self.counters.items():
+            lines.append(f"{counter}: {n}")
+        return "\n".join(lines)
+
+    def export(self, path=None, **fields):
+        """
+        Appends the report as one JSON line, so sessions can be compared over time.
+
+        Args:
+            path (str): The JSON lines file, STATS_PATH if not given
+            **fields: Extra fields of the line (e.g. rma, serials)
+
+        Returns:
+            dict: The record written
+        """
+        path = path if path is not None else self.STATS_PATH
+        record = {"finished_at": datetime.now().isoformat(timespec="seconds"), **fields,
+                  "counters": dict(self.counters), "stages": self.report()}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+
+def timed_stage(stage):
+    """
+    Decorator that times every call of a ProcessRMA method as a stage of the RMA's SessionStats.
+
+    Args:
+        stage (str): Name of the stage
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timed(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedTerminal(TerminalDriver):
+    """
+    Wraps a terminal to time focusing the window, the key sequences and the screen reads, and to count
+    keystrokes and screen reads, in a SessionStats.
+    """
+
+    def __init__(self, terminal, stats):
+        """
+        Args:
+            terminal (TerminalDriver): The terminal to wrap
+            stats (SessionStats): Where the times and counts go
+
+        Returns: Nothing
+        """
+        self.inner = terminal
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    @property
+    def supports_fields(self):
+        return self.inner.supports_fields
+
+    @property
+    def owns_screen(self):
+        return self.inner.owns_screen
+
+    def focus(self):
+        with self.stats.timed("focus"):
+            self.inner.focus()
+
+    def send_keys(self, *keys):
+        self.stats.count("keystrokes", len(keys))
+        with self.stats.timed("keys"):
+            self.inner.send_keys(*keys)
+
+    def type_text(self, text, interval=0.0):
+        self.stats.count("keystrokes", len(text))
+        with self.stats.timed("keys"):
+            self.inner.type_text(text, interval)
+
+    def send_input(self, events):
+        self.stats.count("keystrokes", sum(1 if event[0] == "key" else len(event[1]) for event in events))
+        with self.stats.timed("keys"):
+            self.inner.send_input(events)
+
+    def write_field(self, row, col, text):
+        self.stats.count("field writes")
+        with self.stats.timed("keys"):
+            self.inner.write_field(row, col, text)
+
+    def read_screen(self):
+        self.stats.count("screen reads")
+        with self.stats.timed("read screen"):
+            return self.inner.read_screen()
+
+    def wait_for_screen(self, predicate, timeout=10.0):
+        with self.stats.timed("wait screen"):
+            return TerminalDriver.wait_for_screen(self, predicate, timeout)
+
+class Key:
+    """
+    Keys to press in a macro, by pyautogui key name.
+    """
+
+    def __init__(self, *names):
+        self.names = names
+
+class Text:
+    """
+    Text to type where the cursor is in a macro. `{name}` placeholders are filled in when the macro runs.
+    """
+
+    def __init__(self, text, interval=0.0):
+        self.text = text
+        self.interval = interval
+
+class FieldInput:
+    """
+    Text for an input field in a macro. Terminals that can address fields get it written straight into the field,
+    the others walk the cursor there with `walk`, erase the rest of the field if `erase` and type it.
+    """
+
+    def __init__(self, row, col, text, walk=(), offset=0, erase=False):
+        """
+        Args:
+            row (int): Row of the first character of the field (0 based)
+            col (int): Column of the first character of the field (0 based)
+            text (str): The text, can have `{name}` placeholders
+            walk (tuple): Keys that move the cursor from where the previous input left it to the text's position
+            offset (int): Position of the text inside the field (the walk ends that many characters in)
+            erase (bool): Erase the field from that position on before typing
+
+        Returns: Nothing
+        """
+        self.row = row
+        self.col = col
+        self.text = text
+        self.walk = walk
+        self.offset = offset
+        self.erase = erase
+
+class Macro:
+    """
+    One navigation step on the AS400: the input for a screen, sent as a single burst, then optionally the screen to
+    wait for. Compiled once into the fewest input events for both kinds of terminals (fields written directly, or
+    cursor walking), the placeholders are filled in when it runs.
+
+    A step ends with at most one attention key (Enter, Page Down, ...). The host locks the keyboard until it has
+    answered an attention key and drops whatever is typed meanwhile, so navigation that needs several of them is a
+    MacroSequence of steps that each wait for their screen.
+    """
+
+    OPPOSITE = {"down": "up", "up": "down", "right": "left", "left": "right"}
+    AID_KEYS = {"return", "enter", "pagedown", "pageup", "f3", "f12"}
+
+    def __init__(self, *parts, until=None):
+        """
+        Args:
+            *parts (Key, Text or FieldInput): The input, in order
+            until (str, tuple or callable): Screen to wait for afterwards, see TerminalDriver.wait_for_screen.
+                A str can have `{name}` placeholders, a callable is called with the screen and the macro's values.
+
+        Returns: Nothing
+
+        Raises:
+            ValueError: If an attention key is anywhere but at the end of the step
+        """
+        self.parts = parts
+        self.until = until
+        self.direct = self.compile(True)
+        self.walking = self.compile(False)
+        aids = [i for i, event in enumerate(self.walking) if event[0] == "key" and event[1] in self.AID_KEYS]
+        if aids and aids != [len(self.walking) - 1]:
+            raise ValueError("A macro step can only end with an attention key, split it into a MacroSequence")
+
+    def compile(self, direct):
+        """
+        Turns the parts into input events: ("key", name), ("text", text, interval) and, if `direct`,
+        ("field", row, col, text). Adjacent texts are merged and a cursor move straight followed by its opposite
+        is dropped.
+
+        Returns:
+            list: The events
+        """
+        events = []
+        for part in self.parts:
+            if isinstance(part, Key):
+                events.extend(("key", name) for name in part.names)
+            elif isinstance(part, Text):
+                events.append(("text", part.text, part.interval))
+            elif direct:
+                events.append(("field", part.row, part.col, " " * part.offset + part.text))
+            else:
+                events.extend(("key", name) for name in part.walk)
+                if part.erase:
+                    events.append(("key", "end"))
+                if part.text:
+                    events.append(("text", part.text, 0.0))
+
+        compiled = []
+        for event in events:
+            previous = compiled[-1] if compiled else None
+            if previous and previous[0] == "text" and event[0] == "text" and previous[2] == event[2]:
+                compiled[-1] = ("text", previous[1] + event[1], event[2])
+            elif previous and previous[0] == "key" and event[0] == "key" and self.OPPOSITE.get(event[1]) == previous[1]:
+                compiled.pop()
+            else:
+                compiled.append(event)
+        return compiled
+
+    def run(self, terminal, **values):
+        """
+        Sends the macro to a terminal and waits for the `until` screen.
+
+        Args:
+            terminal (TerminalDriver): The terminal
+            **values: Values for the placeholders
+
+        Returns:
+            str: The screen that was waited for, None if the macro has no `until`
+        """
+        events = self.direct if terminal.supports_fields else self.walking
+        if events and events[0][0] == "field":
+            try:
+                terminal.write_field(events[0][1], events[0][2], events[0][3].format(**values))
+                events = events[1:]
+            except ValueError:
+                events = self.walking  # The screen layout is not the one expected, walk the cursor instead
+
+        burst = []
+        for event in events:
+            if event[0] == "field":
+                if burst:
+                    terminal.send_input(burst)
+                    burst = []
+                terminal.write_field(event[1], event[2], event[3].format(**values))
+            elif event[0] == "key":
+                burst.append(event)
+            else:
+                burst.append(("text", event[1].format(**values), event[2]))
+        if burst:
+            terminal.send_input(burst)
+
+        if self.until is None:
+            return None
+        if isinstance(self.until, str):
+            until = self.until.format(**values)
+        elif callable(self.until):
+            until = functools.partial(self.until, **values)
+        else:
+            until = self.until
+        return terminal.wait_for_screen(until)
+
+class MacroSequence:
+    """
+    Navigation that takes several attention keys: every step is a Macro ending in one attention key, and the next
+    step is only sent once the screen the previous one waits for is shown.
+    """
+
+    def __init__(self, *steps):
+        """
+        Args:
+            *steps (Macro): The steps, in order
+
+        Returns: Nothing
+        """
+        self.steps = steps
+
+    def run(self, terminal, **values):
+        """
+        Runs every step, see Macro.run().
+
+        Returns:
+            str: The screen the last step waited for
+        """
+        screen = None
+        for step in self.steps:
+            screen = step.run(terminal, **values)
+        return screen
+
+def list_ready(screen, **values):
+    """
+    The FA02 serial list is shown and the host has taken the last command: the "Position to/command" field, where
+    the command was typed, is empty again.
+    """
+    for line in screen.split("\n"):
+        if "Position to/command" in line:
+            return not line.split("===>", 1)[-1].strip()
+    return False
+
+def list_positioned(screen, serial, **values):
+    """
+    The FA02 serial list is positioned on the serial: the command is taken and the serial is on the first row under
+    the column headings (not merely echoed in the command field).
+    """
+    if not list_ready(screen):
+        return False
+    lines = screen.split("\n")
+    for i, line in enumerate(lines[:-1]):
+        if line.lstrip().startswith("Opt") and "Serial" in line:
+            return serial in lines[i + 1]
+    return False
+
+# Every key sequence the program sends to the AS400, by step
+MACROS = {
+    # Failure Analysis Menu: option 02 opens FA02
+    "open_fa02": Macro(Text("02"), Key("return"),
+                       until=lambda screen: "Failure Analysis Menu" not in screen.split("\n")[0]),
+    # Leave the serial list or the RMA search for the menu
+    "exit": Macro(Key("f3"), until=lambda screen, **values: "Failure Analysis Menu" in screen.split("\n")[0]),
+    # Leave a serial without saving it, back to the list
+    "cancel_serial": Macro(Key("f12"), until=list_ready),
+
+    # FA02 search: inquire (I), clear the user so every RMA is found, the RMA number
+    "search_rma": Macro(FieldInput(4, 30, "I"),
+                        FieldInput(7, 30, "", walk=("down", "down"), erase=True),
+                        FieldInput(6, 30, "{rma}", walk=("up",)),
+                        Key("return")),
+    "next_page": Macro(Key("pagedown")),
+
+    # Save the open serial (if any), refresh the list and position it on the serial
+    "position_serial": MacroSequence(Macro(Key("return"), until=list_ready),
+                                     Macro(Text("p"), Key("return"), until=list_ready),
+                                     Macro(Text("r"), Key("return"), until=list_ready),
+                                     Macro(Text("I"), Text("{serial}", interval=0.01), Key("return"),
+                                           until=list_positioned)),
+    # Select the serial for failure analysis processing
+    "select_serial": Macro(Text("s"), Key("down", "down", "down"), Text("s"), Key("return")),
+    "answer_ok": Macro(Text("OK")),
+
+    # Failure analysis processing screen: the date goes in the "Other:" field
+    "enter_date": Macro(FieldInput(10, 8, "{date}", walk=("down",) * 4 + ("right",) * 4, offset=4)),
+    "delete_date": Macro(FieldInput(10, 8, "", walk=("down",) * 4 + ("right",) * 4, offset=4, erase=True),
+                         Key("return")),
+
+    # Save the last serial and go back to the Failure Analysis Menu
+    "finish": MacroSequence(Macro(Key("return"), until=list_ready),
+                            Macro(Text("p"), Key("return"), until=list_ready),
+                            Macro(Text("r"), Key("return"), until=list_ready),
+                            Macro(Text("e"), Key("return"), until="Failure Analysis Menu")),
+}
+
+class Missing:
+    """
+    Value of a template field that is not on the screen. It is falsy, so `if record.partNum:` reads naturally.
+    """
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "MISSING"
+
+MISSING = Missing()
+
+class ScreenRecord:
+    """
+    The fields a ScreenTemplate read from a screen, as attributes. Fields that are not on the screen are MISSING.
+    """
+
+    def __init__(self, screen, valid, values):
+        """
+        Args:
+            screen (str): Name of the screen the template is for
+            valid (bool): Whether the screen is that screen (every marker of the template is on it) and every field
+                was found on it
+            values (dict): Field name -> value (converted) or MISSING
+
+        Returns: Nothing
+        """
+        self.screen = screen
+        self.valid = valid
+        self.values = values
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["values"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def missing(self):
+        """
+        Returns:
+            list: Names of the fields that are not on the screen
+        """
+        return [name for name, value in self.values.items() if value is MISSING]
+
+    def __repr__(self):
+        return f"ScreenRecord({self.screen!r}, valid={self.valid}, {self.values})"
+
+class ScreenTemplate:
+    """
+    Describes where the fields of one AS400 screen are. The fields are named groups in regular expressions anchored
+    on their labels, fields next to each other on a row share one expression. The expressions are compiled once into
+    a single pattern, so all of the fields are read in one pass over the screen. Values may contain single spaces.
+    """
+
+    def __init__(self, screen, markers, patterns, converters=None):
+        """
+        Args:
+            screen (str): Name of the screen, used in error messages
+            markers (tuple): Text that is on this screen, all of it, and tells it apart from the other screens
+            patterns (tuple): Regular expressions, each with one or more groups named after fields
+            converters (dict): Field name -> function turning the text found into the field's value
+
+        Returns: Nothing
+        """
+        self.screen = screen
+        self.markers = markers
+        self.converters = converters or {}
+        self.pattern = re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.MULTILINE)
+        self.fields = list(self.pattern.groupindex)
+
+    def extract(self, text):
+        """
+        Reads every field from the screen text.
+
+        Args:
+            text (str): The screen
+
+        Returns:
+            ScreenRecord: The fields, MISSING for the ones not found, and whether this is the right screen with all
+            of its fields
+        """
+        found = {}
+        for match in self.pattern.finditer(text):
+            for name, value in match.groupdict().items():
+                if value is not None and name not in found:
+                    found[name] = value.strip()
+
+        values = {}
+        for name in self.fields:
+            if name not in found:
+                values[name] = MISSING
+            else:
+                convert = self.converters.get(name)
+                values[name] = convert(found[name]) if convert else found[name]
+        valid = all(marker in text for marker in self.markers) and MISSING not in values.values()
+        return ScreenRecord(self.screen, valid, values)
+
+# Failure Analysis Menu: " FAM01  RECEIVER  Failure Analysis Menu  08/27/25  10:00:00" on the first row
+MENU_SCREEN = ScreenTemplate("Failure Analysis Menu", ("Failure Analysis Menu",), (
+    r"^ *\S+ +(?P<receiver>\S+) +Failure Analysis Menu +(?P<date>\S+)",
+))
+
+# FA02 serial list: "Note :  ASMITH" (or the date the RMA was opened when it is not assigned)
+LIST_SCREEN = ScreenTemplate("FA02 serial list", ("Note",), (
+    r"Note *: *(?P<note>\S+)",
+))
+
+# Failure Analysis Processing: "RMA# RMA100000 Repair   SLA : Y", "Part Number : 61-0000-000", "Other: <date>"
+SERIAL_SCREEN = ScreenTemplate("Failure Analysis Processing", ("RMA#", "Other:"), (
+    r"RMA# +(?P<rma>\S+) +(?P<returnType>\S+(?: \S+)*)",
+    r"SLA *: *(?P<sla>\S+)",
+    r"Part Number *: *(?P<partNum>\S+)",
+    r"Other:(?P<other>[^\n]*)",
+), converters={"sla": lambda value: value == "Y"})
+
+class ScreenSnapshot:
+    """
+    A single capture of the AS400 screen. The fields of a screen are read from it with a ScreenTemplate, once per
+    template, so all of the fields on one screen come from a single read.
+    """
+
+    def __init__(self, text):
+        """
+        Args:
+            text (str): The screen content as read from the AS400
+
+        Returns: Nothing
+        """
+        self.text = text
+        self.records = {}  # Template -> ScreenRecord
+
+    @property
+    def tokens(self):
+        return [s for s in self.text.split(" ") if s != ""]  # Same tokens screenCopy() has always returned
+
+    def __contains__(self, marker):
+        """
+        Allows `"Bottom" in snapshot` style checks against the raw screen text.
+        """
+        return marker in self.text
+
+    def record(self, template):
+        """
+        Reads the fields of a screen template from this capture.
+
+        Args:
+            template (ScreenTemplate): The template of the screen expected
+
+        Returns:
+            ScreenRecord: The fields, see ScreenTemplate.extract()
+        """
+        if template not in self.records:
+            self.records[template] = template.extract(self.text)
+        return self.records[template]
+
+class FolderIndex:
+    """
+    In-memory index of the folder names in the share directories searched by `FolderProvisioner.find_existing_folder`.
+
+    Each directory is enumerated once with `os.scandir` and kept as a sorted list, so a prefix lookup is a binary
+    search instead of a listdir plus an isdir per entry over SMB. Folders this program creates are added to the
+    index directly. After `ttl` seconds the directory's modification time is checked (one stat) and the directory
+    is enumerated again only if it changed, which picks up folders created by other stations.
+    """
+
+    def __init__(self, ttl=60.0):
+        """
+        Args:
+            ttl (float): Seconds an index is trusted before its directory's modification time is checked again
+
+        Returns: Nothing
+        """
+        self.ttl = ttl
+        self.dirs = {}  # Directory -> [sorted folder names, modification time, time checked]
+        self.lock = threading.Lock()
+
+    def scan(self, parent):
+        """
+        Enumerates the folders in a directory.
+
+        Returns:
+            list: [sorted folder names, modification time, time checked]
+        """
+        try:
+            mtime = os.stat(parent).st_mtime
+            with os.scandir(parent) as entries:
+                names = sorted(entry.name for entry in entries if entry.is_dir())
+        except FileNotFoundError:
+            mtime, names = None, []
+        return [names, mtime, time.monotonic()]
+
+    def names(self, parent):
+        """
+        Returns:
+            list: The sorted folder names in the directory, from the index when it is still current
+        """
+        with self.lock:
+            entry = self.dirs.get(parent)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                try:
+                    mtime = os.stat(parent).st_mtime
+                except FileNotFoundError:
+                    mtime = None
+                if mtime != entry[1]:
+                    entry = None  # Changed by someone else, enumerate again
+                else:
+                    entry[2] = time.monotonic()
+            if entry is None:
+                entry = self.dirs[parent] = self.scan(parent)
+            return entry[0]
+
+    def find(self, parent, prefix):
+        """
+        Gets every folder in the directory whose name starts with the prefix.
+
+        Returns:
+            list: The matching folder names
+        """
+        names = self.names(parent)
+        matches = []
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            matches.append(names[i])
+            i += 1
+        return matches
+
+    def add(self, parent, name):
+        """
+        Adds a folder this program created to the index of its directory.
+        """
+        with self.lock:
+            entry = self.dirs.get(parent)
+            if entry is None:
+                return  # Not indexed yet, it will be found when the directory is enumerated
+            i = bisect.bisect_left(entry[0], name)
+            if i == len(entry[0]) or entry[0][i] != name:
+                entry[0].insert(i, name)
+
+
+class FolderProvisioner:
+    """
+    Creates the three-level folder of an RMA (e.g. RMA12xxxx\\RMA123xxx\\RMA123456) under any number of roots
+    (RMA_Received_Pictures, RMA_Damage, ...).
+
+    The path of an RMA under a root is resolved and created once, then kept in an LRU keyed by (root, RMA), so the
+    other serials of the RMA (and the next RMAs of the same range) don't go to the share at all. The roots of one
+    call are provisioned at the same time on a small thread pool. Serials asking for an RMA that is still being
+    provisioned wait for that same work instead of starting it again.
+    """
+
+    def __init__(self, index=None, maxEntries=256, workers=4):
+        """
+        Args:
+            index (FolderIndex): Index of the folder names on the share, a new one if not given
+            maxEntries (int): Number of (root, RMA) paths kept, the least recently used one is dropped after that
+            workers (int): Number of roots provisioned at the same time
+
+        Returns: Nothing
+        """
+        self.index = index if index is not None else FolderIndex()
+        self.maxEntries = maxEntries
+        self.paths = OrderedDict()  # (root, RMA) -> Future of the RMA's folder path, least recently used first
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="provision")
+
+    def find_existing_folder(self, parent, folder_prefix, total_length): #Function written with Jezu Mario Palackal Stanley
+        """
+        Searches for an existing folder in the specified parent directory whose name starts with a given prefix.
+        If no such folder exists, it generates a default folder name using the prefix filled with additional 'x' characters 
+        to match the required total length. The folder names come from the FolderIndex instead of listing the
+        directory every time.
+
+        Args:
+            parent (str): Path to the parent directory where the folders are located.
+            folder_prefix (str): The prefix of the folder to search for.
+            total_length (int): The total length of the desired folder name (including the prefix).
+
+        Returns:
+            tuple: (name of the matching folder, True) if found, or (a generated folder name based on the prefix,
+                False) if no match exists.
+        """
+        candidates = self.index.find(parent, folder_prefix)
+
+        if candidates:
+            match = min(candidates, key=len)
+            return match, True
+        return folder_prefix + ('x' * (total_length - len(folder_prefix))), False
+
+    def create(self, root, RMA):
+        """
+        Resolves the RMA's folder under the root and creates whatever part of it is missing.
+
+        Args:
+            root (str): The folder the three levels go under
+            RMA (str): The RMA number
+
+        Returns:
+            str: Path to the third-level folder of the RMA
+        """
+        first_folder, found = self.find_existing_folder(root, RMA[:5], 9)
+        first_path = os.path.join(root, first_folder)
+
+        if found:
+            second_folder, found = self.find_existing_folder(first_path, RMA[:6], 9)
+        else:
+            second_folder = RMA[:6] + 'xxx'  # A new first level folder has nothing in it to look for
+        second_path = os.path.join(first_path, second_folder)
+        third_path = os.path.join(second_path, RMA)
+
+        # One call creates every missing level, and does nothing but fail its mkdir when all of them exist
+        os.makedirs(third_path, exist_ok=True)
+        self.index.add(root, first_folder)
+        self.index.add(first_path, second_folder)
+        return third_path
+
+    def provision(self, RMA, *roots):
+        """
+        Gets the RMA's folder under every root, creating the ones that are not in the LRU yet.
+
+        Args:
+            RMA (str): The RMA number
+            roots (str): The folders the RMA's folder should exist under
+
+        Returns:
+            list: Path to the RMA's third-level folder under each root, in the order of the roots
+
+        Raises:
+            ValueError: If the RMA number is not in the expected format (e.g., does not start with 'RMA' and does not
+            have at least six digits following 'RMA').
+        """
+        if not (RMA.startswith('RMA') and len(RMA) >= 9 and RMA[3:].isdigit()):
+            raise ValueError("RMA code must start with 'RMA' and have at least 6 digits after RMA")
+
+        futures = []
+        started = []
+        with self.lock:
+            for root in roots:
+                key = (root, RMA)
+                future = self.paths.get(key)
+                if future is None:
+                    future = self.paths[key] = self.pool.submit(self.create, root, RMA)
+                    started.append((key, future))
+                    while len(self.paths) > self.maxEntries:
+                        self.paths.popitem(last=False)
+                else:
+                    self.paths.move_to_end(key)
+                futures.append(future)
+        # Outside the lock: a future that already failed calls forget_failed() right here, which takes the lock
+        for key, future in started:
+            future.add_done_callback(functools.partial(self.forget_failed, key))
+        return [future.result() for future in futures]
+
+    def forget_failed(self, key, future):
+        """
+        Drops a failed provisioning from the LRU so the next serial tries again.
+        """
+        if future.exception() is not None:
+            with self.lock:
+                if self.paths.get(key) is future:
+                    del self.paths[key]
+
+class ShareSpool:
+    """
+    Local write-behind spool for everything that goes to the share: the day file lines of `trackRMA` and the RMA
+    folders of `createFolders`.
+
+    Each record is committed to a SQLite file on the local disk first, so receiving carries on at local disk speed and
+    a crash of the program can't lose it. A background replayer writes the records to the share in the order they were made: the
+    lines are appended with one open/write/fsync/close per day file and the folders are created by the provisioner.
+    It waits until `maxLines` records are waiting or the oldest one is `maxSeconds` old, or until drain() is called,
+    so the share gets a few large writes instead of one per serial.
+
+    When the share can't be reached the spool goes offline. The records stay on the local disk and the replayer tries
+    again after 1, 2, 4... up to `maxBackoff` seconds, starting from the oldest record. Listeners are called with
+    (depth, online) whenever the number of waiting records or the state changes.
+    """
+
+    instances = {}  # Spool path -> ShareSpool, one replayer per spool file
+    instancesLock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path, provision=None):
+        """
+        Gets the spool of a file, opening it (and starting its replayer) the first time.
+
+        Args:
+            path (str): Path of the spool's SQLite file
+            provision (callable): provision(RMA, *roots) creates the folders of an RMA, see FolderProvisioner
+
+        Returns:
+            ShareSpool: The same instance for every call with the same path
+        """
+        with cls.instancesLock:
+            spool = cls.instances.get(path)
+            if spool is None:
+                spool = cls.instances[path] = cls(path, provision)
+            return spool
+
+    def __init__(self, path, provision=None, maxLines=50, maxSeconds=5.0, maxBackoff=60.0):
+        """
+        Opens (and creates if needed) the spool and starts the replayer, which first writes out whatever an earlier
+        run left in the spool.
+
+        Args:
+            path (str): Path of the spool's SQLite file
+            provision (callable): provision(RMA, *roots) creates the folders of an RMA, see FolderProvisioner
+            maxLines (int): Replay once this many records are waiting
+            maxSeconds (float): Replay once the oldest waiting record is this many seconds old
+            maxBackoff (float): Longest wait in seconds between two attempts while the share is unreachable
+
+        Returns: Nothing
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.provision = provision
+        self.maxLines = maxLines
+        self.maxSeconds = maxSeconds
+        self.maxBackoff = maxBackoff
+        self.dayFolders = set()  # Day file folders known to exist on the share
+        self.listeners = []      # Called with (depth, online) when either changes
+        self.condition = threading.Condition()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # Survives a crash of the program, like the ledger
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, "
+                "target TEXT NOT NULL, data TEXT NOT NULL)")
+
+        self.depth = self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        self.oldest = time.monotonic() if self.depth else None  # When the oldest waiting record was made
+        self.online = True
+        self.backoff = 0.0
+        self.retryAt = 0.0
+        self.drainRequests = 0
+        self.closed = False
+        self.replayer = threading.Thread(target=self.run, name="share-spool", daemon=True)
+        self.replayer.start()
+
+    def record(self, kind, target, data):
+        """
+        Commits a record to the local spool for the replayer.
+
+        Args:
+            kind (str): "line" or "folders"
+            target (str): The day file of a line, the RMA of a folder record
+            data (str): The line, or the folder roots as a JSON list
+        """
+        with self.condition:
+            with self.connection:
+                self.connection.execute("INSERT INTO records (kind, target, data) VALUES (?, ?, ?)", (kind, target, data))
+            self.depth += 1
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            self.condition.notify_all()
+        self.notifyListeners()
+
+    def write(self, dayFile, line):
+        """
+        Spools a line to be appended to a day file.
+
+        Args:
+            dayFile (str): Path of the day file on the share
+            line (str): The line, including the newline
+        """
+        self.record("line", dayFile, line)
+
+    def folders(self, RMA, roots):
+        """
+        Spools the folders of an RMA to be created under the roots.
+
+        Args:
+            RMA (str): The RMA number
+            roots (list): The folders the RMA's folder should exist under
+        """
+        self.record("folders", RMA, json.dumps(list(roots)))
+
+    def markOffline(self):
+        """
+        Puts the spool offline after a share call outside the spool failed, so the next records don't wait for the
+        share. The replayer finds out when it is back.
+        """
+        with self.condition:
+            if self.online:
+                self.online = False
+                self.backoff = 1.0
+                self.retryAt = time.monotonic() + self.backoff
+        self.notifyListeners()
+
+    def notifyListeners(self):
+        depth, online = self.depth, self.online
+        for listener in list(self.listeners):
+            listener(depth, online)
+
+    def drain(self, timeout=None):
+        """
+        Asks the replayer to write every waiting record now and waits for it. Returns straight away when the share
+        is unreachable, the records stay in the spool until it is back.
+
+        Args:
+            timeout (float): Seconds to wait at most, no limit if not given
+
+        Returns:
+            bool: True if nothing is waiting anymore
+        """
+        with self.condition:
+            if self.depth and self.online:
+                self.drainRequests += 1
+                self.condition.notify_all()
+                self.condition.wait_for(lambda: not self.depth or not self.online or self.closed, timeout)
+                self.drainRequests -= 1
+            return not self.depth
+
+    def close(self):
+        """
+        Stops the replayer and closes the spool file. The records still waiting are replayed the next time it is
+        opened.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.replayer.join()
+        self.connection.close()
+        with self.instancesLock:
+            if self.instances.get(self.path) is self:
+                del self.instances[self.path]
+
+    def run(self):
+        """
+        The replayer: waits until records are due (see the class description) and writes them to the share.
+        """
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    now = time.monotonic()
+                    timeout = None
+                    if self.depth:
+                        due = self.oldest + self.maxSeconds
+                        if now < self.retryAt:
+                            timeout = self.retryAt - now
+                        elif self.drainRequests or self.depth >= self.maxLines or now >= due or not self.online:
+                            break
+                        else:
+                            timeout = due - now
+                    self.condition.wait(timeout)
+                rows = self.connection.execute("SELECT id, kind, target, data FROM records ORDER BY id LIMIT 1000").fetchall()
+            self.replay(rows)
+
+    def replay(self, rows):
+        """
+        Writes records to the share in order, stopping at the first one the share refuses, then removes the
+        records that were written from the spool.
+
+        Args:
+            rows (list): (id, kind, target, data) of the records, oldest first
+        """
+        done = []
+        failed = False
+        i = 0
+        try:
+            while i < len(rows):
+                if rows[i][1] == "line":
+                    # A run of lines is appended with one open per day file, the lines of a file keep their order
+                    byFile = {}
+                    while i < len(rows) and rows[i][1] == "line":
+                        byFile.setdefault(rows[i][2], []).append(rows[i])
+                        i += 1
+                    for dayFile, records in byFile.items():
+                        self.append(dayFile, [data for _, _, _, data in records])
+                        done.extend(id for id, _, _, _ in records)
+                else:
+                    id, _, RMA, roots = rows[i]
+                    try:
+                        self.provision(RMA, *json.loads(roots))
+                    except ValueError:
+                        pass  # A malformed RMA number can never be created, don't hold the rest of the spool up
+                    done.append(id)
+                    i += 1
+        except OSError:
+            failed = True
+
+        with self.condition:
+            if done:
+                with self.connection:
+                    self.connection.executemany("DELETE FROM records WHERE id = ?", [(id,) for id in done])
+                self.depth -= len(done)
+            if failed:
+                self.online = False
+                self.backoff = min(max(1.0, self.backoff * 2), self.maxBackoff)
+                self.retryAt = time.monotonic() + self.backoff
+            else:
+                self.online = True
+                self.backoff = 0.0
+                self.retryAt = 0.0
+            if not self.depth:
+                self.oldest = None
+            self.condition.notify_all()
+        self.notifyListeners()
+
+    def append(self, dayFile, lines):
+        """
+        Appends lines to a day file and fsyncs it.
+        """
+        folder = os.path.dirname(dayFile)
+        if folder not in self.dayFolders:
+            os.makedirs(folder, exist_ok=True)
+            self.dayFolders.add(folder)
+        with open(dayFile, "a") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+class ReceivingLedger:
+    """
+    Structured, append-only record of every serial received, kept next to the free-text day files.
+
+    The ledger is a SQLite database in WAL mode with an index on every column a report looks things up by, so
+    questions like "when was serial X received" are an index lookup instead of a scan of every day file. Receipts are
+    buffered and inserted `batchSize` at a time in one transaction.
+
+    SQLite's WAL mode does not work on a network share, so the ledger is kept on the local disk of the station.
+    """
+
+    COLUMNS = ["received_at", "as400_date", "rma", "serial", "part_number", "return_type", "sla", "assigned_to",
+               "receiver", "damaged"]
+
+    def __init__(self, path=None, batchSize=50):
+        """
+        Opens (and creates if needed) the ledger.
+
+        Args:
+            path (str): Path of the SQLite file, ~/RmaReceiving/receiving_ledger.sqlite3 if not given
+            batchSize (int): Number of receipts inserted per transaction
+
+        Returns: Nothing
+        """
+        if path is None:
+            path = os.path.join(LOCAL_DIR, "receiving_ledger.sqlite3")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.batchSize = batchSize
+        self.buffer = []
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS receipts ("
+                "id INTEGER PRIMARY KEY, received_at TEXT NOT NULL, as400_date TEXT, rma TEXT NOT NULL, "
+                "serial TEXT NOT NULL, part_number TEXT, return_type TEXT, sla TEXT, assigned_to TEXT, "
+                "receiver TEXT, damaged INTEGER NOT NULL DEFAULT 0)"
+            )
+            for column in ("rma", "serial", "part_number", "return_type", "sla", "assigned_to", "receiver",
+                           "received_at", "damaged"):
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS receipts_{column} ON receipts ({column})")
+
+    def record(self, **receipt):
+        """
+        Adds a receipt. Missing columns are stored as NULL and received_at defaults to now.
+
+        Args:
+            **receipt: Column name -> value, see `ReceivingLedger.COLUMNS`
+        """
+        receipt.setdefault("received_at", datetime.now().isoformat(timespec="seconds"))
+        receipt["damaged"] = int(bool(receipt.get("damaged")))
+        with self.lock:
+            self.buffer.append(tuple(receipt.get(column) for column in self.COLUMNS))
+            if len(self.buffer) >= self.batchSize:
+                self.flushLocked()
+
+    def flush(self):
+        """
+        Inserts the buffered receipts in one transaction.
+        """
+        with self.lock:
+            self.flushLocked()
+
+    def flushLocked(self):
+        if not self.buffer:
+            return
+        placeholders = ", ".join("?" for _ in self.COLUMNS)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO receipts ({', '.join(self.COLUMNS)}) VALUES ({placeholders})", self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def find(self, column, value):
+        """
+        Looks receipts up by one indexed column.
+
+        Args:
+            column (str): One of `ReceivingLedger.COLUMNS`
+            value: The value to look for
+
+        Returns:
+            list: Every matching receipt as a dict, oldest first
+        """
+        if column not in self.COLUMNS:
+            raise ValueError(f"Unknown ledger column: {column}")
+        self.flush()
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM receipts WHERE {column} = ? ORDER BY id", (value,))
+        return [dict(zip(self.COLUMNS, row)) for row in cursor]
+
+    def find_serial(self, serial):
+        return self.find("serial", serial)
+
+    def find_rma(self, rma):
+        return self.find("rma", rma)
+
+class RmaCheckpoint:
+    """
+    Local record of the serials captured for each RMA and which of them are done, so an RMA that was interrupted (the
+    program crashed, the AS400 session dropped or the operator quit) resumes at the first serial not done instead of
+    capturing every page and going through every serial again.
+
+    A serial is done once its day file line is in the share spool. The checkpoint of an RMA is removed when every
+    serial of it is done.
     """
 
-    def find_as400(self, list_of_windows):
+    def __init__(self, path=None):
         """
-        Searches a list of open windows for the AS400 application.
+        Opens (and creates if needed) the checkpoints.
 
         Args:
-            list_of_windows (list): A list of currently open windows
+            path (str): Path of the SQLite file, ~/RmaReceiving/rma_checkpoints.sqlite3 if not given
+
+        Returns: Nothing
+        """
+        if path is None:
+            path = os.path.join(LOCAL_DIR, "rma_checkpoints.sqlite3")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS serials (rma TEXT NOT NULL, position INTEGER NOT NULL, "
+                "serial TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0, captured_at TEXT, PRIMARY KEY (rma, serial))")
+
+    def load(self, rma):
+        """
+        Gets the checkpoint of an RMA.
+
+        Returns:
+            tuple: (every serial captured, in the order of the AS400 list, set of the serials done), None if the RMA
+                has no checkpoint
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT serial, done FROM serials WHERE rma = ? ORDER BY position", (rma,)).fetchall()
+        if not rows:
+            return None
+        return [serial for serial, _ in rows], {serial for serial, done in rows if done}
+
+    def save(self, rma, serials):
+        """
+        Stores the serials captured for an RMA, none of them done, in place of any earlier checkpoint of it.
+        """
+        capturedAt = datetime.now().isoformat(timespec="seconds")
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM serials WHERE rma = ?", (rma,))
+            self.connection.executemany(
+                "INSERT INTO serials (rma, position, serial, captured_at) VALUES (?, ?, ?, ?)",
+                [(rma, position, serial, capturedAt) for position, serial in enumerate(serials)])
+
+    def mark_done(self, rma, serial):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE serials SET done = 1 WHERE rma = ? AND serial = ?", (rma, serial))
+
+    def discard(self, rma):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM serials WHERE rma = ?", (rma,))
+
+    def complete(self, rma):
+        """
+        Removes the checkpoint of an RMA if every serial of it is done.
 
         Returns:
-            int: The window handle (`hwnd`) of the AS400 application if found, or -1 if not found.
+            bool: True if the RMA is complete (or has no checkpoint)
         """
-        for window in list_of_windows:
-            if "as400" in window[2].lower():  # Check if AS400 is in the title (case insensitive)
-                return window[0]  # Return the window handle ('hwnd')
-        return -1  # Return -1 if no AS400 window found
+        with self.lock, self.connection:
+            pending = self.connection.execute(
+                "SELECT COUNT(*) FROM serials WHERE rma = ? AND done = 0", (rma,)).fetchone()[0]
+            if pending:
+                return False
+            self.connection.execute("DELETE FROM serials WHERE rma = ?", (rma,))
+            return True
+
+    def close(self):
+        self.connection.close()
+
+class BloomFilter:
+    """
+    Compact set of strings that answers "maybe in it" or "certainly not in it" in constant time. A "maybe" is wrong
+    at most `errorRate` of the time while no more than `capacity` strings are in it. Strings can be added from any
+    thread.
+    """
+
+    def __init__(self, capacity=500000, errorRate=0.01):
+        """
+        Args:
+            capacity (int): Number of strings expected
+            errorRate (float): Chance of a wrong "maybe" at that number of strings
 
-    def list_window_names(self):
+        Returns: Nothing
+        """
+        self.size = max(8, math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2))  # Bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.lock = threading.Lock()  # Setting a bit reads and writes its byte, two adds must not interleave
+
+    def positions(self, value):
+        # Two halves of one digest give every position (double hashing)
+        digest = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=16).digest(), "little")
+        first, second = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        positions = self.positions(value)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, values):
         """
-        Lists the names (titles) of all currently open windows.
+        Adds many strings, the same as add() for each of them with the lookups hoisted out of the loop.
+        """
+        bits, size, hashes, blake2b = self.bits, self.size, range(self.hashes), hashlib.blake2b
+        with self.lock:
+            for value in values:
+                digest = int.from_bytes(blake2b(value.encode(), digest_size=16).digest(), "little")
+                first, second = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+                for i in hashes:
+                    position = (first + i * second) % size
+                    bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+def as400_day(date):
+    """
+    Converts an AS400 date to the day format of the receiving history and the day file index.
+
+    Args:
+        date (str): MM/DD/YY, as shown on the AS400
+
+    Returns:
+        str: YYYY-MM-DD
+    """
+    return datetime.strptime(date, "%m/%d/%y").date().isoformat()
+
+class ReceiptHistory:
+    """
+    Tells whether a serial was received before, by this station or any other, so a serial received twice is flagged
+    before any AS400 navigation is spent on it.
+
+    Every serial in the receiving ledger of this station and in the index of the day files on the share
+    (`receiving_query.ReceivedIndex`) is loaded into a BloomFilter when the history is opened, from the two local
+    SQLite files only. A lookup is a constant time filter check and only a "maybe" is confirmed in the exact indexes.
+    The day file index is then brought up to date from the share in the background to pick up the other stations.
+    """
+
+    instances = {}  # (share root, local folder) -> ReceiptHistory
+    instancesLock = threading.Lock()
 
-        Uses the WinAPI to enumerate all visible windows and retrieve their
-        handles, hex representations, and names.
+    @classmethod
+    def shared(cls, shareRoot=SHARE_ROOT, localDir=LOCAL_DIR):
+        """
+        Gets the history of a share and local folder, opening it the first time.
 
         Returns:
-            list: A list of currently open windows.
+            ReceiptHistory: The same instance for every call with the same folders
         """
-        list_of_windows = []
+        with cls.instancesLock:
+            history = cls.instances.get((shareRoot, localDir))
+            if history is None:
+                history = cls.instances[(shareRoot, localDir)] = cls(shareRoot, localDir)
+            return history
 
-        def win_enum_handler(hwnd, ctx):
-            """
-            Callback function for use with `win32gui.EnumWindows`.
+    def __init__(self, shareRoot=SHARE_ROOT, localDir=LOCAL_DIR, refresh=True):
+        """
+        Starts loading the history in the background, see wait().
 
-            Captures all visible windows and appends their information
-            (handle, hex handle, title) to the `list_of_windows`.
+        Args:
+            shareRoot (str): The share folder, the day files are under its RMAs_Received folder
+            localDir (str): The local folder the ledger and the day file index are in
+            refresh (bool): Update the day file index from the share once the history is loaded
 
-            Args:
-                hwnd (int): The handle to the window being enumerated.
-                ctx: Additional context (not used).
-            """
-            if win32gui.IsWindowVisible(hwnd):  # Check if the window is visible
-                list_of_windows.append([hwnd, hex(hwnd), win32gui.GetWindowText(hwnd)])
+        Returns: Nothing
+        """
+        self.root = os.path.join(shareRoot, "RMAs_Received")
+        self.indexPath = os.path.join(localDir, "received_index.sqlite3")
+        self.ledgerPath = os.path.join(localDir, "receiving_ledger.sqlite3")
+        self.filter = BloomFilter()
+        self.recent = {}            # Serial -> receipt logged by this program since the history was loaded
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+        self.loadSeconds = None     # How long loading the filter took
+        self.error = None           # Why the history could not be loaded or refreshed, None if it could
+        self.listeners = []         # Called with the error message (from the loading thread) when that happens
+        self.loader = threading.Thread(target=self.load, args=(refresh,), name="receipt-history", daemon=True)
+        self.loader.start()
+
+    def load(self, refresh=True):
+        start = time.perf_counter()
+        self.ledger = self.index = None
+        try:
+            self.ledger = ReceivingLedger(self.ledgerPath)
+            self.index = ReceivedIndex(self.root, self.indexPath)
+            # Most serials are in both, so the union is about half of the rows
+            connection = sqlite3.connect(self.indexPath)
+            connection.execute("ATTACH DATABASE ? AS ledger", (self.ledgerPath,))
+            self.filter.update(serial for serial, in connection.execute(
+                "SELECT serial FROM lines WHERE serial IS NOT NULL UNION SELECT serial FROM ledger.receipts"))
+            connection.close()
+            lastLine = self.index.connection.execute("SELECT COALESCE(MAX(id), 0) FROM lines").fetchone()[0]
+        except (OSError, sqlite3.Error) as e:
+            self.ledger = self.index = None
+            self.report(f"Could not load the receiving history, only this session's serials are checked: {e}")
+            return
+        finally:
+            self.loadSeconds = time.perf_counter() - start
+            self.loaded.set()
+
+        if refresh:
+            try:
+                if not os.path.isdir(self.root):
+                    return  # Nothing received on this share yet
+                # Its own index instance, the share can be slow and lookups must not wait for it
+                index = ReceivedIndex(self.root, self.indexPath)
+                index.update()
+                self.filter.update(serial for serial, in index.connection.execute(
+                    "SELECT serial FROM lines WHERE id > ? AND serial IS NOT NULL", (lastLine,)))
+                index.close()
+            except (OSError, sqlite3.Error) as e:
+                self.report(f"Could not update the received day file index: {e}")
+
+    def report(self, message):
+        self.error = message
+        for listener in list(self.listeners):
+            listener(message)
+
+    def wait(self, timeout=None):
+        """
+        Waits until the history is loaded.
+
+        Returns:
+            bool: True if it is loaded
+        """
+        return self.loaded.wait(timeout)
 
-        win32gui.EnumWindows(win_enum_handler, None)  # Enumerate all windows
-        return list_of_windows
+    def add(self, serial, receipt):
+        """
+        Adds a serial this program just received.
 
-    def as400_main_screen(self, data):
+        Args:
+            serial (str): The serial number
+            receipt (str): Where and when it was received, returned by lookup() from now on
         """
-        Checks whether the AS400 is in the main menu for Failure analysis.
+        with self.lock:
+            self.recent[serial] = receipt
+        self.filter.add(serial)
+
+    def lookup(self, serial, timeout=None):
+        """
+        Finds the last time a serial was received.
 
         Args:
-            data (str): The screen data that it takes in
+            serial (str): The serial number
+            timeout (float): Seconds to wait for the history to load, no limit if not given. If it is still loading
+                afterwards only the serials received by this program are checked.
 
         Returns:
-            bool: `True` if the content contains "Failure Analysis Menu",
-                  otherwise `False`.
+            str: When, on which RMA and by whom it was received, None if it was never received
         """
-        if "Failure Analysis Menu" in data:
-            return True 
-        else:
-            return False  
+        loaded = self.wait(timeout)
+        with self.lock:
+            if serial in self.recent:
+                return self.recent[serial]
+        if not loaded or self.index is None or serial not in self.filter:
+            return None
+
+        receipts = []
+        with self.lock:  # The filter said maybe, look it up in the exact indexes
+            for receipt in self.ledger.find_serial(serial):
+                # The AS400 date, like the day file the line went to
+                day = as400_day(receipt["as400_date"]) if receipt["as400_date"] else receipt["received_at"][:10]
+                receipts.append((day, receipt["rma"], receipt["receiver"]))
+            for day, text in self.index.query(serial=serial):
+                match = LINE_PATTERN.search(text)
+                receipts.append((day, match["rma"], match["receiver"]))
+        if not receipts:
+            return None
+        day, rma, receiver = max(receipts)
+        return f"{day} on {rma}, received by {receiver}"
+
+    def close(self):
+        """
+        Waits for the loading (and the refresh from the share) to end and closes the indexes.
+        """
+        self.loader.join()
+        if self.index is not None:
+            self.index.close()
+            self.ledger.close()
+        with self.instancesLock:
+            for key, history in list(self.instances.items()):
+                if history is self:
+                    del self.instances[key]
+
+    def duplicates(self, serials, timeout=None):
+        """
+        Args:
+            serials (iterable): The serial numbers
+            timeout (float): Seconds to wait for the history to load, see lookup()
+
+        Returns:
+            dict: Serial -> its last receipt (see lookup()) for every serial that was received before
+        """
+        loaded = self.wait(timeout)
+        found = {}
+        for serial in serials:
+            receipt = self.lookup(serial, None if loaded else 0)
+            if receipt is not None:
+                found[serial] = receipt
+        return found
 
 class ProcessRMA(AccessAS400):
-    def __init__(self, RMA):
+    folders = FolderProvisioner()  # Shared by every RMA processed by this program
+    def __init__(self, RMA, terminal=None, shareRoot=SHARE_ROOT, localDir=LOCAL_DIR):
         """
-        Initializes Finds the AS400 window and sets it to the foreground. Initializes the tkinter root, checks if it is in AS400 homescreen 
+        Initializes Finds the AS400 window and sets it to the foreground. Initializes the terminal, checks if it is in AS400 homescreen 
         then initializes the date and receiver variables by copying the 
 
         Args:
             RMA(str): The RMA number
+            terminal (TerminalDriver): The terminal to drive, the real AS400 window (the shared PyAutoGuiTerminal) if not given
+            shareRoot (str): The folder RMAs_Received, RMA_Received_Pictures and RMA_Damage are in
+            localDir (str): Local folder for the day file spool and the ledger
 
         Returns: Nothing
         """
         self.RMA = RMA #Initialize the RMA
+        self.shareRoot = shareRoot
+        self.localDir = localDir
+        self.stats = SessionStats()  # Time spent in every stage of this RMA, see timed()
+        self.dayFile = None    # Path of today's day file, worked out on the first trackRMA call
+        self.spool = ShareSpool.shared(os.path.join(localDir, "share_spool.sqlite3"), self.folders.provision)  # Day file lines and folders on their way to the share
+        self.ledger = ReceivingLedger(os.path.join(localDir, "receiving_ledger.sqlite3"))  # Structured copy of the day file lines
+        self.checkpoint = RmaCheckpoint(os.path.join(localDir, "rma_checkpoints.sqlite3"))  # Serials done, to resume an interrupted RMA
+        self.resumed = 0       # Serials already done by an earlier, interrupted run of this RMA
+        self.history = ReceiptHistory.shared(shareRoot, localDir)  # Serials received before, on any day or station
+
+        if terminal is None:
+            terminal = PyAutoGuiTerminal.shared()
+        if isinstance(terminal, InstrumentedTerminal):  # Terminal of a previous RMA
+            terminal = terminal.inner
+        self.terminal = InstrumentedTerminal(terminal, self.stats)
 
+        try:
+            self.terminal.focus()
+            mdata = self.terminal.read_screen().split('\n')
 
-        list_of_windows = self.list_window_names()
-        as400 = self.find_as400(list_of_windows)
-        win32gui.SetForegroundWindow(as400)
-        pa.hotkey('ctrl', 'c')
+            mdata = mdata[0]
 
-        self.root = tkinter.Tk()
-        self.root.withdraw()
-        mdata = self.root.clipboard_get().split('\n')
-        # self.root.destroy()
+            if not self.as400_main_screen(mdata):
+                mdata = self.back_to_menu()
 
-        mdata = mdata[0]
+            menu = MENU_SCREEN.extract(mdata)
+            if menu.missing():
+                raise RuntimeError(f"Could not read the {' and '.join(menu.missing())} from the Failure Analysis Menu")
+            self.receiver = menu.receiver
+            self.date = menu.date
+            self.run_macro("open_fa02")
+        except Exception:
+            self.close()
+            raise
 
-        if self.as400_main_screen(mdata):
-            mdata = mdata.split(" ")
-            cleaned = [s.strip() for s in mdata if s.strip()]
-            self.receiver = cleaned[1]
-            self.date = cleaned[5]
-            pa.typewrite("02")
-            pa.hotkey(["return"], interval=0.01)
-        else:
-            pa.typewrite("e")
-            pa.hotkey(["return"])
-            return
+    def close(self):
+        """
+        Closes the ledger and the checkpoint of the RMA, whichever way it ended. Calling it again does nothing.
+
+        Returns:
+            Nothing
+        """
+        self.ledger.close()
+        self.checkpoint.close()
+
+    def back_to_menu(self):
+        """
+        Takes the AS400 back to the Failure Analysis Menu from the FA02 screen an RMA was left on (e.g. by an RMA that
+        failed half way). Only attention keys are used so nothing is typed into the fields of the screen: F12 leaves
+        an open serial without saving it, F3 leaves the serial list and the RMA search.
+
+        Returns:
+            str: The first line of the menu
+
+        Raises:
+            RuntimeError: If the menu doesn't show
+        """
+        screen = self.terminal.read_screen()
+        for _ in range(3):
+            if self.as400_main_screen(screen.split('\n')[0]):
+                return screen.split('\n')[0]
+            try:
+                screen = self.run_macro("cancel_serial" if "Other:" in screen else "exit")
+            except TimeoutError:
+                break
+        raise RuntimeError("The AS400 is not on the Failure Analysis Menu and could not be taken back to it")
 
-    def getAssigned(self):
+    def getAssigned(self, snapshot=None):
         """"
         Gets who the RMA is assigned to by analyzing the screen data.
         
-        Args: None
+        Args:
+            snapshot (ScreenSnapshot): An already captured screen, the screen is copied if not given
 
         Returns:
             str: The name of the person who the RMA is assigned to, or "Not assigned" if it is not assigned yet.
         """
-        screenClean = self.screenCopy()
-        for i in range(len(screenClean)):
-            if screenClean[i] == 'Note':
-                #If it is not assigned screenClean[i+2] would return the date (MM/DD/YY)(December = 12, Jan = 01) 
-                # which is why the condition for the if statement is whether screenClean[i+2] starts with 1 or a 0 
-                if screenClean[i+2].startswith("1") or screenClean[i+2].startswith('0'): 
-                    return "Not assigned"
-                else:
-                    return screenClean[i+2]
+        if snapshot is None:
+            snapshot = self.captureScreen()
+
+        assigned = snapshot.record(LIST_SCREEN).note
+        if assigned is MISSING:
+            return None
+
+        #If it is not assigned the value after Note would be the date (MM/DD/YY)(December = 12, Jan = 01) 
+        # which is why the condition for the if statement is whether it starts with 1 or a 0 
+        if assigned.startswith("1") or assigned.startswith('0'): 
+            return "Not assigned"
+        else:
+            return assigned
 
     def dateFormat(self):
         """"
@@ -200,258 +2073,431 @@ class ProcessRMA(AccessAS400):
 
         return date
 
-    def trackRMA(self, serialNum, returnType, partNum):
+    @timed_stage("day file")
+    def trackRMA(self, serialNum, returnType, partNum, sla=None, damaged=False):
         """
         Searches for an existing folder in the specified parent directory whose name starts with a given prefix.
         If no such folder exists, it generates a default folder name using the prefix filled with additional 'x' characters then
         creates or opens a txt file based on if it exists for the current day and writes in the following RMA information:
-        RMA#, Return Type, SerialNum, Part Number, Person Assigned To, and Received by".
+        RMA#, Return Type, SerialNum, Part Number, Person Assigned To, and Received by". The line goes to the local
+        spool (`self.spool`), which writes it to the share in the background, and the same information is recorded
+        in the structured ledger (`self.ledger`).
 
         Args:
             serialNum (str): The serial number of the current part being proccessed
             returnType (str): The return type of the current part being proccessed
             partNum(str): The part number of the current part being proccessed
+            sla (str): Whether the part is SLA ("Yes"/"No", None if unknown), only recorded in the ledger
+            damaged (bool): Whether the RMA is damaged, only recorded in the ledger
 
         Returns:
             dayFile (str): The path of the txt file that was either created or opened and written into
         """
-        date = self.dateFormat()
-        yearFolder = date[2]  
-        monthFolder = date[0]  
-        dayFile = f"{date[0]} {date[1]}, {date[2]}.txt"  
-
-        basePath = r"\\panther\RMA\RMA_Repairs\RMAs_Received"
+        if self.dayFile is None:
+            date = self.dateFormat()
+            yearFolder = date[2]  
+            monthFolder = date[0]  
+            dayFile = f"{date[0]} {date[1]}, {date[2]}.txt"  
 
-        # Define the full path structure
-        yearPath = os.path.join(basePath, yearFolder)  
-        monthPath = os.path.join(yearPath, monthFolder)  
-        dayFile = os.path.join(monthPath, dayFile)  
+            basePath = os.path.join(self.shareRoot, "RMAs_Received")
 
-        # Ensure the folder structure exists
-        if not os.path.exists(yearPath):
-            os.makedirs(yearPath)
-        if not os.path.exists(monthPath):
-            os.makedirs(monthPath)
+            # Define the full path structure, the year and month folders are created when the lines are flushed
+            yearPath = os.path.join(basePath, yearFolder)  
+            monthPath = os.path.join(yearPath, monthFolder)  
+            self.dayFile = os.path.join(monthPath, dayFile)  
 
-        # Write content multiple times into the file
+        # Spooled, the line reaches the share once the replayer writes it out (see ShareSpool)
+        self.spool.write(self.dayFile, f"RMA#: {self.RMA}   Type: {returnType}   S/N: {serialNum}	P/N: {partNum}	Assigned To: {self.assignedTo}	Received by: {self.receiver}\n")
 
-        with open(dayFile, "a") as f:
-            f.write(f"RMA#: {self.RMA}   Type: {returnType}   S/N: {serialNum}	P/N: {partNum}	Assigned To: {self.assignedTo}	Received by: {self.receiver}\n")
+        self.ledger.record(as400_date=self.date, rma=self.RMA, serial=serialNum, part_number=partNum,
+                           return_type=returnType, sla=sla, assigned_to=self.assignedTo, receiver=self.receiver,
+                           damaged=damaged)
+        self.ledger.flush()  # Committed before the serial is marked done, a resumed RMA never logs it again
+        self.checkpoint.mark_done(self.RMA, serialNum)  # The line is safe in the spool, don't log the serial again
+        self.history.add(serialNum, f"{as400_day(self.date)} on {self.RMA}, received by {self.receiver}")
 
         # Notify the user
-        return dayFile
+        return self.dayFile
 
-    def find_existing_folder(self,parent, folder_prefix, total_length): #Function written with Jezu Mario Palackal Stanley
+    @timed_stage("capture")
+    def getBarcodes(self):
         """
-        Searches for an existing folder in the specified parent directory whose name starts with a given prefix.
-        If no such folder exists, it generates a default folder name using the prefix filled with additional 'x' characters 
-        to match the required total length.
+        Navigates through and enters the RMA number into FA02 then gets and returns all barcodes in the RMA entered. If more than one page of 
+        barcodes in RMA then it will press page down until at last page while still collecting all the barcodes.
+        Only needs to be called once per RMA.
+
+        The barcodes are checkpointed locally. If an earlier run of the RMA was interrupted the pages are not captured
+        again, only the serials that run did not finish are returned and `self.resumed` is how many it did.
 
         Args:
-            parent (str): Path to the parent directory where the folders are located.
-            folder_prefix (str): The prefix of the folder to search for.
-            total_length (int): The total length of the desired folder name (including the prefix).
+            None.
 
         Returns:
-            str: Name of the matching folder if found, or a generated folder name based on 
-                the prefix if no match exists.
+            self.barcodeList (Queue): A queue containing all the serial numbers in the RMA
+            **If Queue is empty** return (str): RMA not open
+        
         """
-        candidates = []
-        if os.path.exists(parent):
-            for fname in os.listdir(parent):
-                fpath = os.path.join(parent, fname)
-                if os.path.isdir(fpath) and fname.startswith(folder_prefix):
-                    candidates.append(fname)
+        
+        #Searches up the RMA number in FA02 (inquire, user deleted, RMA number)
+        self.run_macro("search_rma", rma=self.RMA)
+
+        #Store screen data in a variable once the serial list is shown
+        snapshot = self.captureScreen(until=("More...", "Bottom"))
+        page = snapshot.text
+
+        #Gets who the RMA is assigned to from the same capture and stores it in an instance variable
+        self.assignedTo = self.getAssigned(snapshot)
+
+        #Find the serial numbers page by page as each page arrives. Pages can overlap, a serial is only kept the first time
+        self.barcodes = []
+        seen = set()
+
+        def collect(page):
+            for barcode in SERIAL_PATTERN.findall(page):
+                if barcode not in seen:
+                    seen.add(barcode)
+                    self.barcodes.append(barcode)
+
+        collect(page)
+
+        #Resume an interrupted run of the RMA, unless the RMA was closed or got serials the checkpoint doesn't have
+        saved = self.checkpoint.load(self.RMA)
+        if saved is not None and not (self.barcodes and seen.issubset(saved[0])):
+            self.checkpoint.discard(self.RMA)
+            saved = None
+
+        if saved is not None:
+            self.barcodes, done = saved
+            self.resumed = len(done)
+            pending = [barcode for barcode in self.barcodes if barcode not in done]
+        else:
+            #Gets all barcodes if there is more than one page of serial numbers in an RMA
+            if "More..." in page:
+                while "Bottom" not in page:
+                    previous = page
+                    self.run_macro("next_page")
+                    page = self.terminal.wait_for_screen(lambda new: new != previous)  # Wait for the next page to render
+                    collect(page)
+            if self.barcodes:
+                self.checkpoint.save(self.RMA, self.barcodes)
+            self.resumed = 0
+            pending = self.barcodes
+        
+        # Print the extracted barcodes
+        self.barcodeList = Queue()
+        for barcode in pending:
+            self.barcodeList.put(barcode)
 
-        if candidates:
-            match = min(candidates, key=len)
-            return match
-        return folder_prefix + ('x' * (total_length - len(folder_prefix)))
+        #For the case that the RMA is not open therefore having no serial numbers when RMA is searched into FA02
+        if not self.barcodes:
+            return "RMA not open"
+
+        #Put whitespace at the end of the queue (important of GUI section)
+        self.barcodeList.put(" ")
+        return self.barcodeList
 
-    def create_rma_folder_structure(self): #Function written with Jezu Mario Palackal Stanley
+    @timed_stage("enter date")
+    def enterDate(self):
         """
-        Creates a nested folder structure for RMA images based on the RMA number.Each RMA is organized into three levels: a root folder, 
-        a subfolder, and finally a unique folder for the specific RMA. 
+        Once inside the failure analysis processing screen for a product in an RMA, this method enters the date into the "Other" category. 
 
         Args:
             None.
 
         Returns:
-            str: Path to the third-level folder corresponding to the specific RMA. 
-                Creates the folder if it does not exist.
-        
-        Raises:
-            ValueError: If the RMA number is not in the expected format (e.g., does not start with 'RMA' and does not have at least
-            six digits following 'RMA').
+            Nothing
         """
-        if not (self.RMA.startswith('RMA') and len(self.RMA) >= 9 and self.RMA[3:].isdigit()):
-            raise ValueError("RMA code must start with 'RMA' and have at least 6 digits after RMA")
+        #Format self.date
+        date = self.dateFormat() 
+        date = f"{date[0]} {date[1]}, {date[2]}"
+
+        #Write the date into the "Other" section
+        self.run_macro("enter_date", date=date)
 
-        base_path = r"\\panther\RMA\RMA_Repairs\RMA_Received_Pictures"
+    def deleteDate(self):
+        """
+        ***This method is for testing***
+        Once inside the failure analysis processing screen for a product in an RMA, this method deletes the date in the "Other" category. 
 
-        first_folder_prefix = self.RMA[:5]
-        second_folder_prefix = self.RMA[:6]
-        third_folder = self.RMA
+        Args:
+            None.
 
-        # Find or create root folder
-        first_folder = self.find_existing_folder(base_path, first_folder_prefix, 9)
-        first_path = os.path.join(base_path, first_folder)
-        if not os.path.exists(first_path):
-            os.makedirs(first_path)
+        Returns:
+            Nothing
+        """
+        #Deletes the date in the "Other" section
+        self.run_macro("delete_date")
 
-        # Find or create second level folder
-        second_folder = self.find_existing_folder(first_path, second_folder_prefix, 9)
-        second_path = os.path.join(first_path, second_folder)
-        if not os.path.exists(second_path):
-            os.makedirs(second_path)
+    def run_macro(self, name, **values):
+        """
+        ***Helper Method***
+        Sends one of the navigation steps in MACROS to the AS400.
 
-        #create third level folder for unique RMA
+        Args:
+            name (str): The step
+            **values: Values for its placeholders (rma, serial, date)
 
-        third_path = os.path.join(second_path, third_folder)
-        if not os.path.exists(third_path):
-            os.makedirs(third_path, exist_ok=True)
-            #Return the folder path of the third folder created/opened
-            return third_path
-        else:
-            return third_path
+        Returns:
+            str: The screen the step waits for, None if it doesn't wait
+        """
+        return MACROS[name].run(self.terminal, **values)
+
+    @timed_stage("screen")
+    def captureScreen(self, until=None, timeout=10.0):
+        """
+        ***Helper Method***
+        Copies the content on the screen once and returns it as a ScreenSnapshot. Capture the screen once per screen state 
+        and pass the snapshot to the field accessors instead of letting each of them copy the screen again.
 
-    def createDamagedRmaFolder(self):
+        Args:
+            until (str, tuple or callable): If given, waits for this screen first (see TerminalDriver.wait_for_screen)
+            timeout (float): Seconds to wait for the `until` screen
+
+        Returns:
+            ScreenSnapshot: The tokenized and indexed screen
+        """
+        if until is None:
+            return ScreenSnapshot(self.terminal.read_screen())
+        return ScreenSnapshot(self.terminal.wait_for_screen(until, timeout))
+
+    def screenCopy(self):
         """
-        Same logic as the create_rma_folder_structure(self) method.  
+        ***Helper Method***
+        This method copys the content onto the screen, removes all of the whitespace and then returns a list of everthing that is on the screen when 
+        function is called. 
 
         Args:
             None.
 
         Returns:
-            str: Path to the third-level folder corresponding to the specific RMA. 
-                Creates the folder if it does not exist.
-        
-        Raises:
-            ValueError: If the RMA number is not in the expected format 
-            (e.g., does not start with 'RMA' and does not have at least six digits following 'RMA').
+            screenClean (List): List of all content (words, numbers, characters) as a string without whitespace 
         """
-        if not (self.RMA.startswith('RMA') and len(self.RMA) >= 9 and self.RMA[3:].isdigit()):
-            raise ValueError("RMA code must start with 'RMA' and have at least 6 digits after RMA")
+        return self.captureScreen().tokens
+
+    def isSLA(self, snapshot=None):
+        """
+        Checks if the current product is an SLA.
 
-        base_path = r"\\panther\RMA\RMA_Repairs\RMA_Damage"
+        This method scans the screen data for the keyword "SLA" and evaluates the response following it. 
+        If the response is "Y", it indicates that the product is under SLA.
+
+        Args:
+            snapshot (ScreenSnapshot): An already captured screen, the screen is copied if not given
 
-        first_folder_prefix = self.RMA[:5]
-        second_folder_prefix = self.RMA[:6]
-        third_folder = self.RMA
+        Returns:
+            str: "Yes" if the product is SLA, "No" if it is not, or None if the SLA field is not found.
+        """
+        if snapshot is None:
+            snapshot = self.captureScreen()
 
-        # Find or create root folder
-        first_folder = self.find_existing_folder(base_path, first_folder_prefix, 9)
-        first_path = os.path.join(base_path, first_folder)
-        if not os.path.exists(first_path):
-            os.makedirs(first_path)
+        sla = snapshot.record(SERIAL_SCREEN).sla
+        if sla is MISSING:  # Not on the screen, or moved: unknown rather than "No"
+            return None
+        return "Yes" if sla else "No"
 
-        # Find or create second level folder
-        second_folder = self.find_existing_folder(first_path, second_folder_prefix, 9)
-        second_path = os.path.join(first_path, second_folder)
-        if not os.path.exists(second_path):
-            os.makedirs(second_path)
+    def returnType(self, snapshot=None):
+        """
+        Determines the return type associated with the current RMA.
+
+        This method scans the screen data for the keyword "RMA#" and retrieves 
+        the type of return listed directly after it.
+
+        Args:
+            snapshot (ScreenSnapshot): An already captured screen, the screen is copied if not given
+
+        Returns:
+            str: The return type of the RMA (e.g., "Repair", "Replace", etc.)
+                if found, or None if not found.
+        """
+        if snapshot is None:
+            snapshot = self.captureScreen()
+
+        returnType = snapshot.record(SERIAL_SCREEN).returnType
+        return None if returnType is MISSING else returnType
+
+    def partNum(self, snapshot=None):
+        """
+        Extracts the part number from the screen data.
+
+        This method scans the screen data for the keywords "Part" and "Number" 
+        in sequence and retrieves the part number listed after them.
+
+        Args:
+            snapshot (ScreenSnapshot): An already captured screen, the screen is copied if not given
+
+        Returns:
+            str: The part number if found, or None if not found.
+        """
+        if snapshot is None:
+            snapshot = self.captureScreen()
+
+        partNum = snapshot.record(SERIAL_SCREEN).partNum
+        return None if partNum is MISSING else partNum
+
+    def dateEntered(self, snapshot=None):
+        """
+        Checks if the date has been entered in other section.
+
+        This method scans the screen data for the keywords "Other"
+        in sequence and retrieves whether or not a date has been entered.
+
+        Args:
+            snapshot (ScreenSnapshot): An already captured screen, the screen is copied if not given
 
-        #create third level folder for unique RMA
+        Returns:
+            bool: True if date has not been entered, False if date has been entered.
+        """
+        if snapshot is None:
+            snapshot = self.captureScreen()
 
-        third_path = os.path.join(second_path, third_folder)
-        if not os.path.exists(third_path):
-            os.makedirs(third_path, exist_ok=True)
-            return third_path
+        if snapshot.record(SERIAL_SCREEN).other == "":
+            return True
         else:
-            return third_path
+            return False
 
-    def getBarcodes(self):
+    def timed(self, stage):
         """
-        Navigates through and enters the RMA number into FA02 then gets and returns all barcodes in the RMA entered. If more than one page of 
-        barcodes in RMA then it will press page down until at last page while still collecting all the barcodes.
+        Context manager that adds how long the block took to the stage in `self.stats`.
 
         Args:
-            None.
+            stage (str): Name of the stage (e.g. "navigate", "log", "folders")
+        """
+        return self.stats.timed(stage)
+
+    @timed_stage("open serial")
+    def openSerial(self, serial):
+        """
+        From the FA02 serial list (or the processing screen of the previous serial) navigates to the failure analysis
+        processing screen of a serial, answering the "Type OK" prompt if there is one.
+
+        Args:
+            serial (str): The serial number to open
 
         Returns:
-            self.barcodeList (Queue): A queue containing all the serial numbers in the RMA
-            **If Queue is empty** return (str): RMA not open
-        
+            ScreenSnapshot: The processing screen of the serial
         """
-        
-        #Navigates to section to search up RMA number in FA02
-        pa.typewrite("I")
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("end") #Deletes the user
-        pa.hotkey("up")
+        self.terminal.focus()
 
-        #Enters RMA number
-        pa.typewrite(f"{self.RMA}")
-        pa.hotkey("return")
+        self.run_macro("position_serial", serial=serial)  # Waits until the list is positioned on the serial
+        self.run_macro("select_serial")
 
-        #Gets who the RMA is assigned to and stores it in an instance variable
-        self.assignedTo = self.getAssigned()
+        #Capture the processing screen once it is shown, every field is read from this snapshot
+        snapshot = self.captureScreen(until="Other:")
 
-        #Store screen data in a variable
-        pa.hotkey('ctrl', 'a')
-        pa.hotkey('ctrl', 'c')
-        screen = self.root.clipboard_get()
-
-        #Gets all barcodes if there is more than one page of serial numbers in an RMA
-        if "More..." in screen:
-            while "Bottom" not in screen:
-                pa.hotkey("pagedown")
-                pa.hotkey('ctrl', 'a')
-                pa.hotkey('ctrl', 'c')
-                new = self.root.clipboard_get()
-                screen+=new
-
-                if "Bottom" in screen:
-                    break
-        
-        #Find all serial numbers in the screen
-        self.barcodes = re.findall(r'\b\d{10}\b', screen)
+        #In the case that to get to the RMA processing screen you need to type OK
+        if "Type OK" in snapshot:
+            self.run_macro("answer_ok")
+            snapshot = self.captureScreen()  # Screen changed, capture it again
+        return snapshot
 
-        # Print the extracted barcodes
-        self.barcodeList = Queue()
-        for barcode in self.barcodes:
-            self.barcodeList.put(barcode)
+    def peekSerial(self, serial):
+        """
+        Opens a serial and reads its information without writing anything to it. Used to fetch the next serial while
+        the operator is still looking at the current one, the date is entered later by confirmSerial().
 
-        #For the case that the RMA is not open therefore having no serial numbers when RMA is searched into FA02
-        if self.barcodeList.empty() == True:
-            return "RMA not open"
+        Args:
+            serial (str): The serial number to open
 
-        #Put whitespace at the end of the queue (important of GUI section)
-        self.barcodeList.put(" ")
-        return self.barcodeList
+        Returns:
+            tuple: (the serial number, SLA, return type and part number as a dict, whether the date still has to be entered)
+        """
+        with self.timed("navigate"):
+            snapshot = self.openSerial(serial)
+
+        # Make sure the AS400 is on the processing screen before anything is read from it or written to it
+        record = snapshot.record(SERIAL_SCREEN)
+        if not record.valid:
+            raise RuntimeError(f"Serial {serial}: the AS400 is not on the {record.screen} screen, or its "
+                               f"{', '.join(record.missing()) or 'fields'} could not be read")
+
+        info = {
+            "Serial Number": serial,
+            "SLA": self.isSLA(snapshot),
+            "Return Type": self.returnType(snapshot), 
+            "Part Number": self.partNum(snapshot),
+        }
+        return info, self.dateEntered(snapshot)
+
+    def confirmSerial(self, needsDate):
+        """
+        Makes the writes to the serial that is open on the AS400: enters the date if it has not been entered.
+        The AS400 saves it when the next serial is opened (or when the RMA is finished).
+
+        Args:
+            needsDate (bool): Whether the date still has to be entered, from peekSerial()
+        """
+        if needsDate == True:
+            with self.timed("navigate"):
+                self.enterDate()
+
+    def readSerial(self, serial):
+        """
+        The AS400 part of processing a serial: opens it, enters the date if it is not entered yet and reads its
+        information.
+
+        Args:
+            serial (str): The serial number to process
+
+        Returns:
+            dict: The serial number, SLA, return type and part number of the serial
+        """
+        info, needsDate = self.peekSerial(serial)
+        self.confirmSerial(needsDate)
+        return info
+
+    def createFolders(self, damaged=False):
+        """
+        The folder part of processing a serial: creates the picture folder and, if the RMA is damaged, the damaged folder.
+
+        Args:
+            damaged (bool): Whether the RMA is damaged
 
-    def enterDate(self):
+        Returns:
+            tuple: (folder path, damaged path or "Not Damaged"). While the share is unreachable the folders are
+                spooled and a pending note is returned instead of their paths.
         """
-        Once inside the failure analysis processing screen for a product in an RMA, this method enters the date into the "Other" category. 
+        roots = [os.path.join(self.shareRoot, "RMA_Received_Pictures")]
+        if damaged == True:
+            roots.append(os.path.join(self.shareRoot, "RMA_Damage"))
+
+        with self.timed("folders"):
+            paths = None
+            if self.spool.online:
+                try:
+                    paths = self.folders.provision(self.RMA, *roots)
+                except OSError:
+                    self.spool.markOffline()
+            if paths is None:  # Share unreachable, the folders are created when it is back
+                self.spool.folders(self.RMA, roots)
+                paths = [f"Pending, created once {root} is reachable" for root in roots]
+        if damaged == True:
+            return paths[0], paths[1]
+        return paths[0], "Not Damaged"
+
+    def processSerial(self, serial, damaged=False):
+        """
+        Processes one serial end to end: opens it on the AS400, enters the date if it is not entered yet, reads its
+        information, writes it to the day file and creates the picture (and damaged) folders.
 
         Args:
-            None.
+            serial (str): The serial number to process
+            damaged (bool): Whether the RMA is damaged, creates the damaged folder if True
 
         Returns:
-            Nothing
+            dict: The information shown in the GUI for the serial
         """
-        #Format self.date
-        date = self.dateFormat() 
-        date = f"{date[0]} {date[1]}, {date[2]}"
+        info = self.readSerial(serial)
 
-        #Navigate to the "Other" section
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("right")
-        pa.hotkey("right")
-        pa.hotkey("right")
-        pa.hotkey("right")
+        with self.timed("log"):
+            info["Content Written To"] = self.trackRMA(serial, info["Return Type"], info["Part Number"], info["SLA"], damaged)
 
-        #Write the date into the "Other" section
-        pa.typewrite(f"{date}")
+        info["Folder Path "], info["Damaged Path"] = self.createFolders(damaged)
+        return info
 
-    def deleteDate(self):
+    @timed_stage("finish")
+    def finish(self):
         """
-        ***This method is for testing***
-        Once inside the failure analysis processing screen for a product in an RMA, this method deletes the date in the "Other" category. 
+        Saves the last serial and takes the AS400 back to the Failure Analysis Menu, ready for the next RMA.
 
         Args:
             None.
@@ -459,149 +2505,387 @@ class ProcessRMA(AccessAS400):
         Returns:
             Nothing
         """
-        #Navigates to the "Other" section
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("down")
-        pa.hotkey("right")
-        pa.hotkey("right")
-        pa.hotkey("right")
-        pa.hotkey("right")
+        self.terminal.focus()
+        self.run_macro("finish")
 
-        #Deletes the date
-        pa.hotkey('end') 
-        pa.hotkey('return')
+        self.ledger.flush()
 
-    def screenCopy(self):
-        """
-        ***Helper Method***
-        This method copys the content onto the screen, removes all of the whitespace and then returns a list of everthing that is on the screen when 
-        function is called. 
+class SerialPipeline:
+    """
+    Processes serials in stages so the network share never holds up the AS400.
+
+    The AS400 work of a serial (navigation, date entry, reading the screen) runs on one worker thread, since there
+    is only one session to type into. As soon as it is done the serial moves on to the share: the day file line is
+    written by a single writer thread so the lines keep the serial order, and the folders are created on a small
+    thread pool. Meanwhile the AS400 worker is already on the next serial. At most `maxPending` serials can be waiting
+    for the share, after that the AS400 worker waits for the share to catch up.
 
+    Results are handed back through `deliver`, which the GUI sets to `root.after` so the callbacks run on the Tk thread.
+    """
+
+    def __init__(self, backend, folderWorkers=4, maxPending=32, deliver=None, terminalThread=True, lookAhead=False):
+        """
         Args:
-            None.
+            backend (ProcessRMA): The backend of the RMA being processed
+            folderWorkers (int): Number of threads creating folders on the share
+            maxPending (int): Number of serials that can wait for the share before the AS400 work waits
+            deliver (callable): deliver(callback, *args) runs a callback, the callback is called directly if not given
+            terminalThread (bool): Run the AS400 work on its own thread. If False it runs on the thread calling
+                submit(), which is needed when the terminal can only be used from that thread.
+            lookAhead (bool): Once a serial is shown, open the next serial and read its information right away
+                (see submit()), so it is ready when the operator moves on. Nothing is written to it until then.
 
-        Returns:
-            screenClean (List): List of all content (words, numbers, characters) as a string without whitespace 
+        Returns: Nothing
         """
-        pa.hotkey('ctrl', 'a')
-        pa.hotkey('ctrl', 'c')
-        screen = self.root.clipboard_get()
-        screen = screen.split(" ")
-        screenClean = []
-        for i in screen:
-            if i != "":
-                screenClean.append(i)
-        return screenClean
+        self.backend = backend
+        self.deliver = deliver if deliver is not None else (lambda callback, *args: callback(*args))
+        self.terminalWorker = ThreadPoolExecutor(1, thread_name_prefix="as400") if terminalThread else None
+        self.logWorker = ThreadPoolExecutor(1, thread_name_prefix="daylog")
+        self.folderPool = ThreadPoolExecutor(folderWorkers, thread_name_prefix="folders")
+        self.pending = threading.BoundedSemaphore(maxPending)
+        self.lookAhead = lookAhead
+        self.prefetched = {}  # Serial -> (info, needs date) read ahead by prefetch(), only used on the AS400 worker
+
+    def submit(self, serial, damaged=False, onScreen=None, onDone=None, onError=None, nextSerial=None):
+        """
+        Queues a serial. The callbacks are called through `deliver`.
 
-    def isSLA(self):
+        Args:
+            serial (str): The serial number to process
+            damaged (bool): Whether the RMA is damaged
+            onScreen (callable): onScreen(info) once the AS400 part is done, the share part is still pending
+            onDone (callable): onDone(info) once the day file line is written and the folders exist
+            onError (callable): onError(serial, exception) if any stage fails
+            nextSerial (str): The serial that comes after this one, read ahead when look-ahead is on
         """
-        Checks if the current product is an SLA.
+        if self.terminalWorker is None:
+            self.as400Stage(serial, damaged, onScreen, onDone, onError, nextSerial)
+        else:
+            self.terminalWorker.submit(self.as400Stage, serial, damaged, onScreen, onDone, onError, nextSerial)
 
-        This method scans the screen data for the keyword "SLA" and evaluates the response following it. 
-        If the response is "Y", it indicates that the product is under SLA.
+    def as400Stage(self, serial, damaged, onScreen, onDone, onError, nextSerial=None):
+        try:
+            prefetched = self.prefetched.pop(serial, None)
+            if prefetched is not None:
+                # Already open on the AS400, show it straight away then make the writes the operator confirmed
+                info, needsDate = prefetched
+                if onScreen is not None:
+                    self.deliver(onScreen, dict(info))
+                self.backend.confirmSerial(needsDate)
+            else:
+                info = self.backend.readSerial(serial)
+                if onScreen is not None:
+                    self.deliver(onScreen, dict(info))
+        except Exception as e:
+            if onError is not None:
+                self.deliver(onError, serial, e)
+            return
 
-        Args:
-            None.
+        self.pending.acquire()  # Wait here if the share is too far behind
+        log = self.logWorker.submit(self.logStage, serial, info, damaged)
+        self.folderPool.submit(self.shareStage, info, damaged, log, onDone, onError)
 
-        Returns:
-            str: "Yes" if the product is SLA, otherwise "No".
+        if self.lookAhead and nextSerial is not None:
+            self.prefetch(nextSerial)
+
+    def prefetch(self, serial):
+        """
+        Opens the next serial and reads its information while the operator looks at the current one. If it fails the
+        serial is simply read again when it is submitted.
         """
+        try:
+            self.prefetched = {serial: self.backend.peekSerial(serial)}
+        except Exception:
+            self.prefetched = {}
 
-        screenClean = self.screenCopy()
-        for i in range(len(screenClean)):
-            if screenClean[i] == "SLA":
-                m = screenClean[i+2]
-                if m == "Y":
-                    return "Yes"
-                else:
-                    return "No"
+    def logStage(self, serial, info, damaged):
+        with self.backend.timed("log"):
+            return self.backend.trackRMA(serial, info["Return Type"], info["Part Number"], info["SLA"], damaged)
+
+    def shareStage(self, info, damaged, log, onDone, onError):
+        try:
+            info["Folder Path "], info["Damaged Path"] = self.backend.createFolders(damaged)
+            info["Content Written To"] = log.result()
+        except Exception as e:
+            if onError is not None:
+                self.deliver(onError, info["Serial Number"], e)
+            return
+        finally:
+            self.pending.release()
 
-    def returnType(self):
+        if onDone is not None:
+            self.deliver(onDone, info)
+
+    def close(self, finish=True):
         """
-        Determines the return type associated with the current RMA.
+        Shuts the pipeline down in order: the AS400 work still queued (then the AS400 is taken back to the menu if
+        `finish`), then every pending day file line (and the spool is drained to the share), then every pending folder.
+        Blocks until all of it is done.
 
-        This method scans the screen data for the keyword "RMA#" and retrieves 
-        the type of return listed directly after it.
+        Args:
+            finish (bool): Call the backend's finish() once the last serial is done on the AS400
+        """
+        try:
+            if self.terminalWorker is not None:
+                if finish:
+                    self.terminalWorker.submit(self.backend.finish).result()
+                self.terminalWorker.shutdown(wait=True)
+            elif finish:
+                self.backend.finish()
+            self.logWorker.shutdown(wait=True)
+            self.backend.spool.drain()  # Every line has been spooled, write them out unless the share is unreachable
+            self.backend.checkpoint.complete(self.backend.RMA)  # Kept if serials are left, the next run resumes there
+        finally:
+            self.logWorker.shutdown(wait=True)  # Also when finishing failed, the lines being logged need the ledger
+            self.backend.close()
+        self.folderPool.shutdown(wait=True)
+
+    def closeInBackground(self, onClosed, onError=None, finish=True):
+        """
+        Runs close() on its own thread so the caller (the Tk thread) is not blocked, then calls onClosed() through
+        `deliver`.
+        """
+        def closing():
+            try:
+                self.close(finish)
+            except Exception as e:
+                if onError is not None:
+                    self.deliver(onError, None, e)
+                return
+            self.deliver(onClosed)
+
+        threading.Thread(target=closing, name="pipeline-close", daemon=True).start()
+
+class BatchProcessor:
+    """
+    Processes a list of RMAs unattended, without the GUI and without waiting for the space bar between serials.
+
+    With several AS400 sessions (each its own terminal with its own screen, e.g. separate TN5250 connections) every
+    session runs on its own thread with its own ProcessRMA, and each session takes the next RMA from the list as soon
+    as it is idle.
+    """
+
+    RESULT_FIELDS = ["RMA", "Status", "Serials", "Seconds", "Message", "Session"]
 
+    def __init__(self, terminal=None, output=None, shareRoot=SHARE_ROOT, localDir=LOCAL_DIR, sessions=None):
+        """
         Args:
-            None.
+            terminal (TerminalDriver): The terminal to process the RMAs on, the real AS400 window if not given
+            output (file): Where the per-RMA result records (CSV) are written, stdout if not given
+            shareRoot (str): The share folder, see ProcessRMA
+            localDir (str): The local folder, see ProcessRMA
+            sessions (list): Terminals of independent AS400 sessions to process the RMAs on in parallel, instead of
+                `terminal`. The real AS400 window can't be one of several sessions, it needs the foreground and the
+                clipboard.
 
-        Returns:
-            str: The return type of the RMA (e.g., "Repair", "Replace", etc.)
-                if found, or "Unknown" if not found.
+        Returns: Nothing
+
+        Raises:
+            ValueError: If several sessions are given and one of them is the AS400 window
+        """
+        self.sessions = list(sessions) if sessions else [terminal]
+        if len(self.sessions) > 1 and any(session is None or isinstance(session, PyAutoGuiTerminal)
+                                          for session in self.sessions):
+            raise ValueError("Only sessions with their own screen (TN5250 or simulated) can run in parallel")
+        self.shareRoot = shareRoot
+        self.localDir = localDir
+        self.writer = csv.DictWriter(output if output is not None else sys.stdout, fieldnames=self.RESULT_FIELDS)
+        self.writer.writeheader()
+        self.stats = SessionStats()  # Every stage of every RMA of the batch
+        self.results = []
+        self.lock = threading.Lock()  # Sessions share the writer and the results
+
+    @staticmethod
+    def read_rmas(lines):
         """
-        screenClean = self.screenCopy()
+        Reads the RMAs to process. Each line is an RMA number optionally followed by a comma and a damaged flag
+        (Y/Yes/True/1/Damaged). Blank lines and lines starting with # are skipped.
 
-        for i in range(len(screenClean)):
-            if screenClean[i] == "RMA#":
-                returnType = screenClean[i+2]
-                # print(f"Return Type: {returnType}")
-                return returnType
+        Args:
+            lines (iterable): Lines of a file or of stdin
 
-    def partNum(self):
+        Returns:
+            generator: (RMA (str), damaged (bool)) for every RMA
         """
-        Extracts the part number from the screen data.
+        for row in csv.reader(lines):
+            if not row or not row[0].strip() or row[0].strip().startswith("#"):
+                continue
+            damaged = len(row) > 1 and row[1].strip().lower() in ("y", "yes", "true", "1", "damaged")
+            yield row[0].strip().upper(), damaged
 
-        This method scans the screen data for the keywords "Part" and "Number" 
-        in sequence and retrieves the part number listed after them.
+    def process(self, RMA, damaged=False, session=0):
+        """
+        Runs one RMA end to end and writes its result record.
 
         Args:
-            None.
+            RMA (str): The RMA number
+            damaged (bool): Whether the RMA is damaged
+            session (int): Index of the session (in `self.sessions`) to run it on
 
         Returns:
-            str: The part number if found, or "N/A" (Not Available) if not found.
+            dict: The result record
         """
+        start = time.perf_counter()
+        result = {"RMA": RMA, "Status": "Done", "Serials": 0, "Message": "", "Session": session}
+        backend = None
+        try:
+            openStart = time.perf_counter()
+            backend = ProcessRMA(RMA, self.sessions[session], self.shareRoot, self.localDir)
+            backend.stats.add("open", time.perf_counter() - openStart)
+            self.sessions[session] = backend.terminal.inner  # Reuse the same terminal for the rest of the batch
 
-        screenClean = self.screenCopy()
+            barcodeList = backend.getBarcodes()
 
-        for i in range(len(screenClean)):
-            if screenClean[i] == "Part" and screenClean[i+1] == "Number":
-                partNumber = screenClean[i+3]
-                # print(f"Part Number: {partNumber}")
-                return partNumber
+            if barcodeList == "RMA not open":
+                result["Status"] = "Not open"
+                result["Message"] = "RMA not open or entered incorrectly"
+                backend.finish()
+            else:
+                # Serials received before are processed all the same, the result record lists them
+                duplicates = backend.history.duplicates(barcodeList.queue)
+
+                # The AS400 work stays on this thread (the clipboard belongs to it), the share work overlaps with it
+                pipeline = SerialPipeline(backend, terminalThread=False)
+                errors = []
+                done = []
+                try:
+                    while not barcodeList.empty():
+                        serial = barcodeList.get()
+                        if serial == " ":  # End of the queue marker
+                            break
+                        pipeline.submit(serial, damaged, onDone=done.append,
+                                        onError=lambda serial, e: errors.append(f"{serial}: {e}"))
+                        if errors:
+                            break
+                finally:
+                    with backend.timed("drain"):  # finish() plus waiting for the last share writes
+                        pipeline.close()
+                result["Serials"] = len(done)
+                notes = []
+                if backend.resumed:
+                    notes.append(f"Resumed, {backend.resumed} serial(s) done by an earlier run")
+                if duplicates:
+                    notes.append(f"Received before: {', '.join(sorted(duplicates))}")
+                if backend.history.error:
+                    notes.append(backend.history.error)
+                result["Message"] = "; ".join(notes)
+                if errors:
+                    raise RuntimeError("; ".join(errors))
+        except Exception as e:
+            result["Status"] = "Error"
+            result["Message"] = str(e)
+        finally:
+            if backend is not None:
+                backend.close()  # Already closed by the pipeline unless the RMA was not open or the capture failed
+
+        result["Seconds"] = f"{time.perf_counter() - start:.3f}"
+        with self.lock:
+            if backend is not None:
+                self.stats.merge(backend.stats)
+                backend.stats.export(os.path.join(self.localDir, "stage_timings.jsonl"),
+                                     rma=RMA, serials=result["Serials"], status=result["Status"], session=session)
+            self.writer.writerow(result)
+            self.results.append(result)
+        return result
+
+    def session_worker(self, session, work):
+        """
+        Processes RMAs from the work queue on one session until the queue is empty.
 
-    def dateEntered(self):
+        Args:
+            session (int): Index of the session in `self.sessions`
+            work (Queue): (RMA, damaged) still to process
         """
-        Checks if the date has been entered in other section.
+        while True:
+            try:
+                RMA, damaged = work.get_nowait()
+            except Empty:
+                return
+            self.process(RMA, damaged, session)
 
-        This method scans the screen data for the keywords "Other"
-        in sequence and retrieves whether or not a date has been entered.
+    def run(self, lines):
+        """
+        Processes every RMA in the lines, one after the other or spread over the sessions.
 
         Args:
-            None.
+            lines (iterable): Lines of a file or of stdin, see read_rmas()
 
         Returns:
-            bool: True if date has not been entered, False if date has not been entered.
+            list: The result record of every RMA
         """
-        screenClean = self.screenCopy()
-
-        for i in range(len(screenClean)):
-            if screenClean[i] == "Other:":
-                dateEntered = screenClean[i+1]
-                break
-
-        if dateEntered == "\n":
-            return True
+        start = time.perf_counter()
+        if len(self.sessions) == 1:
+            for RMA, damaged in self.read_rmas(lines):
+                self.process(RMA, damaged)
         else:
-            return False
+            # Every session takes the next RMA as soon as it is idle
+            work = Queue()
+            for item in self.read_rmas(lines):
+                work.put(item)
+            workers = [threading.Thread(target=self.session_worker, args=(session, work), daemon=True)
+                       for session in range(len(self.sessions))]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.elapsed = time.perf_counter() - start
+        return self.results
+
+    def summary(self):
+        """
+        Returns:
+            str: RMAs processed, RMAs/hour, serials/hour and the p50/p95/max time of every stage
+        """
+        done = [result for result in self.results if result["Status"] == "Done"]
+        serials = sum(result["Serials"] for result in self.results)
+        hours = max(self.elapsed, 1e-9) / 3600
+
+        lines = [
+            f"RMAs: {len(self.results)} ({len(done)} done, {len(self.results) - len(done)} not open or failed)",
+            f"Serials: {serials}",
+            f"Elapsed: {self.elapsed:.1f} s   RMAs/hour: {len(self.results) / hours:.1f}   Serials/hour: {serials / hours:.1f}",
+            self.stats.table(),
+        ]
+        spool = ShareSpool.instances.get(os.path.join(self.localDir, "share_spool.sqlite3"))
+        if spool is not None and spool.depth:
+            lines.append(f"Share spool: {spool.depth} write(s) still waiting locally, written out on the next run")
+        return "\n".join(lines)
 
 class GUI(ProcessRMA):
-    def __init__(self):
+    # States of the serial workflow, see transition()
+    IDLE = "idle"                          # Waiting for an RMA number and Start
+    CAPTURING = "capturing"                # Reading the serial numbers of the RMA from the AS400
+    PROCESSING = "processing"              # The current serial is being read from the AS400
+    AWAITING_CONFIRM = "awaiting-confirm"  # Waiting for the operator to press Next
+    DONE = "done"                          # Every serial confirmed, the AS400 and share work is finishing
+
+    def __init__(self, terminal=None, lookAhead=None, shareRoot=SHARE_ROOT, localDir=LOCAL_DIR):
         """
         Initializes the GUI application and sets up the main window.
 
         Args:
-            None.
+            terminal (TerminalDriver): The terminal every RMA is processed on, the real AS400 window if not given
+            lookAhead (bool): Read the next serial from the AS400 while the operator looks at the current one. By
+                default only on terminals that own their screen (TN5250, simulator): with the AS400 window the
+                prefetch keystrokes go to whatever window has the focus, which can be this one.
+            shareRoot (str): The share folder, see ProcessRMA
+            localDir (str): The local folder, see ProcessRMA
         
         Attributes:
             root (tk.Tk): The main Tkinter root window.
             done (bool): Tracks whether the process is completed.
             rma_number_var (tk.StringVar): Stores the user-inputted RMA number.
-            allow_next_step (bool): Flag to control whether the next step can proceed.
+            state (str): Where the serial workflow is, one of IDLE, CAPTURING, PROCESSING, AWAITING_CONFIRM or DONE.
+            state_listeners (list): Callables called with (old state, new state) on every transition.
             backend (ProcessRMA): Backend instance for processing RMA-related tasks.
             current_serial (str): Keeps track of the current serial number being processed.
+            pipeline (SerialPipeline): Runs the AS400 and share work of the serials off the Tk thread.
+            terminal (TerminalDriver): The terminal passed on to every backend instance.
+            lookAhead (bool): Whether the pipeline reads the next serial ahead, None to decide by the terminal.
+            duplicates (dict): Serial -> its earlier receipt, for the serials of the RMA that were received before.
+            acknowledged (set): Flagged serials the operator chose to receive again.
+            spool (ShareSpool): The local spool of the share writes, its depth is shown under the buttons.
+            history (ReceiptHistory): The serials received before.
         """
 
         self.root = tk.Tk()
@@ -613,12 +2897,51 @@ class GUI(ProcessRMA):
 
         # Variables
         self.rma_number_var = tk.StringVar()  # To store user-inputted RMA number
-        self.allow_next_step = False  # Controls whether the next loop step can proceed
+        self.state = GUI.IDLE        # Where the serial workflow is
+        self.state_listeners = []    # Called with (old state, new state) on every transition
         self.backend = None          # Instance of the backend
         self.current_serial = None   # Track the current serial being processed
+        self.pipeline = None         # SerialPipeline of the RMA being processed
+        self.terminal = terminal     # Terminal the backend drives (None = real AS400 window)
+        self.lookAhead = lookAhead   # Prefetch the next serial while the current one is shown (None = by terminal)
+        self.shareRoot = shareRoot   # Where the day files and folders go
+        self.localDir = localDir     # Where the spool, ledger and timings go
+        self.spool = None            # Opened once the window is up, see start_backends()
+        self.history = None          # Same
+        self.duplicates = {}         # Serials of the RMA received before -> their last receipt
+        self.acknowledged = set()    # Flagged serials the operator chose to receive again
 
         # Build the GUI layout
         self.build_gui()
+        self.state_listeners.append(self.update_next_button)
+
+        # Everything else starts once the window is shown
+        self.root.after(0, self.start_backends)
+
+    def start_backends(self):
+        """
+        Opens the share spool and the receiving history and, when the real AS400 window is used, starts importing
+        pyautogui and win32gui in the background. Called once the window is up so none of it delays the window; the
+        first Start waits for whatever is not ready yet.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self.terminal is None:
+            threading.Thread(target=load_automation, name="load-automation", daemon=True).start()
+        self.history = ReceiptHistory.shared(self.shareRoot, self.localDir)  # Loads in the background
+        # Loading errors are reported from the loading thread, show them on the Tk thread
+        self.history.listeners.append(lambda message: self.root.after(0, self.show_history_error, message))
+        if self.history.error:
+            self.show_history_error(self.history.error)
+
+        self.spool = ShareSpool.shared(os.path.join(self.localDir, "share_spool.sqlite3"), ProcessRMA.folders.provision)
+        # The replayer reports from its own thread, show it on the Tk thread
+        self.spool.listeners.append(lambda depth, online: self.root.after(0, self.show_spool_depth, depth, online))
+        self.show_spool_depth(self.spool.depth, self.spool.online)
 
     def build_gui(self):
         """
@@ -702,6 +3025,10 @@ class GUI(ProcessRMA):
         quit_button = tk.Button(self.root, text="Quit", font=("Rockwell", 14), bg="red", fg="white", command=self.root.quit)
         quit_button.pack(pady=10)
 
+        # Day file lines and folders waiting in the local spool for the share
+        self.spool_label = tk.Label(self.root, text="", font=("Rockwell", 11), bg="light blue")
+        self.spool_label.pack(pady=5)
+
         self.prevSerialNumInfo = tk.Label(self.root, text="Previous Serial Number Information", bg="light blue", font=("Rockwell", 14))
         self.prevSerialNumInfo.pack(pady=10)
 
@@ -744,6 +3071,42 @@ class GUI(ProcessRMA):
 
         return text_widget
 
+    def transition(self, state):
+        """
+        Moves the serial workflow to a new state and tells the state listeners.
+
+            IDLE -> CAPTURING                   Start pressed
+            CAPTURING -> AWAITING_CONFIRM       Serial numbers read on the capture thread, waiting for Next
+            CAPTURING -> IDLE                   RMA not open or the capture failed
+            AWAITING_CONFIRM -> PROCESSING      Next pressed, the serial is sent to the pipeline
+            PROCESSING -> AWAITING_CONFIRM      The current serial is shown (or failed)
+            AWAITING_CONFIRM -> DONE            Next pressed after the last serial
+            DONE -> IDLE                        The pipeline finished the RMA
+
+        Args:
+            state (str): The state to move to
+
+        Returns:
+            None.
+        """
+        old, self.state = self.state, state
+        for listener in list(self.state_listeners):
+            listener(old, state)
+
+    def update_next_button(self, old, state):
+        """
+        State listener that only enables Next while the operator has a serial to confirm, so a serial is never
+        skipped before it was shown.
+
+        Args:
+            old (str): The state moved from
+            state (str): The state moved to
+
+        Returns:
+            None.
+        """
+        self.next_button.config(state=tk.NORMAL if state == GUI.AWAITING_CONFIRM else tk.DISABLED)
+
     def start_processing(self):
         """
         Starts the backend RMA processing process, enabling barcode processing.
@@ -752,44 +3115,193 @@ class GUI(ProcessRMA):
         If errors occur (e.g., RMA not open), displays appropriate error messages
         in the GUI.
         """
+        if self.state != GUI.IDLE:  # Enter pressed again while an RMA is being processed
+            return
+
         rma_number = self.rma_number_var.get().strip()
 
         if not rma_number:  # Validation: Check if RMA number is empty
             self.message_label.config(text="Error: RMA number cannot be empty.", fg="red")
             return
 
+        self.transition(GUI.CAPTURING)
+        self.message_label.config(text=f"Reading the serial numbers of {rma_number} from the AS400...", fg="blue")
+        self.start_button.config(state=tk.DISABLED)
+        try:
+            if self.terminal is None:
+                # One terminal for the whole run, its clipboard fallback uses this window's root instead of a new one
+                self.terminal = PyAutoGuiTerminal.shared(self.root)
+        except Exception as e:
+            self.capture_failed(e)
+            return
+
+        # Paging through the RMA takes a while, the window keeps painting meanwhile
+        threading.Thread(target=self.capture, args=(rma_number,), name="as400-capture", daemon=True).start()
+
+    def capture(self, rma_number):
+        """
+        Opens the RMA on the AS400 and reads its serial numbers. Runs on its own thread, the result is handed to
+        capture_done() (or the error to capture_failed()) on the Tk thread.
+
+        Args:
+            rma_number (str): The RMA number
+
+        Returns:
+            None.
+        """
+        backend = None
         try:
-            self.backend = ProcessRMA(rma_number)  # Create the backend instance
-            self.backend.barcodeList = self.backend.getBarcodes()
+            backend = ProcessRMA(rma_number, self.terminal, self.shareRoot, self.localDir)  # Create the backend instance
+            barcodeList = backend.getBarcodes()
+        except Exception as e:
+            if backend is not None:
+                backend.close()
+            self.root.after(0, self.capture_failed, e)
+            return
+        self.root.after(0, self.capture_done, backend, barcodeList)
+
+    def capture_done(self, backend, barcodeList):
+        """
+        Called on the Tk thread once the serial numbers of the RMA are read. Sets up the pipeline and waits for Next.
 
+        Args:
+            backend (ProcessRMA): The backend of the RMA
+            barcodeList (Queue or str): What getBarcodes() returned
+
+        Returns:
+            None.
+        """
+        self.backend = backend
+        self.backend.barcodeList = barcodeList
+        try:
             if self.backend.barcodeList == "RMA not open":
                 self.message_label.config(
                     text="Error: RMA not open or entered incorrectly. Ensure the RMA is open.",
                     fg="red",
                     bg = "white"
                 )
+                self.backend.close()
                 self.backend = None  # Reset backend instance
                 self.start_button.config(state=tk.NORMAL)  # Re-enable the Start button to retry
-                self.next_button.config(state=tk.DISABLED)  # Disable the Next button
+                self.transition(GUI.IDLE)
                 return
             
-            self.message_label.config(text="RMA Serial Number Saved.", fg="blue")
-            
-            # Disable the start button and enable the next step button
-            self.start_button.config(state=tk.DISABLED)
-            self.next_button.config(state=tk.NORMAL)
+            # Flag the serials received before, each one is shown before the AS400 opens it (see allow_next_iteration()).
+            # The Tk thread doesn't wait for the history, the serials not flagged now are looked up again at Next.
+            self.duplicates = self.backend.history.duplicates(self.backend.barcodeList.queue, timeout=0)
+            self.acknowledged = set()
+
+            if self.duplicates:
+                self.message_label.config(
+                    text=f"Warning: {len(self.duplicates)} serial(s) of this RMA were received before.", fg="red")
+            elif not self.backend.history.loaded.is_set():
+                self.message_label.config(
+                    text="Warning: the receiving history is still loading, each serial is checked again at Next.",
+                    fg="red")
+            elif self.backend.history.error:
+                self.message_label.config(text=self.backend.history.error, fg="red")
+            elif self.backend.resumed:
+                self.message_label.config(
+                    text=f"Resuming RMA: {self.backend.resumed} of {len(self.backend.barcodes)} serials already done.",
+                    fg="blue")
+            else:
+                self.message_label.config(text="RMA Serial Number Saved.", fg="blue")
 
-            # Fetch barcodes and start the main processing loop
-            self.backend.getBarcodes()
-            self.root.after(100, self.main_loop)
+            # Serials are processed as Next is pressed, see allow_next_iteration()
+            lookAhead = self.terminal.owns_screen if self.lookAhead is None else self.lookAhead
+            self.pipeline = SerialPipeline(self.backend, deliver=lambda callback, *args: self.root.after(0, callback, *args),
+                                           lookAhead=lookAhead)
+            self.transition(GUI.AWAITING_CONFIRM)
 
         except Exception as e:
-            # Handle any exception during initialization
-            self.message_label.config(text=f"Error starting process: {e}", fg="red")
+            self.capture_failed(e)
+
+    def capture_failed(self, error):
+        """
+        Called on the Tk thread when the RMA could not be opened or read, goes back to waiting for Start.
+
+        Args:
+            error (Exception): What went wrong
+
+        Returns:
+            None.
+        """
+        self.message_label.config(text=f"Error starting process: {error}", fg="red")
+        if self.backend is not None:
+            self.backend.close()
+        self.backend = None
+        self.start_button.config(state=tk.NORMAL)
+        self.transition(GUI.IDLE)
 
     def allow_next_iteration(self):
         """
-        Allows the next iteration in the main processing loop by setting the control variable.
+        Moves on to the next serial number when Next (or Enter/space) is pressed.
+
+        The serial is sent to the pipeline straight away, which reads it from the AS400 and then writes the day file
+        and creates the folders off the Tk thread. Next is ignored until the current serial is shown (the Next button
+        is disabled meanwhile). After the last serial the pipeline finishes the RMA.
+
+        Args:
+            None.
+
+        Returns:
+            None.
+        """
+        if self.state != GUI.AWAITING_CONFIRM:  # Also while the current serial is still being read
+            return
+
+        # Get the next serial from the backend's barcode queue, the empty marker (or an empty queue) ends the RMA
+        queue = self.backend.barcodeList
+        self.current_serial = queue.get() if not queue.empty() else " "
+        if self.current_serial == " ":
+            queue.queue.clear()
+            self.finish_processing()
+            return
+
+        if self.is_flagged(self.current_serial):
+            # Received before: show it without touching the AS400, Next again receives it anyway
+            self.acknowledged.add(self.current_serial)
+            queue.queue.appendleft(self.current_serial)
+            self.show_duplicate(self.current_serial)
+            return
+
+        self.message_label.config(text=f"Processing Serial: {self.current_serial}", fg="blue")
+
+        # The serial after this one is read ahead while the operator looks at this one, unless it is flagged
+        queued = queue.queue
+        next_serial = queued[0] if queued and queued[0] != " " else None
+        if next_serial is not None and self.is_flagged(next_serial):
+            next_serial = None
+
+        # The textbox is filled in once the screen is read and again once the share work is done
+        self.pipeline.submit(self.current_serial, self.rmaDamaged,
+                             onScreen=self.serial_on_screen, onDone=self.show_serial_information,
+                             onError=self.show_serial_error, nextSerial=next_serial)
+        self.transition(GUI.PROCESSING)
+
+    def is_flagged(self, serial):
+        """
+        Whether a serial was received before and the operator wasn't shown that yet. Serials not flagged at Start are
+        looked up again, the history may have finished loading (or another station received them) since.
+
+        Args:
+            serial (str): The serial number
+
+        Returns:
+            bool: True if the serial is to be shown as a duplicate before it is opened
+        """
+        if serial in self.acknowledged:
+            return False
+        if serial not in self.duplicates:
+            receipt = self.backend.history.lookup(serial, timeout=0)  # Never waits on the Tk thread
+            if receipt is None:
+                return False
+            self.duplicates[serial] = receipt
+        return True
+
+    def finish_processing(self):
+        """
+        All barcodes processed, lets the pipeline take the AS400 back to the menu and drain the share writes.
 
         Args:
             None.
@@ -797,7 +3309,10 @@ class GUI(ProcessRMA):
         Returns:
             None.
         """
-        self.allow_next_step = True
+        self.message_label.config(text="Finishing up, writing the last serials...", fg="blue")
+        self.next_button.config(state=tk.DISABLED)  # Disable the "Next Step" button
+        self.transition(GUI.DONE)
+        self.pipeline.closeInBackground(self.processing_finished, onError=self.show_serial_error)
 
 
     def create_dynamic_textbox(self):
@@ -872,18 +3387,30 @@ class GUI(ProcessRMA):
         textbox.configure(state="disabled")  
 
 
-    def main_loop(self):
+    def processing_finished(self):
         """
-        Main processing loop for handling barcode serial numbers.
+        Called on the Tk thread once the pipeline has taken the AS400 back to the menu and every share write is done.
+
+        Args:
+            None.
 
-        This method processes all serial numbers in the backend's barcode queue.
-        For each serial:
-        - Processes the associated backend information.
-        - Sends updates to the dynamic Text widget.
-        - Responds to the user pressing "Next Step" to move to the next serial.
+        Returns:
+            None.
+        """
+        self.pipeline = None
+        self.message_label.config(text="All barcodes processed. Process completed!", fg="green")
+        self.start_button.config(state=tk.NORMAL)  # Re-enable the "Start" button
+        self.show_stage_report()
+            
+        # Uncheck the "RMA is Damaged" checkbox after processing
+        self.rmaDamaged_var.set(False)
+        self.rmaDamaged = False  # Set the internal value to False as well
+        self.transition(GUI.IDLE)
 
-        Stops processing when the barcode queue is empty or an "empty marker"
-        (empty string) is encountered.
+    def show_stage_report(self):
+        """
+        Shows where the time of the RMA went (p50/p95/max of every stage) in the information textbox and appends it
+        to the stage timings file.
 
         Args:
             None.
@@ -891,110 +3418,129 @@ class GUI(ProcessRMA):
         Returns:
             None.
         """
+        stats = self.backend.stats
+        try:
+            stats.export(os.path.join(self.backend.localDir, "stage_timings.jsonl"), rma=self.backend.RMA)
+        except OSError as e:
+            self.message_label.config(text=f"Process completed, but the stage timings could not be written: {e}",
+                                      fg="red")
+
+        report = {"Stage timings of": self.backend.RMA}
+        for stage, row in stats.report().items():
+            report[stage] = (f"{row['count']} x, p50 {1000 * row['p50']:.0f} ms, p95 {1000 * row['p95']:.0f} ms, "
+                             f"max {1000 * row['max']:.0f} ms")
+        for counter, n in stats.counters.items():
+            report[counter.capitalize()] = n
+
+        if not hasattr(self, 'information_textbox'):
+            self.information_textbox = self.create_dynamic_textbox()
+        self.update_dynamic_textbox(self.information_textbox, report)
+
+    def show_spool_depth(self, depth, online):
+        """
+        Shows how many day file lines and folders are waiting in the local spool for the share.
 
-        #Breaks loop and returns if RMA is entered incorrectly or RMA is not open
-        if self.backend == None: 
-            return
-        
-        if self.backend and self.backend.barcodeList and not self.backend.barcodeList.empty():
-
-            # Check if the user has pressed "Next Step"
-            if self.allow_next_step:
-                self.allow_next_step = False  # Reset the control variable
-
-                # Get the next serial from the backend's barcode queue
-                self.current_serial = self.backend.barcodeList.get()
-                self.message_label.config(text=f"Processing Serial: {self.current_serial}", fg="blue")
-
-                # Check if the empty string (marker) is reached
-                if self.current_serial == " ":
-                    self.message_label.config(text="Processing complete.", fg="red")
-                    self.backend.barcodeList.queue.clear()  # Clear the queue to trigger `else`
-                    return self.main_loop()  # Immediately transition to the `else` block
-
-                # Simulate backend processing for the serial (extend as needed)
-                list_of_windows = self.list_window_names()
-                as400 = self.find_as400(list_of_windows)
-                win32gui.SetForegroundWindow(as400)
-
-                pa.hotkey(["return"])
-                pa.typewrite('p')
-                pa.hotkey(["return"])
-                pa.typewrite('r')
-                pa.hotkey(["return"]) 
-                pa.typewrite("I")
-                pa.typewrite(f"{self.current_serial}", interval=0.01)
-                pa.hotkey(["return"])
-                pa.typewrite("s")
-                pa.hotkey("down")
-                pa.hotkey("down")
-                pa.hotkey("down")
-                pa.typewrite("s")
-                pa.hotkey(["return"])
-
-                pa.hotkey('ctrl', 'a')
-                pa.hotkey('ctrl', 'c')
-                screen = self.root.clipboard_get()
-
-                #In the case that to get to the RMA processing screen you need to type OK
-                if "Type OK" in screen:
-                    pa.typewrite("OK")
-
-                if self.backend.dateEntered() == True:
-                    self.backend.enterDate()
-
-                isSLA = self.backend.isSLA()
-                returnType = self.backend.returnType()
-                partNum = self.backend.partNum()
-                informationTxt = self.backend.trackRMA(self.current_serial, returnType, partNum)
-                folderPath = self.backend.create_rma_folder_structure()
-                if self.rmaDamaged == True:
-                    damagedPath = self.backend.createDamagedRmaFolder()
-                else:
-                    damagedPath = "Not Damaged"
-                # If the dynamic textbox doesn’t yet exist, create it
-                if not hasattr(self, 'information_textbox'):
-                    self.information_textbox = self.create_dynamic_textbox()
-
-                # Update the textbox with formatted content
-                info_content_dict = {
-                    "Serial Number": self.current_serial,
-                    "SLA": isSLA,
-                    "Return Type": returnType, 
-                    "Part Number": partNum,
-                    "Content Written To": informationTxt,
-                    "Folder Path " : folderPath,
-                    "Damaged Path" : damagedPath
-                }
-
-                # Call the updated function
-                self.update_dynamic_textbox(self.information_textbox, info_content_dict)
-                
-                # Schedule the next iteration after processing
-                self.root.after(100, self.main_loop)
-            else:
-                # If the user hasn't pressed the "Next Step" button, check again later
-                self.root.after(100, self.main_loop)
+        Args:
+            depth (int): Number of records waiting
+            online (bool): Whether the share can be reached
+
+        Returns:
+            None.
+        """
+        if not online:
+            self.spool_label.config(text=f"Share unreachable: {depth} write(s) kept locally until it is back", fg="red")
+        elif depth:
+            self.spool_label.config(text=f"Share spool: {depth} write(s) waiting", fg="blue")
         else:
-            # All barcodes processed, finish the process
-            self.message_label.config(text="All barcodes processed. Process completed!", fg="green")
-            self.start_button.config(state=tk.NORMAL)  # Re-enable the "Start" button
-            self.next_button.config(state=tk.DISABLED)  # Disable the "Next Step" button
-            list_of_windows = self.list_window_names()
-            as400 = self.find_as400(list_of_windows)
-            win32gui.SetForegroundWindow(as400)
-            pa.hotkey(["return"])
-            pa.typewrite('p')
-            pa.hotkey(["return"])
-            pa.typewrite('r')
-            pa.hotkey(["return"]) 
-            
-            # Uncheck the "RMA is Damaged" checkbox after processing
-            self.rmaDamaged_var.set(False)
-            self.rmaDamaged = False  # Set the internal value to False as well
+            self.spool_label.config(text="Share spool: up to date", fg="black")
+
+    def show_history_error(self, message):
+        """
+        Shows why the receiving history could not be loaded or refreshed, serials received before may not be flagged.
+
+        Args:
+            message (str): The error, see ReceiptHistory.report()
+
+        Returns:
+            None.
+        """
+        self.message_label.config(text=message, fg="red")
+
+    def serial_on_screen(self, info_content_dict):
+        """
+        Called on the Tk thread by the pipeline once a serial is read from the AS400. Shows it and, if it is the
+        current serial, waits for the operator to press Next.
+
+        Args:
+            info_content_dict (dict): Label -> value of the serial
+
+        Returns:
+            None.
+        """
+        self.show_serial_information(info_content_dict)
+        if self.state == GUI.PROCESSING and info_content_dict.get("Serial Number") == self.current_serial:
+            self.transition(GUI.AWAITING_CONFIRM)
+
+    def show_serial_information(self, info_content_dict):
+        """
+        Shows the information of a serial in the information textbox. Called on the Tk thread by the pipeline.
+
+        Args:
+            info_content_dict (dict): Label -> value, share paths not in it yet are shown as pending
+
+        Returns:
+            None.
+        """
+        # If the dynamic textbox doesn’t yet exist, create it
+        if not hasattr(self, 'information_textbox'):
+            self.information_textbox = self.create_dynamic_textbox()
+
+        for label in ("Content Written To", "Folder Path ", "Damaged Path"):
+            info_content_dict.setdefault(label, "Pending...")
+        if info_content_dict.get("Serial Number") in self.duplicates:
+            info_content_dict["Already Received"] = self.duplicates[info_content_dict["Serial Number"]]
+
+        # Update the textbox with formatted content
+        self.update_dynamic_textbox(self.information_textbox, info_content_dict)
+
+    def show_duplicate(self, serial):
+        """
+        Flags a serial that was received before, before it is opened on the AS400.
+
+        Args:
+            serial (str): The serial number
+
+        Returns:
+            None.
+        """
+        self.message_label.config(
+            text=f"Serial {serial} was already received. Press Next to receive it again.", fg="red")
+
+        if not hasattr(self, 'information_textbox'):
+            self.information_textbox = self.create_dynamic_textbox()
+        self.update_dynamic_textbox(self.information_textbox,
+                                    {"Serial Number": serial, "Already Received": self.duplicates[serial]})
+
+    def show_serial_error(self, serial, error):
+        """
+        Shows an error from the pipeline in the message label. Called on the Tk thread by the pipeline.
+
+        Args:
+            serial (str): The serial that failed, None if finishing the RMA failed
+            error (Exception): What went wrong
+
+        Returns:
+            None.
+        """
+        where = f"serial {serial}" if serial is not None else "finishing the RMA"
+        self.message_label.config(text=f"Error processing {where}: {error}", fg="red")
 
-            pa.typewrite('e')
-            pa.hotkey(["return"])
+        if serial is None:
+            self.pipeline = None
+            self.start_button.config(state=tk.NORMAL)
+            self.transition(GUI.IDLE)
+        elif self.state == GUI.PROCESSING and serial == self.current_serial:
+            self.transition(GUI.AWAITING_CONFIRM)  # The operator can move on to the next serial
 
     def run(self):
         #Start the Main Loop
@@ -1002,6 +3548,49 @@ class GUI(ProcessRMA):
 
 
 if __name__ == "__main__":
-    # Create the front-end application instance and run it
-    frontend = GUI()
-    frontend.run()
+    parser = argparse.ArgumentParser(description="RMA Receiving Program")
+    parser.add_argument("--simulate", action="store_true", help="Drive the simulated AS400 instead of the real AS400 window")
+    parser.add_argument("--tn5250", metavar="HOST[:PORT]", help="Connect to the AS400 over TN5250 instead of driving the AS400 window")
+    parser.add_argument("--user", help="User profile to sign on to the AS400 with over TN5250, the password is taken from AS400_PASSWORD or asked for")
+    parser.add_argument("--share-root", default=SHARE_ROOT, help="Folder RMAs_Received, RMA_Received_Pictures and RMA_Damage are in")
+    parser.add_argument("--local-dir", default=LOCAL_DIR, help="Local folder for the spool, the ledger and the stage timings")
+    parser.add_argument("--no-look-ahead", action="store_true", help="Don't read the next serial from the AS400 before Next is pressed (only done with --simulate or --tn5250)")
+    parser.add_argument("--batch", metavar="FILE", help="Process the RMAs listed in FILE (- for stdin) without the GUI, one RMA[,damaged] per line")
+    parser.add_argument("--sessions", type=int, default=1, help="Number of AS400 sessions to run the batch on in parallel (--simulate or --tn5250 only)")
+    parser.add_argument("--batch-output", metavar="FILE", help="Write the batch result records (CSV) to FILE instead of stdout")
+    args = parser.parse_args()
+    if args.sessions > 1 and not (args.batch and (args.simulate or args.tn5250)):
+        parser.error("--sessions needs --batch and --simulate or --tn5250, the AS400 window is a single session")
+    if args.user and not args.tn5250:
+        parser.error("--user needs --tn5250, the AS400 window and the simulator are already signed on")
+
+    terminal = None
+    sessions = []
+    if args.simulate:
+        from as400_simulator import SimulatedAS400, SimulatedTerminal
+        host = SimulatedAS400.generate()
+        sessions = [SimulatedTerminal(host.session()) for _ in range(args.sessions)]
+    elif args.tn5250:
+        from tn5250 import Tn5250Terminal
+        address, _, port = args.tn5250.partition(":")
+        password = None
+        if args.user:
+            # Not an option, it would show in the process list
+            password = os.environ.get("AS400_PASSWORD") or getpass.getpass(f"AS400 password for {args.user}: ")
+        sessions = [Tn5250Terminal(address, int(port or 23), user=args.user, password=password)
+                    for _ in range(args.sessions)]
+    if sessions:
+        terminal = sessions[0]
+
+    if args.batch:
+        # Headless batch mode, the summary goes to stderr so stdout can be redirected to a results file
+        output = open(args.batch_output, "w", newline="") if args.batch_output else sys.stdout
+        source = sys.stdin if args.batch == "-" else open(args.batch)
+        batch = BatchProcessor(terminal, output, args.share_root, args.local_dir, sessions)
+        with source, output:
+            batch.run(source)
+        print(batch.summary(), file=sys.stderr)
+    else:
+        # Create the front-end application instance and run it
+        frontend = GUI(terminal, lookAhead=False if args.no_look_ahead else None, shareRoot=args.share_root, localDir=args.local_dir)
+        frontend.run()
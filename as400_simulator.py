@@ -0,0 +1,604 @@
+import random
+import time
+
+from terminal_driver import TerminalDriver, WindowSystem
+
+"""
+AS400 Screen Simulator
+======================
+
+Description:
+A deterministic, in-process stand-in for the AS400 screens the RMA Receiving Program drives. It reproduces the
+Sign On screen (for sessions opened with a password), the Failure Analysis Menu, the FA02 RMA search and serial list (with "More..."/"Bottom" paging), and the Failure Analysis
+Processing screen (with the "Type OK" prompt and the "Other:" field) on a 24x80 screen.
+
+It lets ProcessRMA and the GUI run headless on any machine, which is what the benchmarks and load tests use.
+
+`tests/tn5250_server.py` serves the same screens over the TN5250 protocol for the client in `tn5250.py`.
+
+Usage:
+    host = SimulatedAS400.generate(rma_count=5, serials_per_rma=50)
+    backend = ProcessRMA("RMA100000", SimulatedTerminal(host))
+
+    python tests/tn5250_server.py --port 2323   (then: python RmaReceivingApplication.py --tn5250 localhost:2323)
+"""
+
+ROWS = 24
+COLS = 80
+
+
+class Field:
+    """
+    An input field on a simulated screen.
+    """
+
+    def __init__(self, name, row, col, length, value=""):
+        """
+        Args:
+            name (str): Name the host uses to read the field back
+            row (int): Screen row of the first character (0 based)
+            col (int): Screen column of the first character (0 based)
+            length (int): Number of characters the field holds
+            value (str): Initial content of the field
+
+        Returns: Nothing
+        """
+        self.name = name
+        self.row = row
+        self.col = col
+        self.length = length
+        self.value = value[:length].ljust(length)
+
+    def text(self):
+        """
+        Returns:
+            str: The content of the field without the trailing blanks
+        """
+        return self.value.rstrip()
+
+
+class SimulatedAS400:
+    """
+    State machine for the simulated AS400 session.
+
+    The host owns the screen, the input fields and the cursor, the same way the emulator does for the real session.
+    Characters typed go into the field the cursor is in; "return", "pagedown", "pageup", "f3" and "f12" are sent to
+    the host which reads the fields and moves to the next screen.
+    """
+
+    AID_KEYS = {"return": "enter", "enter": "enter", "pagedown": "pagedown", "pageup": "pageup", "f3": "f3", "f12": "f12"}
+
+    def __init__(self, receiver="RECEIVER", date="08/27/25", page_size=12):
+        """
+        Initializes an empty host sitting on the Failure Analysis Menu.
+
+        Args:
+            receiver (str): User signed on to the session
+            date (str): System date shown on the screens (MM/DD/YY)
+            page_size (int): Number of serials on one page of the FA02 list
+
+        Returns: Nothing
+        """
+        self.receiver = receiver
+        self.date = date
+        self.page_size = page_size
+
+        self.rmas = {}     # RMA number -> RMA record
+        self.serials = {}  # Serial number -> serial record
+
+        self.state = "menu"
+        self.message = ""
+        self.password = None # Password of the receiver on the Sign On screen, see session()
+        self.rma = None      # RMA listed on the FA02 list
+        self.listed = []     # Serials listed on the FA02 list
+        self.top = 0         # Index of the first serial on the current page of the FA02 list
+        self.serial = None   # Serial open on the processing screen
+        self.listCursor = 0  # Field the cursor starts in on the FA02 list
+        self.cursorField = 0
+        self.cursorOffset = 0
+        self.render()
+
+    @classmethod
+    def generate(cls, rma_count=3, serials_per_rma=30, seed=0, ok_every=7, **kwargs):
+        """
+        Builds a host filled with deterministic RMAs and serials. RMAs are numbered from RMA100000 upwards.
+
+        Args:
+            rma_count (int): Number of RMAs to create
+            serials_per_rma (int): Number of serials in every RMA
+            seed (int): Seed for the random part numbers, SLA flags and assignments
+            ok_every (int): Every nth serial asks for "Type OK" on the processing screen (0 = never)
+            **kwargs: Passed on to SimulatedAS400()
+
+        Returns:
+            SimulatedAS400: The host
+        """
+        rng = random.Random(seed)
+        host = cls(**kwargs)
+        serial = 1000000000 + rng.randrange(1000000)
+        count = 0
+
+        for n in range(rma_count):
+            serials = []
+            for _ in range(serials_per_rma):
+                serial += rng.randrange(1, 50)
+                count += 1
+                serials.append({
+                    "serial": str(serial),
+                    "partNum": f"61-{rng.randrange(10000):04d}-000",
+                    "sla": rng.choice(("Y", "N")),
+                    "needsOk": bool(ok_every) and count % ok_every == 0,
+                })
+            host.add_rma(
+                f"RMA{100000 + n}",
+                serials,
+                returnType=rng.choice(("Repair", "Replace", "Credit", "Evaluate")),
+                assigned=rng.choice((None, "JDOE", "ASMITH")),
+            )
+        return host
+
+    def session(self, password=None):
+        """
+        Opens another session to the same host. The new session shares the RMAs and serials but has its own
+        screen, starting on the Failure Analysis Menu.
+
+        Args:
+            password (str): Start on the Sign On screen instead, where the receiver signs on with this password
+
+        Returns:
+            SimulatedAS400: The new session
+        """
+        session = SimulatedAS400(self.receiver, self.date, self.page_size)
+        session.rmas = self.rmas
+        session.serials = self.serials
+        if password is not None:
+            session.password = password
+            session.state = "signon"
+            session.render()
+        return session
+
+    def sign_on(self, user, password):
+        """
+        Signs the receiver on, from the Sign On screen.
+
+        Returns:
+            bool: True if the user and password are the receiver's, the session is then on the Failure Analysis Menu
+        """
+        if user.upper() != self.receiver:
+            self.message = f"CPF1120 - User {user.upper()} does not exist."
+            return False
+        if password != self.password:
+            self.message = "CPF1107 - Password not correct for user profile."
+            return False
+        self.state = "menu"
+        return True
+
+    def add_rma(self, rma, serials, returnType="Repair", assigned=None, opened="08/20/25"):
+        """
+        Adds an open RMA to the host.
+
+        Args:
+            rma (str): The RMA number
+            serials (list): Serial records, each a dict with "serial" and optionally "partNum", "sla", "needsOk" and "other"
+            returnType (str): Return type shown after the RMA number on the processing screen
+            assigned (str): Who the RMA is assigned to, None if not assigned
+            opened (str): Date the RMA was opened, shown instead of the assignee when not assigned
+
+        Returns: Nothing
+        """
+        self.rmas[rma] = {"returnType": returnType, "assigned": assigned, "opened": opened,
+                          "serials": [record["serial"] for record in serials]}
+        for record in serials:
+            self.serials[record["serial"]] = {
+                "rma": rma,
+                "partNum": record.get("partNum", "61-0000-000"),
+                "sla": record.get("sla", "N"),
+                "needsOk": record.get("needsOk", False),
+                "other": record.get("other", ""),
+            }
+
+    # ----------------------------------------------------------------------------------------------------------
+    # Keyboard
+    # ----------------------------------------------------------------------------------------------------------
+
+    def type(self, char):
+        """
+        Types one character into the field under the cursor. Moves to the next field when the field is full.
+        """
+        if not self.fields:
+            return
+        field = self.fields[self.cursorField]
+        value = list(field.value)
+        value[self.cursorOffset] = char
+        field.value = "".join(value)
+        self.cursorOffset += 1
+        if self.cursorOffset >= field.length:
+            self.move(1)
+
+    def press(self, key):
+        """
+        Presses one key on the terminal. Unknown keys are ignored.
+
+        Args:
+            key (str): The pyautogui name of the key
+        """
+        key = key.lower()
+        if key in self.AID_KEYS:
+            self.aid(self.AID_KEYS[key])
+        elif key in ("down", "tab"):
+            self.move(1)
+        elif key == "up":
+            self.move(-1)
+        elif key == "right" and self.fields:
+            self.cursorOffset = min(self.cursorOffset + 1, self.fields[self.cursorField].length - 1)
+        elif key == "left":
+            self.cursorOffset = max(self.cursorOffset - 1, 0)
+        elif key == "end" and self.fields:  # Erase to the end of the field
+            field = self.fields[self.cursorField]
+            field.value = field.value[:self.cursorOffset].ljust(field.length)
+        elif key == "home":
+            self.cursorField = 0
+            self.cursorOffset = 0
+
+    def move(self, step):
+        """
+        Moves the cursor to the start of the next (step=1) or previous (step=-1) field, wrapping around the screen.
+        """
+        if self.fields:
+            self.cursorField = (self.cursorField + step) % len(self.fields)
+        self.cursorOffset = 0
+
+    def values(self):
+        """
+        Returns:
+            dict: Field name -> field content for every input field on the screen
+        """
+        return {field.name: field.text() for field in self.fields}
+
+    def aid(self, key, values=None):
+        """
+        Sends an attention key to the host together with the content of the input fields, the host then moves to the
+        next screen.
+
+        Args:
+            key (str): "enter", "pagedown", "pageup", "f3" or "f12"
+            values (dict): Field name -> content, the fields on the screen are used if not given
+        """
+        if values is None:
+            values = self.values()
+        self.message = ""
+        getattr(self, f"aid_{self.state}")(key, values)
+        self.render()
+
+    # ----------------------------------------------------------------------------------------------------------
+    # Screens
+    # ----------------------------------------------------------------------------------------------------------
+
+    def render(self):
+        """
+        Builds the lines and the input fields of the current screen.
+        """
+        self.lines = [" " * COLS for _ in range(ROWS)]
+        self.fields = []
+        cursor = getattr(self, f"render_{self.state}")()
+        self.put(23, 1, self.message)
+        self.cursorField = cursor
+        self.cursorOffset = 0
+
+    def put(self, row, col, text):
+        """
+        Writes static text onto the screen being built.
+        """
+        line = self.lines[row]
+        self.lines[row] = (line[:col] + text + line[col + len(text):])[:COLS]
+
+    def field(self, name, row, col, length, value=""):
+        """
+        Adds an input field to the screen being built.
+        """
+        self.fields.append(Field(name, row, col, length, value))
+
+    def screen_lines(self):
+        """
+        Returns:
+            list: The 24 screen rows (80 characters each) with the field contents filled in
+        """
+        lines = list(self.lines)
+        for field in self.fields:
+            line = lines[field.row]
+            lines[field.row] = line[:field.col] + field.value + line[field.col + field.length:]
+        return lines
+
+    def screen_text(self):
+        """
+        Returns:
+            str: The screen the way the emulator copies it to the clipboard, rows separated by newlines
+        """
+        return "\n".join(self.screen_lines())
+
+    def header(self, program, title):
+        """Writes the program name, screen title and system date on the first row."""
+        self.put(0, 1, program)
+        self.put(0, 12, title)
+        self.put(0, 71, self.date)
+
+    def render_signon(self):
+        """Sign On screen, the user and the password are its first two fields."""
+        self.put(0, 36, "Sign On")
+        self.put(1, 48, "System  . . . . . :   SIMAS400")
+        self.put(5, 17, "User  . . . . . . . . . . . . . .")
+        self.field("user", 5, 53, 10)
+        self.put(6, 17, "Password  . . . . . . . . . . . .")
+        self.field("password", 6, 53, 10)
+        self.put(7, 17, "Program/procedure . . . . . . . .")
+        self.field("program", 7, 53, 10)
+        return 0
+
+    def aid_signon(self, key, values):
+        """Enter signs on, the Sign On screen stays with the reason otherwise."""
+        if key == "enter":
+            self.sign_on(values["user"], values["password"])
+
+    def render_menu(self):
+        """Failure Analysis Menu. Returns the index of the field the cursor starts in (same for every render_ method)."""
+        self.put(0, 1, "FAM01")
+        self.put(0, 12, self.receiver)
+        self.put(0, 24, "Failure Analysis Menu")
+        self.put(0, 60, f"{self.date}  10:00:00")
+        self.put(3, 1, "Select one of the following:")
+        self.put(5, 5, "1. Receive RMA")
+        self.put(6, 5, "2. Work with RMA serials (FA02)")
+        self.put(7, 5, "3. Failure analysis inquiry")
+        self.put(20, 1, "Selection or command")
+        self.put(21, 1, "===>")
+        self.field("command", 21, 6, 20)
+        return 0
+
+    def aid_menu(self, key, values):
+        """Option 02 opens FA02, everything else stays on the menu."""
+        command = values["command"].strip().lower()
+        if key != "enter" or command in ("", "e"):
+            return
+        if command in ("2", "02"):
+            self.state = "search"
+        else:
+            self.message = f"Option {command} is not valid."
+
+    def render_search(self):
+        """FA02 search screen: option, location, RMA number and user (prefilled with the signed on user)."""
+        self.header("FA02", "Work with RMA Serials")
+        self.put(2, 1, "Type choices, press Enter.")
+        self.put(4, 3, "Option  . . . . . . . . .")
+        self.field("option", 4, 30, 1)
+        self.put(5, 3, "Location  . . . . . . . .")
+        self.field("location", 5, 30, 4)
+        self.put(6, 3, "RMA number  . . . . . . .")
+        self.field("rma", 6, 30, 10)
+        self.put(7, 3, "User  . . . . . . . . . .")
+        self.field("user", 7, 30, 10, self.receiver)
+        self.put(9, 3, "I=Inquire")
+        self.put(22, 1, "F3=Exit")
+        return 0
+
+    def aid_search(self, key, values):
+        """Lists the serials of the RMA. Nothing is listed if the user field does not match who the RMA is assigned to."""
+        if key == "f3" or values["option"].lower() == "e":
+            self.state = "menu"
+            return
+        if key != "enter":
+            return
+
+        rma = self.rmas.get(values["rma"].upper())
+        user = values["user"]
+        self.rma = values["rma"].upper()
+        self.listed = []
+        if rma is not None and (not user or user == rma["assigned"]):
+            self.listed = rma["serials"]
+        self.top = 0
+        self.state = "list"
+
+    def render_list(self):
+        """FA02 serial list, one page at a time with "More..." or "Bottom" under the last row."""
+        self.header("FA02", "Work with RMA Serials")
+        rma = self.rmas.get(self.rma)
+        note = "" if rma is None else (rma["assigned"] or rma["opened"])
+        self.put(2, 1, f"RMA . . . . . :  {self.rma}")
+        self.put(2, 40, f"Note :  {note}")
+        self.put(3, 1, "Position to/command ===>")
+        self.field("position", 3, 26, 11)
+        self.put(5, 1, "Type options, press Enter.")
+        self.put(6, 3, "s=Select   5=Display")
+        self.put(7, 1, "Opt  Serial      Status")
+
+        page = self.listed[self.top:self.top + self.page_size]
+        for i, serial in enumerate(page):
+            self.field(f"opt{i}", 8 + i, 2, 1)
+            self.put(8 + i, 6, serial)
+            self.put(8 + i, 18, "Received" if self.serials[serial]["other"] else "Open")
+
+        more = self.top + self.page_size < len(self.listed)
+        self.put(8 + self.page_size, 72, "More..." if more else "Bottom")
+        self.put(22, 1, "F3=Exit   F12=Cancel")
+        return self.listCursor
+
+    def aid_list(self, key, values):
+        """Paging, position to a serial (I + serial), select a serial (s) and the e/p/r commands."""
+        self.listCursor = 0
+        if key == "f3":
+            self.state = "menu"
+        elif key == "f12":
+            self.state = "search"
+        elif key == "pagedown":
+            if self.top + self.page_size < len(self.listed):
+                self.top += self.page_size
+            else:
+                self.message = "You have reached the bottom of the list."
+        elif key == "pageup":
+            self.top = max(self.top - self.page_size, 0)
+        elif key == "enter":
+            page = self.listed[self.top:self.top + self.page_size]
+            selected = [page[i] for i in range(len(page)) if values.get(f"opt{i}", "").lower() == "s"]
+            command = values["position"].strip()
+
+            if selected:
+                self.serial = selected[0]
+                self.state = "detail"
+            elif command[:1].upper() == "I" and command[1:].isdigit():
+                if command[1:] in self.listed:
+                    self.top = self.listed.index(command[1:])
+                    self.listCursor = 1  # Cursor goes to the option of the first serial
+                else:
+                    self.message = f"Serial {command[1:]} is not in this RMA."
+            elif command.lower() == "e":
+                self.state = "menu"
+            elif command.lower() in ("p", "r"):
+                self.top = 0
+            elif command:
+                self.message = f"Command {command} is not valid."
+
+    def render_detail(self):
+        """Failure Analysis Processing screen for one serial, with the "Type OK" prompt when the serial needs it."""
+        record = self.serials[self.serial]
+        rma = self.rmas[record["rma"]]
+        self.header("FA03", "Failure Analysis Processing")
+        self.put(2, 1, f"RMA# {record['rma']}")
+        self.put(2, 16, rma["returnType"])
+        self.put(2, 40, f"SLA : {record['sla']}")
+        self.put(3, 1, f"Serial . . . :  {self.serial}")
+        self.put(4, 1, f"Part Number : {record['partNum']}")
+        self.put(6, 1, "Failure code  . .")
+        self.field("failure", 6, 20, 4)
+        self.put(7, 1, "Disposition . . .")
+        self.field("disposition", 7, 20, 4)
+        self.put(8, 1, "Technician  . . .")
+        self.field("technician", 8, 20, 10)
+        self.put(9, 1, "Inspected . . . .")
+        self.field("inspected", 9, 20, 1)
+        self.put(10, 1, "Other:")
+        self.field("other", 10, 8, 30, record["other"])
+        self.put(22, 1, "F12=Cancel")
+
+        if record["needsOk"]:
+            self.put(21, 1, "Unit is outside warranty. Type OK to continue ==>")
+            self.field("ok", 21, 52, 2)
+            return len(self.fields) - 1
+        return 0
+
+    def aid_detail(self, key, values):
+        """Saves the "Other:" field and goes back to the list, unless the "Type OK" prompt has not been answered."""
+        if key == "f12":
+            self.state = "list"
+            return
+        if key != "enter":
+            return
+        record = self.serials[self.serial]
+        if record["needsOk"] and values.get("ok", "").upper() != "OK":
+            self.message = "Type OK to continue."
+            return
+        record["other"] = values["other"].strip()
+        self.top = self.listed.index(self.serial) if self.serial in self.listed else 0
+        self.state = "list"
+
+
+class SimulatedTerminal(TerminalDriver):
+    """
+    TerminalDriver for the simulated AS400. Keys go straight to the host state machine and the screen is read from
+    its buffer, so nothing touches the desktop, the keyboard or the clipboard.
+    """
+
+    supports_fields = True
+    owns_screen = True
+
+    def __init__(self, host=None, key_latency=0.0, read_latency=0.0):
+        """
+        Args:
+            host (SimulatedAS400): The host to drive, a generated one if not given
+            key_latency (float): Seconds every keystroke takes, to model the emulator and the network
+            read_latency (float): Seconds every screen read takes, to model the clipboard round trip
+
+        Returns: Nothing
+        """
+        self.host = host if host is not None else SimulatedAS400.generate()
+        self.key_latency = key_latency
+        self.read_latency = read_latency
+        self.keystrokes = 0  # Counters so benchmarks can report keys and screen reads per serial
+        self.screenReads = 0
+
+    def focus(self):
+        pass
+
+    def send_keys(self, *keys):
+        for key in keys:
+            self.keystrokes += 1
+            if self.key_latency:
+                time.sleep(self.key_latency)
+            self.host.press(key)
+
+    def type_text(self, text, interval=0.0):
+        for char in text:
+            self.keystrokes += 1
+            if self.key_latency:
+                time.sleep(self.key_latency)
+            self.host.type(char)
+
+    def write_field(self, row, col, text):
+        field = next((field for field in self.host.fields if (field.row, field.col) == (row, col)), None)
+        if field is None:
+            raise ValueError(f"There is no input field at row {row}, column {col}")
+        self.keystrokes += 1  # One input event
+        if self.key_latency:
+            time.sleep(self.key_latency)
+        field.value = text[:field.length].ljust(field.length)
+
+    def read_screen(self):
+        self.screenReads += 1
+        if self.read_latency:
+            time.sleep(self.read_latency)
+        return self.host.screen_text()
+
+
+class SimulatedWindowSystem(WindowSystem):
+    """
+    A fake desktop for WindowLocator: a list of (handle, title) top-level windows that can be opened, closed and
+    renamed, counting how many windows are looked at while enumerating.
+    """
+
+    def __init__(self, titles=("Inbox - Outlook", "AS400 Session A", "Untitled - Notepad")):
+        """
+        Args:
+            titles (iterable): Titles of the windows on the desktop, in enumeration order
+
+        Returns: Nothing
+        """
+        self.windows = {}
+        self.nextHandle = 0x10000
+        self.enumerations = 0  # Times find() was called
+        self.visited = 0       # Windows looked at by find()
+        for title in titles:
+            self.open(title)
+
+    def open(self, title):
+        """
+        Returns:
+            int: The handle of the new window
+        """
+        self.nextHandle += 0x10
+        self.windows[self.nextHandle] = title
+        return self.nextHandle
+
+    def close(self, hwnd):
+        self.windows.pop(hwnd, None)
+
+    def is_window(self, hwnd):
+        return hwnd in self.windows
+
+    def title(self, hwnd):
+        return self.windows[hwnd]
+
+    def find(self, match):
+        self.enumerations += 1
+        for hwnd, title in self.windows.items():
+            self.visited += 1
+            if match(title):
+                return hwnd
+        return None
@@ -0,0 +1,258 @@
+import argparse
+import builtins
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from RmaReceivingApplication import ProcessRMA, ReceiptHistory, SerialPipeline
+from as400_simulator import SimulatedAS400, SimulatedTerminal
+
+"""
+RMA Receiving Benchmarks
+========================
+
+Description:
+Runs the whole RMA flow (getBarcodes, then every serial the way the GUI processes it through the SerialPipeline:
+AS400 screens, trackRMA and the folder structure) against the simulated AS400 and a temporary folder standing in for
+`\\\\panther`. Keystroke, clipboard and filesystem latency can be added to model the real emulator and share.
+
+Every scenario reports serials/second plus keystrokes, screen reads and filesystem calls per serial, and is compared
+with the stored baseline (`benchmark_baseline.json`). The startup time (importing RmaReceivingApplication in a new
+interpreter, everything that happens before the GUI's window can be built) is measured and compared as well. The counts are deterministic, serials/second depends on the
+machine, so save a new baseline with --save-baseline when moving to another machine.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --scenario 50 --key-latency 0.002 --read-latency 0.03 --fs-latency 0.005
+    python benchmark.py --save-baseline
+"""
+
+SCENARIOS = {f"{serials}{'-damaged' if damaged else ''}": (serials, damaged)
+             for serials in (1, 50, 1000) for damaged in (False, True)}
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+METRICS = ["serials_per_second", "keystrokes_per_serial", "screen_reads_per_serial", "fs_calls_per_serial"]
+STARTUP_CODE = "import time; start = time.perf_counter(); import RmaReceivingApplication; print(time.perf_counter() - start)"
+
+
+class FilesystemProbe:
+    """
+    Counts the filesystem calls made under a folder (stat, mkdir, scandir, listdir, open, remove, replace and fsync)
+    and adds latency to each of them, while in a `with` block. os.path.exists and os.makedirs are counted through
+    the stat and mkdir calls they make.
+    """
+
+    CALLS = ["stat", "mkdir", "scandir", "listdir", "remove", "replace"]
+
+    def __init__(self, root, latency=0.0):
+        """
+        Args:
+            root (str): Only calls on paths under this folder are counted
+            latency (float): Seconds added to every counted call
+
+        Returns: Nothing
+        """
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.originals = {}
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def counted(self, name, function):
+        def probe(path=".", *args, **kwargs):
+            if isinstance(path, (str, bytes, os.PathLike)) and os.fspath(path).startswith(self.root):
+                with self.lock:
+                    self.counts[name] = self.counts.get(name, 0) + 1
+                if self.latency:
+                    time.sleep(self.latency)
+            return function(path, *args, **kwargs)
+        return probe
+
+    def __enter__(self):
+        for name in self.CALLS:
+            self.originals[name] = getattr(os, name)
+            setattr(os, name, self.counted(name, self.originals[name]))
+        self.originals["open"] = builtins.open
+        builtins.open = self.counted("open", self.originals["open"])
+        self.originals["fsync"] = os.fsync
+
+        def fsync(fd):
+            with self.lock:
+                self.counts["fsync"] = self.counts.get("fsync", 0) + 1
+            if self.latency:
+                time.sleep(self.latency)
+            return self.originals["fsync"](fd)
+        os.fsync = fsync
+        return self
+
+    def __exit__(self, *exc):
+        builtins.open = self.originals.pop("open")
+        for name, function in self.originals.items():
+            setattr(os, name, function)
+        self.originals = {}
+        return False
+
+
+def run_scenario(serials, damaged=False, key_latency=0.0, read_latency=0.0, fs_latency=0.0):
+    """
+    Processes one RMA with the given number of serials from Start to the last serial.
+
+    Args:
+        serials (int): Number of serials in the RMA
+        damaged (bool): Whether the RMA is damaged (creates the RMA_Damage folders as well)
+        key_latency (float): Seconds per keystroke
+        read_latency (float): Seconds per screen (clipboard) read
+        fs_latency (float): Seconds per filesystem call on the share
+
+    Returns:
+        dict: The metrics of the run, see METRICS, plus "serials", "seconds" and "fs_calls" (count per call)
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        share = os.path.join(folder, "panther")
+        local = os.path.join(folder, "local")
+        host = SimulatedAS400.generate(rma_count=1, serials_per_rma=serials)
+        terminal = SimulatedTerminal(host, key_latency, read_latency)
+        errors = []
+
+        # The receiving history is loaded once per program, not per RMA, and the share has no history to refresh
+        history = ReceiptHistory.instances[(share, local)] = ReceiptHistory(share, local, refresh=False)
+        history.wait()
+
+        with FilesystemProbe(share, fs_latency) as probe:
+            start = time.perf_counter()
+            backend = ProcessRMA("RMA100000", terminal, share, local)
+            barcodes = [serial for serial in list(backend.getBarcodes().queue) if serial != " "]
+            pipeline = SerialPipeline(backend, lookAhead=True)
+            for i, serial in enumerate(barcodes):
+                nextSerial = barcodes[i + 1] if i + 1 < len(barcodes) else None
+                pipeline.submit(serial, damaged, onError=lambda serial, e: errors.append(f"{serial}: {e}"),
+                                nextSerial=nextSerial)
+            pipeline.close()
+            seconds = time.perf_counter() - start
+        backend.spool.close()
+        history.close()
+
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        if len(barcodes) != serials:
+            raise RuntimeError(f"Captured {len(barcodes)} of {serials} serials")
+
+    return {
+        "serials": serials,
+        "seconds": seconds,
+        "serials_per_second": serials / seconds,
+        "keystrokes_per_serial": terminal.keystrokes / serials,
+        "screen_reads_per_serial": terminal.screenReads / serials,
+        "fs_calls_per_serial": probe.total() / serials,
+        "fs_calls": dict(sorted(probe.counts.items())),
+    }
+
+
+def measure_startup():
+    """
+    Imports RmaReceivingApplication in a new interpreter.
+
+    Returns:
+        float: Seconds the import took
+    """
+    output = subprocess.run([sys.executable, "-c", STARTUP_CODE], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+
+def compare(result, baseline, tolerance, speedTolerance):
+    """
+    Compares a run with its baseline. The counts may not grow by more than `tolerance` and serials/second may not
+    drop by more than `speedTolerance` (timings of short runs are noisy, the counts are not).
+
+    Args:
+        result (dict): The run, from run_scenario()
+        baseline (dict): The baseline of the same scenario
+        tolerance (float): Allowed growth of the counts as a fraction (0.1 = 10%)
+        speedTolerance (float): Allowed drop of serials/second as a fraction
+
+    Returns:
+        list: A description of every regression, empty if there is none
+    """
+    regressions = []
+    for metric in METRICS:
+        if metric not in baseline:
+            continue
+        old, new = baseline[metric], result[metric]
+        if metric == "serials_per_second":
+            worse = new < old * (1 - speedTolerance)
+        else:
+            worse = new > old * (1 + tolerance)
+        if worse:
+            regressions.append(f"{metric} {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the RMA flow against the simulated AS400")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run (serial count, -damaged for a damaged RMA), every scenario if not given")
+    parser.add_argument("--key-latency", type=float, default=0.0, help="Seconds per keystroke")
+    parser.add_argument("--read-latency", type=float, default=0.0, help="Seconds per screen (clipboard) read")
+    parser.add_argument("--fs-latency", type=float, default=0.0, help="Seconds per filesystem call on the share")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario, the fastest one is reported")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed growth of the per-serial counts")
+    parser.add_argument("--speed-tolerance", type=float, default=0.4, help="Allowed drop of serials/second")
+    args = parser.parse_args()
+
+    settings = {"key_latency": args.key_latency, "read_latency": args.read_latency, "fs_latency": args.fs_latency}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print(f"Baseline was recorded with {baseline.get('settings')}, not comparing", file=sys.stderr)
+            baseline = {}
+
+    startup = min(measure_startup() for _ in range(max(1, args.repeat)))
+    oldStartup = baseline.get("startup_seconds")
+    verdict = "-"
+    regressed = False
+    if oldStartup is not None:
+        regressed = startup > oldStartup * (1 + args.speed_tolerance)
+        verdict = f"{startup / oldStartup - 1:+.0%}" + (f"  REGRESSION: startup {1000 * oldStartup:.0f} ms -> "
+                                                        f"{1000 * startup:.0f} ms" if regressed else "")
+    print(f"Startup: {1000 * startup:.0f} ms  vs baseline {verdict}")
+
+    print(f"{'Scenario':<14} {'Serials/s':>10} {'Keys/serial':>12} {'Reads/serial':>13} {'FS calls/serial':>16}  vs baseline")
+    results = {}
+    for name in args.scenario or list(SCENARIOS):
+        serials, damaged = SCENARIOS[name]
+        runs = [run_scenario(serials, damaged, **settings) for _ in range(max(1, args.repeat))]
+        result = max(runs, key=lambda run: run["serials_per_second"])
+        results[name] = result
+
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            verdict = "-"
+        else:
+            regressions = compare(result, old, args.tolerance, args.speed_tolerance)
+            regressed = regressed or bool(regressions)
+            change = result["serials_per_second"] / old["serials_per_second"] - 1
+            verdict = f"{change:+.0%} serials/s" + (f"  REGRESSION: {', '.join(regressions)}" if regressions else "")
+        print(f"{name:<14} {result['serials_per_second']:>10.1f} {result['keystrokes_per_serial']:>12.1f} "
+              f"{result['screen_reads_per_serial']:>13.2f} {result['fs_calls_per_serial']:>16.2f}  {verdict}")
+
+    if args.save_baseline:
+        scenarios = baseline.get("scenarios", {}) if baseline else {}
+        scenarios.update({name: {metric: round(result[metric], 3) for metric in METRICS}
+                          for name, result in results.items()})
+        with open(args.baseline, "w") as f:
+            json.dump({"settings": settings, "startup_seconds": round(startup, 4), "scenarios": scenarios}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+
+    sys.exit(1 if regressed else 0)
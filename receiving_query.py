@@ -0,0 +1,250 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+"""
+RMAs Received Query Tool
+========================
+
+Description:
+Answers "when was this serial / RMA / part number received" from the `Mon DD, YYYY.txt` day files that
+`ProcessRMA.trackRMA` writes under `RMAs_Received\\YEAR\\Mon`, without reading every day file for every question.
+
+The day files are parsed once, line by line, into an inverted index (serial, RMA and part number -> lines) kept in
+a local SQLite file. Before each query the index is brought up to date using the size and modification time of
+each day file: unchanged files are skipped, files that only grew (day files are append-only) are parsed from where
+the last update stopped, and anything else (a truncated or rewritten file) is parsed again. Each day file is
+committed on its own.
+
+Usage:
+    python receiving_query.py --serial 1000886439
+    python receiving_query.py --rma RMA100001
+    python receiving_query.py --part 61-9663-000 --from 2025-08-01 --to 2025-08-31
+"""
+
+RECEIVED_PATH = r"\\panther\RMA\RMA_Repairs\RMAs_Received"
+INDEX_PATH = os.path.join(os.path.expanduser("~"), "RmaReceiving", "received_index.sqlite3")
+
+MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+          "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+DAY_FILE_PATTERN = re.compile(r"^(?P<month>[A-Z][a-z]{2}) (?P<day>\d{1,2}), (?P<year>\d{4})\.txt$")
+
+# RMA#: {RMA}   Type: {returnType}   S/N: {serial}<tab>P/N: {partNum}<tab>Assigned To: {assignedTo}<tab>Received by: {receiver}
+LINE_PATTERN = re.compile(
+    r"RMA#: (?P<rma>\S*)\s+Type: (?P<returnType>.*?)\s+S/N: (?P<serial>\S*)\s*\tP/N: (?P<partNum>[^\t]*)"
+    r"\tAssigned To: (?P<assignedTo>[^\t]*)\tReceived by: (?P<receiver>.*)"
+)
+
+
+def day_files(root):
+    """
+    Walks the year/month folders under the root.
+
+    Args:
+        root (str): The RMAs_Received folder
+
+    Returns:
+        generator: (path, day (YYYY-MM-DD), modification time, size) for every day file
+    """
+    for year in os.scandir(root):
+        if not (year.is_dir() and year.name.isdigit()):
+            continue
+        for month in os.scandir(year.path):
+            if not month.is_dir():
+                continue
+            for entry in os.scandir(month.path):
+                match = DAY_FILE_PATTERN.match(entry.name)
+                if match is None or match["month"] not in MONTHS or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                day = f"{match['year']}-{MONTHS[match['month']]:02d}-{int(match['day']):02d}"
+                yield entry.path, day, stat.st_mtime, stat.st_size
+
+
+def parse_lines(path, start=0):
+    """
+    Reads the complete lines of a day file from a byte offset on. A line still being written (no newline yet) is
+    left for the next update.
+
+    Args:
+        path (str): Path of the day file
+        start (int): Byte offset to start at
+
+    Returns:
+        generator: (offset of the line, offset after the line, the line as a dict of its fields plus "text") for
+        every line. Lines that don't match the day file format are returned with only "text".
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                return
+            text = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            match = LINE_PATTERN.search(text)
+            fields = match.groupdict() if match else {}
+            fields["text"] = text
+            yield offset, offset + len(raw), fields
+            offset += len(raw)
+
+
+class ReceivedIndex:
+    """
+    Inverted index over the day files, stored in a local SQLite file.
+    """
+
+    def __init__(self, root=RECEIVED_PATH, path=INDEX_PATH):
+        """
+        Opens (and creates if needed) the index.
+
+        Args:
+            root (str): The RMAs_Received folder the day files are in
+            path (str): Path of the index file
+
+        Returns: Nothing
+        """
+        self.root = root
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)  # Callers serialize their own access
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, day TEXT, mtime REAL, size INTEGER)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS lines (id INTEGER PRIMARY KEY, path TEXT, day TEXT, offset INTEGER, "
+                "rma TEXT, serial TEXT, part_number TEXT, text TEXT)")
+            for column in ("serial", "rma", "part_number", "day", "path"):
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS lines_{column} ON lines ({column})")
+
+    def update(self):
+        """
+        Brings the index up to date with the day files.
+
+        Returns:
+            int: Number of lines added to the index
+        """
+        known = {path: (mtime, size) for path, mtime, size in self.connection.execute("SELECT path, mtime, size FROM files")}
+        seen = set()
+        added = 0
+
+        # One transaction per day file, a walk that fails half way (the share dropped) keeps the files done so far
+        for path, day, mtime, size in day_files(self.root):
+            seen.add(path)
+            start = 0
+            if path in known:
+                oldMtime, oldSize = known[path]
+                if oldMtime == mtime and oldSize == size:
+                    continue
+                if size >= oldSize and self.unchanged_until(path, oldSize):
+                    start = oldSize  # Day files are only appended to, parse the new part
+
+            end = start
+            rows = []
+            for offset, end, fields in parse_lines(path, start):
+                rows.append((path, day, offset, fields.get("rma"), fields.get("serial"), fields.get("partNum"),
+                             fields["text"]))
+            with self.connection:
+                if start == 0:  # New, truncated or rewritten
+                    self.connection.execute("DELETE FROM lines WHERE path = ?", (path,))
+                self.connection.executemany(
+                    "INSERT INTO lines (path, day, offset, rma, serial, part_number, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows)
+                # Remember where the complete lines end so a half written line is parsed next time
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files (path, day, mtime, size) VALUES (?, ?, ?, ?)",
+                    (path, day, mtime if end == size else None, end))
+            added += len(rows)
+
+        for path in set(known) - seen:  # Day file deleted
+            with self.connection:
+                self.connection.execute("DELETE FROM lines WHERE path = ?", (path,))
+                self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        return added
+
+    def unchanged_until(self, path, size):
+        """
+        Checks that the last line indexed for a day file is still where it was, i.e. the file was appended to and
+        not rewritten.
+
+        Args:
+            path (str): Path of the day file
+            size (int): Where the indexed lines end
+
+        Returns:
+            bool: True if the first `size` bytes can be kept
+        """
+        last = self.connection.execute(
+            "SELECT offset, text FROM lines WHERE path = ? ORDER BY offset DESC LIMIT 1", (path,)).fetchone()
+        if last is None:
+            return True
+        offset, text = last
+        with open(path, "rb") as f:
+            f.seek(offset)
+            raw = f.read(size - offset)
+        return raw.endswith(b"\n") and raw.decode("utf-8", errors="replace").rstrip("\r\n") == text
+
+    def query(self, serial=None, rma=None, part=None, start=None, end=None):
+        """
+        Finds the lines matching every filter given.
+
+        Args:
+            serial (str): Serial number
+            rma (str): RMA number
+            part (str): Part number
+            start (str): First day to include (YYYY-MM-DD)
+            end (str): Last day to include (YYYY-MM-DD)
+
+        Returns:
+            list: (day, line text) for every matching line, oldest first
+        """
+        conditions = []
+        values = []
+        for column, value in (("serial", serial), ("rma", rma), ("part_number", part)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        if start is not None:
+            conditions.append("day >= ?")
+            values.append(start)
+        if end is not None:
+            conditions.append("day <= ?")
+            values.append(end)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.connection.execute(f"SELECT day, text FROM lines {where} ORDER BY day, path, offset", values).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the RMAs received day files")
+    parser.add_argument("--serial", help="Serial number to look for")
+    parser.add_argument("--rma", help="RMA number to look for")
+    parser.add_argument("--part", help="Part number to look for")
+    parser.add_argument("--from", dest="start", metavar="YYYY-MM-DD", help="First day to include")
+    parser.add_argument("--to", dest="end", metavar="YYYY-MM-DD", help="Last day to include")
+    parser.add_argument("--root", default=RECEIVED_PATH, help="The RMAs_Received folder")
+    parser.add_argument("--index", default=INDEX_PATH, help="Where the index is kept")
+    parser.add_argument("--rebuild", action="store_true", help="Throw the index away and parse every day file again")
+    args = parser.parse_args()
+
+    if not any((args.serial, args.rma, args.part, args.start, args.end)):
+        parser.error("give at least one of --serial, --rma, --part, --from or --to")
+
+    if args.rebuild and os.path.exists(args.index):
+        os.remove(args.index)
+
+    start = time.perf_counter()
+    index = ReceivedIndex(args.root, args.index)
+    added = index.update()
+    rows = index.query(args.serial, args.rma and args.rma.upper(), args.part, args.start, args.end)
+    index.close()
+
+    for day, text in rows:
+        print(f"{day}\t{text}")
+    print(f"{len(rows)} line(s), {added} new line(s) indexed, {time.perf_counter() - start:.3f} s", file=sys.stderr)
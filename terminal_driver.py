@@ -0,0 +1,162 @@
+import time
+
+"""
+Terminal Interfaces
+===================
+
+Description:
+The interfaces between the RMA Receiving Program and the outside world it drives: `TerminalDriver` for the AS400
+session and `WindowSystem` for the desktop the AS400 window is found on.
+
+They live in their own module so the terminals (`RmaReceivingApplication.PyAutoGuiTerminal`, `tn5250.py` and
+`as400_simulator.py`) can all import them without importing each other. Importing them from
+RmaReceivingApplication while it runs as the main program would load it a second time, with its own copy of every
+class.
+"""
+
+
+class TerminalDriver:
+    """
+    Interface between the program and the AS400 terminal. Everything the program does to the AS400 goes through
+    these four methods so the real emulator window can be swapped for the simulator in `as400_simulator.py`.
+
+    Key names are the pyautogui key names ("return", "down", "pagedown", "end", ...).
+    """
+
+    supports_fields = False  # True if write_field() can address input fields directly
+    owns_screen = False      # True if the session is not a window on the desktop, so keys can't end up elsewhere
+
+    def focus(self):
+        """
+        Brings the AS400 session to the foreground so it receives the keys that are sent.
+        """
+        raise NotImplementedError
+
+    def send_keys(self, *keys):
+        """
+        Presses each key in order.
+
+        Args:
+            *keys (str): The names of the keys to press
+        """
+        raise NotImplementedError
+
+    def type_text(self, text, interval=0.0):
+        """
+        Types the text into the field the cursor is in.
+
+        Args:
+            text (str): The text to type
+            interval (float): Seconds to wait between characters
+        """
+        raise NotImplementedError
+
+    def send_input(self, events):
+        """
+        Sends a burst of input in one go. Terminals that can batch input override this, the default sends each run
+        of keys and each text in order.
+
+        Args:
+            events (list): ("key", name) and ("text", text, interval) tuples, see Macro
+        """
+        keys = []
+        for event in events:
+            if event[0] == "key":
+                keys.append(event[1])
+                continue
+            if keys:
+                self.send_keys(*keys)
+                keys = []
+            self.type_text(event[1], event[2])
+        if keys:
+            self.send_keys(*keys)
+
+    def write_field(self, row, col, text):
+        """
+        Writes straight into the input field that starts at a screen position, without moving the cursor. Only
+        available when `supports_fields` is True.
+
+        Args:
+            row (int): Row of the first character of the field (0 based)
+            col (int): Column of the first character of the field (0 based)
+            text (str): New content of the field
+
+        Raises:
+            ValueError: If there is no input field at that position
+        """
+        raise NotImplementedError
+
+    def read_screen(self):
+        """
+        Reads everything that is currently on the screen.
+
+        Returns:
+            str: The screen content, one line per screen row
+        """
+        raise NotImplementedError
+
+    def wait_for_screen(self, predicate, timeout=10.0):
+        """
+        Reads the screen until the host has rendered the expected screen. Polls quickly at first and backs off
+        the longer the host takes, so a navigation step continues as soon as the screen is ready.
+
+        Args:
+            predicate (str, tuple or callable): A marker that must be on the screen (e.g. "Other:"), a tuple of
+                markers where any one of them is enough, or a function that takes the screen text and returns a bool
+            timeout (float): Seconds to wait before giving up
+
+        Returns:
+            str: The screen that satisfied the predicate
+
+        Raises:
+            TimeoutError: If the screen did not appear within `timeout` seconds
+        """
+        if isinstance(predicate, str):
+            markers = (predicate,)
+            predicate = lambda text: any(marker in text for marker in markers)
+        elif isinstance(predicate, (tuple, list)):
+            markers = tuple(predicate)
+            predicate = lambda text: any(marker in text for marker in markers)
+
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while True:
+            screen = self.read_screen()
+            if predicate(screen):
+                return screen
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"The AS400 did not show the expected screen within {timeout} seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+
+class WindowSystem:
+    """
+    The three window questions WindowLocator asks, so a fake desktop can stand in for win32gui.
+    """
+
+    def is_window(self, hwnd):
+        """
+        Returns:
+            bool: Whether the handle still belongs to a window
+        """
+        raise NotImplementedError
+
+    def title(self, hwnd):
+        """
+        Returns:
+            str: The title of the window
+        """
+        raise NotImplementedError
+
+    def find(self, match):
+        """
+        Enumerates the visible top-level windows until one matches.
+
+        Args:
+            match (callable): Takes a window title and returns a bool
+
+        Returns:
+            int: The handle of the first matching window, or None if no window matches
+        """
+        raise NotImplementedError
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RmaReceivingApplication as app
+from as400_simulator import SimulatedAS400, SimulatedTerminal
+from tn5250_server import Tn5250Server
+
+"""
+Fixtures shared by the tests. Everything runs against the simulated AS400 (directly or over the TN5250 test
+server) with the share and the local folder in a temporary directory, so the tests run on any machine.
+"""
+
+
+@pytest.fixture
+def host():
+    return SimulatedAS400.generate(rma_count=2, serials_per_rma=30)
+
+
+@pytest.fixture
+def terminal(host):
+    return SimulatedTerminal(host)
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    """
+    (share root, local folder) of one test. The spools and histories opened on them are closed afterwards.
+    """
+    share, local = str(tmp_path / "share"), str(tmp_path / "local")
+    yield share, local
+    for history in list(app.ReceiptHistory.instances.values()):
+        history.close()
+    for spool in list(app.ShareSpool.instances.values()):
+        spool.close()
+
+
+@pytest.fixture
+def tn5250_address(host):
+    """
+    Serves the host over TN5250 on a free local port for the length of the test.
+    """
+    server = Tn5250Server(host)
+    yield server.start()
+    server.stop()
+
+
+@pytest.fixture
+def tn5250_server(host):
+    """
+    Starts TN5250 servers of the host with the options given (see Tn5250Server), stopped after the test.
+
+    Returns:
+        function: start(**options) -> (the server, its address)
+    """
+    servers = []
+
+    def start(**options):
+        server = Tn5250Server(host, **options)
+        servers.append(server)
+        return server, server.start()
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def open_list(terminal, dirs, RMA="RMA100000"):
+    """
+    Opens an RMA and captures its serials.
+
+    Returns:
+        tuple: (the ProcessRMA, its serials)
+    """
+    backend = app.ProcessRMA(RMA, terminal, *dirs)
+    return backend, serials_of(backend.getBarcodes())
+
+
+def serials_of(queue):
+    """
+    The serials of a getBarcodes() queue, without the end marker.
+    """
+    return [serial for serial in list(queue.queue) if serial != " "]
+
+
+def receive(backend, serials, lookAhead=False, damaged=False):
+    """
+    Receives the serials on a SerialPipeline the way the GUI does, then closes it.
+
+    Returns:
+        tuple: (information of every serial done, "serial: error" of every serial that failed)
+    """
+    done, errors = [], []
+    pipeline = app.SerialPipeline(backend, lookAhead=lookAhead)
+    for i, serial in enumerate(serials):
+        pipeline.submit(serial, damaged, onDone=done.append, onError=lambda serial, e: errors.append(f"{serial}: {e}"),
+                        nextSerial=serials[i + 1] if i + 1 < len(serials) else None)
+    pipeline.close()
+    return done, errors
@@ -0,0 +1,74 @@
+import csv
+import io
+
+import pytest
+
+import RmaReceivingApplication as app
+from RmaReceivingApplication import BatchProcessor, ProcessRMA
+from as400_simulator import SimulatedAS400, SimulatedTerminal
+from conftest import open_list
+
+
+@pytest.fixture
+def batch_host():
+    return SimulatedAS400.generate(rma_count=6, serials_per_rma=10)
+
+
+def test_read_rmas():
+    lines = ["RMA100000", "", "# comment", "RMA100001, damaged", "rma100002,yes"]
+    assert list(BatchProcessor.read_rmas(lines)) == [("RMA100000", False), ("RMA100001", True), ("RMA100002", True)]
+
+
+def test_batch_results(batch_host, dirs):
+    output = io.StringIO()
+    batch = BatchProcessor(SimulatedTerminal(batch_host), output, *dirs)
+    batch.run(["RMA100000", "RMA100001,damaged"])
+
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert [(row["RMA"], row["Status"], row["Serials"]) for row in rows] == [
+        ("RMA100000", "Done", "10"), ("RMA100001", "Done", "10")]
+    assert batch_host.state == "menu"
+
+
+def test_rma_not_open(batch_host, dirs):
+    batch = BatchProcessor(SimulatedTerminal(batch_host), io.StringIO(), *dirs)
+    batch.run(["RMA999999", "RMA100000"])
+    assert [result["Status"] for result in batch.results] == ["Not open", "Done"]
+
+
+def test_failed_rma_does_not_fail_the_next(batch_host, dirs, monkeypatch):
+    finish = ProcessRMA.finish
+    failures = []
+
+    def finish_once(backend):
+        # The first RMA fails before it takes the AS400 back to the menu, the list is still shown
+        if not failures:
+            failures.append(backend.RMA)
+            raise OSError("The session dropped")
+        finish(backend)
+
+    monkeypatch.setattr(ProcessRMA, "finish", finish_once)
+    batch = BatchProcessor(SimulatedTerminal(batch_host), io.StringIO(), *dirs)
+    batch.run(["RMA100000", "RMA100001"])
+
+    assert [result["Status"] for result in batch.results] == ["Error", "Done"]
+    assert batch.results[1]["Serials"] == 10
+    assert batch_host.state == "menu"
+
+
+def test_process_rma_goes_back_to_the_menu(terminal, dirs):
+    open_list(terminal, dirs)  # Left on the FA02 list
+    backend = ProcessRMA("RMA100000", terminal, *dirs)
+    assert backend.receiver == "RECEIVER"
+    assert backend.date == "08/27/25"
+
+
+def test_process_rma_raises_when_the_menu_never_shows(terminal, dirs, monkeypatch):
+    monkeypatch.setattr(terminal, "read_screen", lambda: "Sign On\n" * 24)
+
+    def wait_for_screen(self, until):
+        raise TimeoutError("The AS400 did not show the expected screen")
+
+    monkeypatch.setattr(app.InstrumentedTerminal, "wait_for_screen", wait_for_screen)
+    with pytest.raises(RuntimeError):
+        ProcessRMA("RMA100000", terminal, *dirs)
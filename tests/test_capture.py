@@ -0,0 +1,54 @@
+import pytest
+
+from as400_simulator import SimulatedAS400, SimulatedTerminal
+from conftest import open_list
+
+
+def rolling_pages(host, monkeypatch, overlap):
+    """
+    Makes the pages of the FA02 list overlap by `overlap` serials, like a list that rolls less than a full page.
+
+    Returns:
+        list: The first serial of every page shown by a page down
+    """
+    shown = []
+    aid_list = host.aid_list
+
+    def rolling(key, values):
+        top = host.top
+        aid_list(key, values)
+        if key == "pagedown" and host.top > top:
+            host.top -= overlap
+            shown.append(host.listed[host.top])
+
+    monkeypatch.setattr(host, "aid_list", rolling)
+    return shown
+
+
+@pytest.mark.parametrize("overlap", [0, 4, 11])
+def test_overlapping_pages_are_deduplicated(host, terminal, dirs, monkeypatch, overlap):
+    pages = rolling_pages(host, monkeypatch, overlap)
+    backend, serials = open_list(terminal, dirs)
+
+    expected = host.rmas["RMA100000"]["serials"]
+    assert serials == expected  # Every serial once, in list order
+    step = host.page_size - overlap
+    assert len(pages) == -(-(len(expected) - host.page_size) // step)  # Stopped at the page showing Bottom
+    assert "Bottom" in terminal.read_screen()
+
+
+def test_single_page(dirs):
+    host = SimulatedAS400.generate(rma_count=1, serials_per_rma=12)
+    terminal = SimulatedTerminal(host)
+    reads = terminal.screenReads
+    backend, serials = open_list(terminal, dirs)
+    assert serials == host.rmas["RMA100000"]["serials"]
+    assert host.top == 0  # Bottom on the first page, no page down
+    assert terminal.screenReads - reads <= 3
+
+
+def test_last_page_full(dirs):
+    host = SimulatedAS400.generate(rma_count=1, serials_per_rma=24)
+    backend, serials = open_list(SimulatedTerminal(host), dirs)
+    assert serials == host.rmas["RMA100000"]["serials"]
+    assert host.top == 12
@@ -0,0 +1,130 @@
+import io
+import os
+import sqlite3
+
+import pytest
+
+import RmaReceivingApplication as app
+from conftest import serials_of, receive
+
+
+def start(terminal, dirs):
+    backend = app.ProcessRMA("RMA100000", terminal, *dirs)
+    return backend, serials_of(backend.getBarcodes())
+
+
+def test_interrupted_rma_resumes(terminal, dirs):
+    backend, serials = start(terminal, dirs)
+    assert backend.resumed == 0
+    done, errors = receive(backend, serials[:12])  # Interrupted after 12 serials
+    assert len(done) == 12
+
+    reads = terminal.screenReads
+    backend, remaining = start(terminal, dirs)
+    assert backend.resumed == 12
+    assert remaining == serials[12:]
+    done, errors = receive(backend, remaining)
+    assert len(done) == 18
+    resumedReads = terminal.screenReads - reads
+
+    # Complete: the checkpoint is gone and the next run captures every serial again
+    reads = terminal.screenReads
+    backend, again = start(terminal, dirs)
+    assert backend.resumed == 0
+    assert again == serials
+    receive(backend, again)
+    assert resumedReads < terminal.screenReads - reads
+
+
+def test_checkpoint_store(tmp_path):
+    checkpoint = app.RmaCheckpoint(str(tmp_path / "checkpoints.sqlite3"))
+    assert checkpoint.load("RMA100000") is None
+
+    checkpoint.save("RMA100000", ["3", "1", "2"])
+    checkpoint.mark_done("RMA100000", "1")
+    assert checkpoint.load("RMA100000") == (["3", "1", "2"], {"1"})
+    assert not checkpoint.complete("RMA100000")
+
+    checkpoint.mark_done("RMA100000", "3")
+    checkpoint.mark_done("RMA100000", "2")
+    assert checkpoint.complete("RMA100000")
+    assert checkpoint.load("RMA100000") is None
+
+    checkpoint.save("RMA100001", ["4"])
+    checkpoint.discard("RMA100001")
+    assert checkpoint.load("RMA100001") is None
+    checkpoint.close()
+    assert os.path.exists(tmp_path / "checkpoints.sqlite3")
+
+
+def closed(connection):
+    try:
+        connection.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def test_ledger_row_is_committed_before_the_checkpoint(terminal, dirs):
+    backend, serials = start(terminal, dirs)
+    marked = []
+    mark_done = backend.checkpoint.mark_done
+
+    def check_ledger(RMA, serial):
+        # Another connection only sees committed rows
+        connection = sqlite3.connect(os.path.join(dirs[1], "receiving_ledger.sqlite3"))
+        marked.append(connection.execute("SELECT COUNT(*) FROM receipts WHERE serial = ?", (serial,)).fetchone()[0])
+        connection.close()
+        mark_done(RMA, serial)
+
+    backend.checkpoint.mark_done = check_ledger
+    receive(backend, serials[:3])
+    assert marked == [1, 1, 1]
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    """
+    Every ProcessRMA created by the test.
+    """
+    created = []
+    init = app.ProcessRMA.__init__
+
+    def tracked(backend, *args, **kwargs):
+        created.append(backend)
+        init(backend, *args, **kwargs)
+
+    monkeypatch.setattr(app.ProcessRMA, "__init__", tracked)
+    return created
+
+
+def test_rma_not_open_closes_the_connections(terminal, dirs, backends):
+    batch = app.BatchProcessor(terminal, io.StringIO(), *dirs)
+    batch.run(["RMA999999"])
+    assert batch.results[0]["Status"] == "Not open"
+    assert closed(backends[0].ledger.connection) and closed(backends[0].checkpoint.connection)
+
+
+def test_failed_capture_closes_the_connections(terminal, dirs, backends, monkeypatch):
+    def fail(backend):
+        raise OSError("The session dropped")
+
+    monkeypatch.setattr(app.ProcessRMA, "getBarcodes", fail)
+    batch = app.BatchProcessor(terminal, io.StringIO(), *dirs)
+    batch.run(["RMA100000"])
+    assert batch.results[0]["Status"] == "Error"
+    assert closed(backends[0].ledger.connection) and closed(backends[0].checkpoint.connection)
+
+
+def test_failed_finish_closes_the_connections(terminal, dirs, monkeypatch):
+    def fail(backend):
+        raise OSError("The session dropped")
+
+    backend, serials = start(terminal, dirs)
+    monkeypatch.setattr(app.ProcessRMA, "finish", fail)
+    with pytest.raises(OSError):
+        receive(backend, serials[:2])
+    assert closed(backend.ledger.connection) and closed(backend.checkpoint.connection)
+    checkpoint = app.RmaCheckpoint(os.path.join(dirs[1], "rma_checkpoints.sqlite3"))
+    assert checkpoint.load("RMA100000")[1] == set(serials[:2])  # The next run resumes after them
+    checkpoint.close()
@@ -0,0 +1,190 @@
+import os
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import RmaReceivingApplication as app
+from RmaReceivingApplication import FolderIndex, FolderProvisioner
+
+
+def provision(provisioner, RMA, *roots, timeout=5.0):
+    """
+    Runs provision() on its own thread, so a deadlock fails the test instead of hanging the test run.
+
+    Returns:
+        list: The paths, or the exception provision() raised
+    """
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(provisioner.provision(RMA, *roots))
+        except Exception as e:
+            outcome.append(e)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    assert outcome, "provision() deadlocked"
+    return outcome[0]
+
+
+@pytest.fixture
+def roots(tmp_path):
+    return str(tmp_path / "RMA_Received_Pictures"), str(tmp_path / "RMA_Damage")
+
+
+def test_three_levels_are_created(roots):
+    provisioner = FolderProvisioner()
+    pictures, damage = provisioner.provision("RMA123456", *roots)
+    assert pictures == os.path.join(roots[0], "RMA12xxxx", "RMA123xxx", "RMA123456")
+    assert damage == os.path.join(roots[1], "RMA12xxxx", "RMA123xxx", "RMA123456")
+    assert os.path.isdir(pictures) and os.path.isdir(damage)
+
+
+def test_existing_folders_are_reused(roots):
+    existing = os.path.join(roots[0], "RMA12 Repairs", "RMA123 Batch")
+    os.makedirs(existing)
+    path, = FolderProvisioner().provision("RMA123456", roots[0])
+    assert path == os.path.join(existing, "RMA123456")
+
+
+def test_invalid_rma(roots):
+    with pytest.raises(ValueError):
+        FolderProvisioner().provision("123456", *roots)
+
+
+def test_rma_is_provisioned_once(roots, monkeypatch):
+    provisioner = FolderProvisioner()
+    calls = []
+    create = provisioner.create
+    monkeypatch.setattr(provisioner, "create", lambda root, RMA: calls.append(root) or create(root, RMA))
+
+    with ThreadPoolExecutor(8) as pool:
+        paths = list(pool.map(lambda _: tuple(provisioner.provision("RMA123456", *roots)), range(32)))
+    assert len(set(paths)) == 1
+    assert sorted(calls) == sorted(roots)
+
+
+def test_failed_rma_is_retried(roots, monkeypatch):
+    provisioner = FolderProvisioner()
+    create = provisioner.create
+    failing = {"left": 1}
+
+    def create_once_failing(root, RMA):
+        if failing["left"]:
+            failing["left"] -= 1
+            raise OSError("The share is unreachable")
+        return create(root, RMA)
+
+    monkeypatch.setattr(provisioner, "create", create_once_failing)
+    assert isinstance(provision(provisioner, "RMA123456", roots[0]), OSError)
+    assert provision(provisioner, "RMA123456", roots[0]) == [create(roots[0], "RMA123456")]
+
+
+def test_failure_before_the_callback_is_added_does_not_deadlock(roots, monkeypatch):
+    # The provisioning fails before provision() adds its callback, the callback then runs on the calling thread
+    provisioner = FolderProvisioner()
+
+    def fail(root, RMA):
+        raise OSError("The share is unreachable")
+
+    monkeypatch.setattr(provisioner, "create", fail)
+    submit = provisioner.pool.submit
+
+    def submit_and_finish(*args):
+        future = submit(*args)
+        future.exception()  # Already failed when provision() gets it
+        return future
+
+    monkeypatch.setattr(provisioner.pool, "submit", submit_and_finish)
+
+    assert isinstance(provision(provisioner, "RMA123456", *roots), OSError)
+    assert provisioner.paths == {}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    The clock of the folder index, moved on by hand.
+    """
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(app, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    scanned = []
+    scan = FolderIndex.scan
+    monkeypatch.setattr(FolderIndex, "scan", lambda index, parent: scanned.append(parent) or scan(index, parent))
+    return scanned
+
+
+def created_elsewhere(parent, name):
+    """
+    Creates a folder the way another station would, and makes sure the directory's modification time changes.
+    """
+    os.makedirs(os.path.join(parent, name))
+    stat = os.stat(parent)
+    os.utime(parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_index_is_trusted_until_the_ttl(tmp_path, clock, scans):
+    parent = str(tmp_path)
+    os.makedirs(os.path.join(parent, "RMA12xxxx"))
+    index = FolderIndex(ttl=60.0)
+    assert index.find(parent, "RMA12") == ["RMA12xxxx"]
+
+    created_elsewhere(parent, "RMA13xxxx")
+    clock.now += 59
+    assert index.find(parent, "RMA13") == []  # Not checked again yet
+    assert scans == [parent]
+
+    clock.now += 2
+    assert index.find(parent, "RMA13") == ["RMA13xxxx"]
+    assert scans == [parent, parent]
+
+
+def test_unchanged_directory_is_not_enumerated_again(tmp_path, clock, scans):
+    parent = str(tmp_path)
+    os.makedirs(os.path.join(parent, "RMA12xxxx"))
+    index = FolderIndex(ttl=60.0)
+    index.find(parent, "RMA12")
+
+    for _ in range(3):
+        clock.now += 61
+        assert index.find(parent, "RMA12") == ["RMA12xxxx"]
+    assert scans == [parent]  # Only its modification time was checked
+
+    created_elsewhere(parent, "RMA12 Repairs")
+    clock.now += 30  # Checked 30 s ago, still trusted
+    assert index.find(parent, "RMA12") == ["RMA12xxxx"]
+    clock.now += 31
+    assert index.find(parent, "RMA12") == ["RMA12 Repairs", "RMA12xxxx"]
+
+
+def test_created_folders_are_added_without_enumerating(tmp_path, clock, scans):
+    parent = str(tmp_path)
+    index = FolderIndex(ttl=60.0)
+    assert index.find(parent, "RMA12") == []
+    index.add(parent, "RMA12xxxx")
+    index.add(parent, "RMA12xxxx")
+    assert index.names(parent) == ["RMA12xxxx"]
+    index.add(str(tmp_path / "other"), "RMA12xxxx")  # Not indexed yet, left for the first enumeration
+    assert index.dirs.keys() == {parent}
+    assert scans == [parent]
+
+
+def test_deleted_directory_is_enumerated_again(tmp_path, clock):
+    parent = str(tmp_path / "RMA12xxxx")
+    os.makedirs(os.path.join(parent, "RMA123xxx"))
+    index = FolderIndex(ttl=60.0)
+    assert index.names(parent) == ["RMA123xxx"]
+
+    os.rmdir(os.path.join(parent, "RMA123xxx"))
+    os.rmdir(parent)
+    clock.now += 61
+    assert index.names(parent) == []
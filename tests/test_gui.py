@@ -0,0 +1,248 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+import RmaReceivingApplication as app
+from RmaReceivingApplication import GUI
+
+
+class Root:
+    """
+    Stands in for the Tk root: after() callbacks are queued and run by pump() on the test's thread.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def after(self, ms, callback, *args):
+        with self.lock:
+            self.pending.append((callback, args))
+
+    def pump(self, seconds=2.0, until=None):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            for callback, args in pending:
+                callback(*args)
+            if until is not None and until():
+                return
+            time.sleep(0.005)
+
+
+@pytest.fixture
+def gui(terminal, dirs):
+    """
+    A GUI without a window: the widgets are mocks, the rest is the real workflow on the simulated AS400.
+    """
+    gui = GUI.__new__(GUI)
+    gui.root = Root()
+    gui.state = GUI.IDLE
+    gui.state_listeners = []
+    gui.backend = gui.pipeline = gui.current_serial = None
+    gui.terminal = terminal
+    gui.lookAhead = None
+    gui.shareRoot, gui.localDir = dirs
+    gui.spool = gui.history = None
+    gui.duplicates, gui.acknowledged = {}, set()
+    gui.rmaDamaged = False
+    for widget in ("message_label", "start_button", "next_button", "spool_label", "rmaDamaged_var",
+                   "information_textbox"):
+        setattr(gui, widget, mock.Mock())
+    gui.update_dynamic_textbox = mock.Mock()
+    gui.rma_number_var = mock.Mock(get=lambda: "RMA100000")
+    gui.state_listeners.append(gui.update_next_button)
+    gui.states = []
+    gui.state_listeners.append(lambda old, state: gui.states.append(state))
+    return gui
+
+
+def start(gui):
+    gui.start_processing()
+    gui.root.pump(until=lambda: gui.state != GUI.CAPTURING)
+
+
+def press_next(gui):
+    gui.allow_next_iteration()
+    gui.root.pump(until=lambda: gui.state != GUI.PROCESSING)
+
+
+def test_serial_workflow(gui, host):
+    start(gui)
+    assert gui.states == [GUI.CAPTURING, GUI.AWAITING_CONFIRM]
+    assert gui.next_button.config.call_args == mock.call(state=app.tk.NORMAL)
+
+    while gui.state != GUI.DONE:
+        press_next(gui)
+    gui.root.pump(until=lambda: gui.state == GUI.IDLE)
+
+    assert gui.states[-2:] == [GUI.DONE, GUI.IDLE]
+    assert gui.states[2:-2] == [GUI.PROCESSING, GUI.AWAITING_CONFIRM] * 30
+    assert all(host.serials[serial]["other"] for serial in host.rmas["RMA100000"]["serials"])
+    assert host.state == "menu"
+
+
+def test_capture_runs_off_the_tk_thread(gui, terminal):
+    threads = []
+    read_screen = terminal.read_screen
+    terminal.read_screen = lambda: threads.append(threading.current_thread()) or read_screen()
+
+    gui.start_processing()
+    assert gui.states == [GUI.CAPTURING]  # Painted before the capture finishes
+    assert "Reading the serial numbers" in gui.message_label.config.call_args.kwargs["text"]
+    assert gui.start_button.config.call_args == mock.call(state=app.tk.DISABLED)
+
+    gui.root.pump(until=lambda: gui.state != GUI.CAPTURING)
+    assert gui.state == GUI.AWAITING_CONFIRM
+    assert threads and threading.main_thread() not in threads
+    gui.pipeline.close()
+
+
+def test_next_is_ignored_while_processing(gui):
+    start(gui)
+    gui.allow_next_iteration()
+    assert gui.state == GUI.PROCESSING
+    assert gui.next_button.config.call_args == mock.call(state=app.tk.DISABLED)
+    serial = gui.current_serial
+
+    gui.allow_next_iteration()  # Pressed again before the serial is shown
+    assert gui.current_serial == serial
+    assert gui.states.count(GUI.PROCESSING) == 1
+
+    gui.root.pump(until=lambda: gui.state == GUI.AWAITING_CONFIRM)
+    assert gui.next_button.config.call_args == mock.call(state=app.tk.NORMAL)
+    gui.pipeline.close()
+
+
+def test_start_ignored_unless_idle(gui):
+    gui.start_processing()
+    gui.start_processing()  # Pressed again while the serials are read
+    gui.root.pump(until=lambda: gui.state != GUI.CAPTURING)
+    states = list(gui.states)
+    gui.start_processing()
+    assert gui.states == states == [GUI.CAPTURING, GUI.AWAITING_CONFIRM]
+    gui.pipeline.close()
+
+
+def test_rma_not_open_goes_back_to_idle(gui):
+    gui.rma_number_var = mock.Mock(get=lambda: "RMA999999")
+    start(gui)
+    assert gui.states == [GUI.CAPTURING, GUI.IDLE]
+    assert gui.backend is None
+    assert gui.start_button.config.call_args == mock.call(state=app.tk.NORMAL)
+
+
+def test_capture_error_goes_back_to_idle(gui, monkeypatch):
+    def fail(backend):
+        raise OSError("The session dropped")
+
+    monkeypatch.setattr(app.ProcessRMA, "getBarcodes", fail)
+    start(gui)
+    assert gui.states == [GUI.CAPTURING, GUI.IDLE]
+    assert "The session dropped" in gui.message_label.config.call_args.kwargs["text"]
+    assert gui.start_button.config.call_args == mock.call(state=app.tk.NORMAL)
+
+
+def test_look_ahead_follows_the_terminal(gui, terminal):
+    start(gui)
+    assert gui.pipeline.lookAhead
+    gui.pipeline.close()
+
+    gui.transition(GUI.IDLE)
+    terminal.owns_screen = False  # Like the AS400 window, whose keystrokes can land in the GUI
+    start(gui)
+    assert not gui.pipeline.lookAhead
+    gui.pipeline.close()
+
+    gui.transition(GUI.IDLE)
+    gui.lookAhead = True
+    start(gui)
+    assert gui.pipeline.lookAhead
+    gui.pipeline.close()
+
+
+def test_clipboard_is_read_on_the_root_thread(monkeypatch):
+    root = Root()
+    threads = []
+    root.clipboard_get = lambda: threads.append(threading.current_thread()) or "x" * 80
+    root.clipboard_clear = root.clipboard_append = lambda *args: None
+    monkeypatch.setattr(app, "pa", mock.Mock())
+    main = threading.main_thread()  # The root's thread, pytest runs the tests on it
+    source = app.ClipboardScreenSource(root)
+
+    screens = []
+    worker = threading.Thread(target=lambda: screens.append(source.read()), name="as400")
+    worker.start()
+    root.pump(until=lambda: screens)
+    worker.join()
+
+    assert screens and threads == [main, main]
+
+
+def test_duplicates_are_flagged_before_the_as400(gui, terminal):
+    start(gui)
+    while gui.state != GUI.DONE:
+        press_next(gui)
+    gui.root.pump(until=lambda: gui.state == GUI.IDLE)
+    gui.backend.history.wait()
+
+    gui.states.clear()
+    start(gui)
+    assert len(gui.duplicates) == 30
+    reads = terminal.screenReads
+    gui.allow_next_iteration()  # Shows the flag without touching the AS400
+    assert gui.state == GUI.AWAITING_CONFIRM
+    assert terminal.screenReads == reads
+    assert "already received" in gui.message_label.config.call_args.kwargs["text"]
+
+    press_next(gui)  # Receives it anyway
+    assert gui.states == [GUI.CAPTURING, GUI.AWAITING_CONFIRM, GUI.PROCESSING, GUI.AWAITING_CONFIRM]
+    assert terminal.screenReads > reads
+    gui.pipeline.close()
+
+
+def test_serials_are_checked_again_at_next(gui, terminal):
+    start(gui)
+    assert gui.duplicates == {}
+    serial = gui.backend.barcodeList.queue[0]
+    # Found once the history is done loading (or another station received it) after Start
+    gui.backend.history.add(serial, "2025-08-26 on RMA100001, received by OTHER")
+
+    reads = terminal.screenReads
+    gui.allow_next_iteration()
+    assert gui.state == GUI.AWAITING_CONFIRM
+    assert terminal.screenReads == reads
+    assert gui.duplicates == {serial: "2025-08-26 on RMA100001, received by OTHER"}
+    gui.pipeline.close()
+
+
+def test_rma_not_open_closes_the_connections(gui, monkeypatch):
+    backends = []
+    close = app.ProcessRMA.close
+    monkeypatch.setattr(app.ProcessRMA, "close", lambda backend: backends.append(backend) or close(backend))
+    gui.rma_number_var = mock.Mock(get=lambda: "RMA999999")
+    start(gui)
+
+    def fail(backend):
+        raise OSError("The session dropped")
+
+    monkeypatch.setattr(app.ProcessRMA, "getBarcodes", fail)
+    gui.rma_number_var = mock.Mock(get=lambda: "RMA100000")
+    start(gui)
+    assert gui.states == [GUI.CAPTURING, GUI.IDLE] * 2
+    assert len(backends) == 2
+
+
+def test_stage_timings_write_error_is_shown(gui, monkeypatch):
+    def fail(stats, path=None, **fields):
+        raise OSError("The disk is full")
+
+    monkeypatch.setattr(app.SessionStats, "export", fail)
+    start(gui)
+    while gui.state != GUI.DONE:
+        press_next(gui)
+    gui.root.pump(until=lambda: gui.state == GUI.IDLE)
+    assert "The disk is full" in gui.message_label.config.call_args.kwargs["text"]
@@ -0,0 +1,87 @@
+import os
+import threading
+
+import RmaReceivingApplication as app
+from RmaReceivingApplication import BloomFilter, ReceiptHistory
+from conftest import serials_of, receive
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, errorRate=0.01)
+    bloom.update(str(n) for n in range(500))
+    bloom.add("extra")
+    assert all(str(n) in bloom for n in range(500))
+    assert "extra" in bloom
+    falsePositives = sum(str(n) in bloom for n in range(10000, 20000))
+    assert falsePositives < 200
+
+
+def test_bloom_filter_adds_from_many_threads():
+    bloom = BloomFilter(capacity=40000, errorRate=0.01)
+    values = [[f"{thread}-{n}" for n in range(5000)] for thread in range(8)]
+    threads = [threading.Thread(target=lambda chunk=chunk: [bloom.add(value) for value in chunk]) for chunk in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(value in bloom for chunk in values for value in chunk)
+
+
+def test_serials_received_before_are_found(terminal, dirs):
+    backend = app.ProcessRMA("RMA100000", terminal, *dirs)
+    serials = serials_of(backend.getBarcodes())
+    receive(backend, serials[:5])
+    backend.history.close()
+
+    # A new program run loads them from the ledger and the day file index
+    history = ReceiptHistory(*dirs)
+    assert history.wait(10.0)
+    found = history.duplicates(serials)
+    assert sorted(found) == sorted(serials[:5])
+    assert "RMA100000" in found[serials[0]]
+    assert history.lookup("0000000000") is None
+    assert history.error is None
+    history.close()
+
+
+def test_receipts_have_one_date_format(terminal, dirs):
+    backend = app.ProcessRMA("RMA100000", terminal, *dirs)
+    serials = serials_of(backend.getBarcodes())
+    receive(backend, serials[:1])
+    receipt = backend.history.lookup(serials[0])
+    assert receipt == "2025-08-27 on RMA100000, received by RECEIVER"
+    backend.history.close()
+
+    # The same once it comes from the ledger and the day file index
+    history = ReceiptHistory(*dirs)
+    assert history.lookup(serials[0]) == receipt
+    history.close()
+
+
+def test_lookup_does_not_wait_for_the_history(dirs):
+    history = ReceiptHistory(*dirs)
+    history.loader.join()
+    history.loaded.clear()  # Still loading as far as the lookups are concerned
+    history.add("1000000001", "2025-08-27 on RMA100000, received by RECEIVER")
+    assert history.lookup("1000000001", timeout=0) == "2025-08-27 on RMA100000, received by RECEIVER"
+    assert history.duplicates(["1000000001", "1000000002"], timeout=0) == {
+        "1000000001": "2025-08-27 on RMA100000, received by RECEIVER"}
+    history.loaded.set()
+    history.close()
+
+
+def test_load_errors_are_reported(dirs):
+    share, local = dirs
+    os.makedirs(local)
+    with open(os.path.join(local, "received_index.sqlite3"), "w") as f:
+        f.write("not a database" * 100)
+
+    reported = []
+    history = ReceiptHistory(share, local, refresh=False)
+    history.listeners.append(reported.append)
+    history.loader.join()
+
+    assert history.error.startswith("Could not load the receiving history")
+    assert reported in ([], [history.error])  # The listener may have been added after the error
+    assert history.lookup("1000000001") is None
+    history.close()
@@ -0,0 +1,39 @@
+import types
+
+import pytest
+
+import RmaReceivingApplication as app
+from RmaReceivingApplication import Macro, FieldInput, Key, MACROS
+from conftest import open_list, receive
+
+
+def test_direct_and_walking_input():
+    macro = Macro(FieldInput(4, 30, "I"), FieldInput(6, 30, "{rma}", walk=("down", "down")), Key("return"))
+    assert macro.direct == [("field", 4, 30, "I"), ("field", 6, 30, "{rma}"), ("key", "return")]
+    assert macro.walking == [("text", "I", 0.0), ("key", "down"), ("key", "down"), ("text", "{rma}", 0.0),
+                             ("key", "return")]
+
+
+@pytest.mark.parametrize("fields", [True, False])
+def test_receive_rma(terminal, dirs, fields):
+    terminal.supports_fields = fields
+    backend, serials = open_list(terminal, dirs)
+    assert len(serials) == 30
+    done, errors = receive(backend, serials, lookAhead=True)
+    assert errors == []
+    assert sorted(info["Serial Number"] for info in done) == sorted(serials)
+    assert all(terminal.host.serials[serial]["other"] for serial in serials)
+    assert terminal.host.state == "menu"
+
+
+def test_pyautogui_batches_everything_but_attention_keys(monkeypatch):
+    sent = []
+    monkeypatch.setattr(app, "pa", types.SimpleNamespace(
+        typewrite=lambda text, interval=0.0: sent.append(("type", text)),
+        press=lambda keys: sent.append(("press", list(keys))),
+        hotkey=lambda key: sent.append(("key", key))))
+    terminal = object.__new__(app.PyAutoGuiTerminal)
+    terminal.aidPause = 0.0
+
+    terminal.send_input(MACROS["select_serial"].walking)
+    assert sent == [("type", "s"), ("press", ["down", "down", "down"]), ("type", "s"), ("key", "return")]
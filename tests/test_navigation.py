@@ -0,0 +1,49 @@
+import pytest
+
+from RmaReceivingApplication import Macro, Key, Text, MACROS, list_ready, list_positioned
+from conftest import open_list
+
+
+def test_attention_key_must_end_a_step():
+    with pytest.raises(ValueError):
+        Macro(Key("return"), Text("p"), Key("return"))
+    Macro(Text("p"), Key("return"))
+    Macro(Text("OK"))
+
+
+def test_list_predicates(terminal, dirs):
+    backend, serials = open_list(terminal, dirs)
+    screen = backend.run_macro("position_serial", serial=serials[3])
+    assert list_ready(screen)
+    assert list_positioned(screen, serials[3])
+    assert not list_positioned(screen, serials[5])
+
+    # The command echoed in the position field is not the host having positioned the list
+    terminal.write_field(3, 26, "I" + serials[5])
+    screen = terminal.read_screen()
+    assert serials[5] in screen
+    assert not list_ready(screen)
+    assert not list_positioned(screen, serials[5])
+
+
+def test_position_serial_waits_after_every_attention_key(terminal, dirs):
+    backend, serials = open_list(terminal, dirs)
+    waits = []
+    wait = backend.terminal.wait_for_screen
+    backend.terminal.wait_for_screen = lambda until: waits.append(until) or wait(until)
+
+    screen = backend.run_macro("position_serial", serial=serials[20])
+    assert len(waits) == len(MACROS["position_serial"].steps) == 4
+    assert list_positioned(screen, serials[20])
+    assert terminal.host.listed[terminal.host.top] == serials[20]
+
+
+def test_wait_for_screen_times_out(terminal):
+    with pytest.raises(TimeoutError):
+        terminal.wait_for_screen("Not on any screen", timeout=0.05)
+
+
+def test_finish_returns_to_the_menu(terminal, dirs):
+    backend, serials = open_list(terminal, dirs)
+    backend.finish()
+    assert terminal.host.state == "menu"
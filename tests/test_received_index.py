@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+import receiving_query
+from receiving_query import LINE_PATTERN, ReceivedIndex
+
+LINE = "RMA#: {rma}   Type: Warranty   S/N: {serial}\tP/N: 61-9663-000\tAssigned To: TECH\tReceived by: RECEIVER\n"
+
+
+def line(serial, rma="RMA100000"):
+    return LINE.format(rma=rma, serial=serial)
+
+
+@pytest.fixture
+def received(tmp_path):
+    root = tmp_path / "RMAs_Received"
+    (root / "2025" / "Aug").mkdir(parents=True)
+    return root
+
+
+@pytest.fixture
+def index(received, tmp_path):
+    index = ReceivedIndex(str(received), str(tmp_path / "index.sqlite3"))
+    yield index
+    index.close()
+
+
+def write(received, text, name="Aug 27, 2025.txt", mode="a"):
+    path = received / "2025" / "Aug" / name
+    with open(path, mode, newline="") as f:
+        f.write(text)
+    return path
+
+
+def serials(index):
+    return [serial for serial, in index.connection.execute("SELECT serial FROM lines ORDER BY path, offset")]
+
+
+def test_line_pattern():
+    match = LINE_PATTERN.search(line("1000886439").rstrip("\n"))
+    assert match.groupdict() == {"rma": "RMA100000", "returnType": "Warranty", "serial": "1000886439",
+                                 "partNum": "61-9663-000", "assignedTo": "TECH", "receiver": "RECEIVER"}
+
+    # Empty fields and a return type of more than one word
+    match = LINE_PATTERN.search("RMA#: RMA100001   Type: Advance Exchange   S/N: 42\tP/N: \tAssigned To: \tReceived by: ")
+    assert (match["returnType"], match["serial"], match["partNum"], match["assignedTo"], match["receiver"]) == (
+        "Advance Exchange", "42", "", "", "")
+
+    assert LINE_PATTERN.search("Some note someone typed into the day file") is None
+
+
+def test_lines_are_indexed(received, index):
+    write(received, line("1") + "Not a receiving line\n" + line("2", "RMA100001"))
+    write(received, line("3"), name="Aug 28, 2025.txt")
+    write(received, line("4"), name="notes.txt")  # Not a day file
+
+    assert index.update() == 4
+    assert serials(index) == ["1", None, "2", "3"]
+    assert index.query(serial="2") == [("2025-08-27", line("2", "RMA100001").rstrip("\n"))]
+    assert [day for day, text in index.query(rma="RMA100000")] == ["2025-08-27", "2025-08-28"]
+    assert index.query(part="61-9663-000", start="2025-08-28") == [("2025-08-28", line("3").rstrip("\n"))]
+
+
+def test_update_parses_only_what_changed(received, index, monkeypatch):
+    path = write(received, line("1") + line("2"))
+    write(received, line("3"), name="Aug 28, 2025.txt")
+    assert index.update() == 3
+
+    parsed = []
+    parse_lines = receiving_query.parse_lines
+    monkeypatch.setattr(receiving_query, "parse_lines", lambda path, start=0: parsed.append((path, start)) or
+                        parse_lines(path, start))
+
+    assert index.update() == 0  # Same size and modification time
+    assert parsed == []
+
+    size = os.path.getsize(path)
+    write(received, line("4"))
+    assert index.update() == 1
+    assert parsed == [(str(path), size)]  # Parsed from where the last update stopped
+    assert serials(index) == ["1", "2", "4", "3"]
+
+
+def test_half_written_line_is_indexed_once_complete(received, index):
+    write(received, line("1") + line("2")[:20])
+    assert index.update() == 1
+    write(received, line("2")[20:])
+    assert index.update() == 1
+    assert serials(index) == ["1", "2"]
+
+
+def test_truncated_day_file_is_parsed_again(received, index):
+    write(received, line("1") + line("2") + line("3"))
+    index.update()
+    write(received, line("5"), mode="w")
+    assert index.update() == 1
+    assert serials(index) == ["5"]
+
+
+def test_rewritten_day_file_is_parsed_again(received, index):
+    path = write(received, line("1") + line("2"))
+    index.update()
+    stat = os.stat(path)
+    write(received, line("7") + line("8") + line("9"), mode="w")  # Rewritten, and longer than before
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert index.update() == 3
+    assert serials(index) == ["7", "8", "9"]
+
+
+def test_deleted_day_file_is_dropped(received, index):
+    path = write(received, line("1"))
+    write(received, line("2"), name="Aug 28, 2025.txt")
+    index.update()
+    os.remove(path)
+    index.update()
+    assert serials(index) == ["2"]
+    assert index.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 1
+
+
+def test_each_day_file_is_committed(received, index, monkeypatch):
+    write(received, line("1"))
+    write(received, line("2"), name="Aug 28, 2025.txt")
+
+    parse_lines = receiving_query.parse_lines
+    parsed = []
+
+    def share_drops(path, start=0):
+        parsed.append(path)
+        if len(parsed) == 2:  # The share drops after the first day file
+            raise OSError("The share is unreachable")
+        return parse_lines(path, start)
+
+    monkeypatch.setattr(receiving_query, "parse_lines", share_drops)
+    with pytest.raises(OSError):
+        index.update()
+    assert len(serials(index)) == 1  # Kept, the next update only parses the other file
+
+    monkeypatch.setattr(receiving_query, "parse_lines", lambda path, start=0: parsed.append(path) or
+                        parse_lines(path, start))
+    assert index.update() == 1
+    assert parsed[2:] == parsed[1:2]
+    assert sorted(serials(index)) == ["1", "2"]
@@ -0,0 +1,65 @@
+import RmaReceivingApplication as app
+from RmaReceivingApplication import MENU_SCREEN, MISSING, SERIAL_SCREEN, ScreenSnapshot
+from conftest import open_list, receive
+
+SERIAL = "\n".join([
+    " FA03       Failure Analysis Processing                               08/27/25",
+    "",
+    " RMA# RMA100000 Repair                   SLA : Y",
+    " Serial . . . :  1000000001",
+    " Part Number : 61-9663-000",
+    "",
+    " Other: 08/27/25",
+])
+
+
+def test_fields_are_read_in_one_pass():
+    record = SERIAL_SCREEN.extract(SERIAL)
+    assert record.valid
+    assert (record.rma, record.returnType, record.sla, record.partNum, record.other) == (
+        "RMA100000", "Repair", True, "61-9663-000", "08/27/25")
+    assert record.missing() == []
+
+
+def test_missing_field():
+    record = SERIAL_SCREEN.extract(SERIAL.replace(" Part Number : 61-9663-000", ""))
+    assert record.partNum is MISSING
+    assert not record.partNum
+    assert record.missing() == ["partNum"]
+    assert not record.valid  # Nothing is read from (or written to) a screen the template doesn't fully match
+
+
+def test_moved_field():
+    # The label changed, the value is no longer where the template looks for it
+    record = SERIAL_SCREEN.extract(SERIAL.replace("SLA : Y", "S.L.A. Y"))
+    assert record.sla is MISSING
+    assert record.missing() == ["sla"]
+    assert not record.valid
+
+
+def test_other_screen_is_not_valid():
+    menu = " FAM01  RECEIVER  Failure Analysis Menu  08/27/25  10:00:00"
+    record = SERIAL_SCREEN.extract(menu)
+    assert not record.valid
+    assert record.missing() == ["rma", "returnType", "sla", "partNum", "other"]
+
+    record = MENU_SCREEN.extract(menu)
+    assert record.valid and (record.receiver, record.date) == ("RECEIVER", "08/27/25")
+    assert not MENU_SCREEN.extract(SERIAL).valid
+
+
+def test_missing_sla_is_not_no():
+    backend = app.ProcessRMA.__new__(app.ProcessRMA)  # Only reads the snapshot given
+    assert backend.isSLA(ScreenSnapshot(SERIAL)) == "Yes"
+    assert backend.isSLA(ScreenSnapshot(SERIAL.replace("SLA : Y", "SLA : N"))) == "No"
+    assert backend.isSLA(ScreenSnapshot(SERIAL.replace("SLA : Y", ""))) is None
+    assert backend.partNum(ScreenSnapshot(SERIAL.replace("Part Number", "Part"))) is None
+
+
+def test_serial_with_a_missing_field_is_not_received(terminal, dirs, monkeypatch):
+    backend, serials = open_list(terminal, dirs)
+    read_screen = terminal.read_screen
+    monkeypatch.setattr(terminal, "read_screen", lambda: read_screen().replace("SLA :", "SLA  "))
+    done, errors = receive(backend, serials[:1])
+    assert done == []
+    assert errors and "sla" in errors[0]
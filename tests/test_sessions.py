@@ -0,0 +1,33 @@
+import csv
+import io
+
+import pytest
+
+from RmaReceivingApplication import BatchProcessor
+from as400_simulator import SimulatedAS400, SimulatedTerminal
+
+RMAS = [f"RMA{100000 + n}" for n in range(6)]
+
+
+@pytest.mark.parametrize("sessions", [1, 3])
+def test_rmas_are_spread_over_the_sessions(dirs, sessions):
+    host = SimulatedAS400.generate(rma_count=6, serials_per_rma=10)
+    output = io.StringIO()
+    batch = BatchProcessor(output=output, shareRoot=dirs[0], localDir=dirs[1],
+                           sessions=[SimulatedTerminal(host.session()) for _ in range(sessions)])
+    batch.run(RMAS)
+
+    assert sorted(result["RMA"] for result in batch.results) == RMAS
+    assert all(result["Status"] == "Done" and result["Serials"] == 10 for result in batch.results)
+    assert {result["Session"] for result in batch.results} == set(range(sessions))
+    assert all(record["other"] for record in host.serials.values())
+    assert len(list(csv.DictReader(io.StringIO(output.getvalue())))) == 6
+
+
+def test_sessions_have_their_own_screens():
+    host = SimulatedAS400.generate(rma_count=2, serials_per_rma=10)
+    first, second = SimulatedTerminal(host.session()), SimulatedTerminal(host.session())
+    first.type_text("02")
+    first.send_keys("return")
+    assert "Failure Analysis Menu" not in first.read_screen().split("\n")[0]
+    assert "Failure Analysis Menu" in second.read_screen().split("\n")[0]
@@ -0,0 +1,83 @@
+import glob
+import os
+import time
+
+import RmaReceivingApplication as app
+from conftest import serials_of, receive
+
+
+def day_file_lines(share):
+    lines = []
+    for path in glob.glob(os.path.join(share, "RMAs_Received", "*", "*", "*.txt")):
+        with open(path) as f:
+            lines.extend(f.read().splitlines())
+    return lines
+
+
+def wait_for(condition, seconds=10.0):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_lines_and_folders_reach_the_share(terminal, dirs):
+    share, local = dirs
+    backend = app.ProcessRMA("RMA100000", terminal, share, local)
+    serials = serials_of(backend.getBarcodes())
+    done, errors = receive(backend, serials, damaged=True)
+
+    assert errors == []
+    assert backend.spool.depth == 0
+    lines = day_file_lines(share)
+    assert len(lines) == 30
+    assert all(any(serial in line for line in lines) for serial in serials)
+    assert os.path.isdir(done[0]["Folder Path "])
+    assert os.path.isdir(done[0]["Damaged Path"])
+
+
+def test_unreachable_share_is_replayed_later(terminal, dirs):
+    share, local = dirs
+    open(share, "w").close()  # The share is "down": every path under it fails
+    backend = app.ProcessRMA("RMA100000", terminal, share, local)
+    backend.spool.maxBackoff = 0.2
+    states = []
+    backend.spool.listeners.append(lambda depth, online: states.append((depth, online)))
+
+    serials = serials_of(backend.getBarcodes())
+    done, errors = receive(backend, serials, damaged=True)
+
+    # Receiving carried on, everything is kept locally
+    assert errors == []
+    assert len(done) == 30
+    assert not backend.spool.online
+    assert backend.spool.depth > 0
+    assert (backend.spool.depth, False) in states
+
+    os.remove(share)  # The share is back
+    assert wait_for(lambda: backend.spool.depth == 0)
+    assert backend.spool.online
+    assert states[-1] == (0, True)
+    assert len(day_file_lines(share)) == 30
+    assert os.path.isdir(os.path.join(share, "RMA_Received_Pictures"))
+
+
+def test_spool_left_by_an_earlier_run_is_replayed(dirs):
+    share, local = dirs
+    path = os.path.join(local, "share_spool.sqlite3")
+    dayFile = os.path.join(share, "RMAs_Received", "2025", "Aug", "08-27-25.txt")
+
+    spool = app.ShareSpool(path, maxSeconds=60.0)
+    open(share, "w").close()
+    spool.write(dayFile, "left behind\n")
+    spool.markOffline()
+    spool.close()
+    os.remove(share)
+
+    spool = app.ShareSpool(path, maxSeconds=60.0, maxBackoff=0.2)
+    assert spool.drain(timeout=5.0) or wait_for(lambda: spool.depth == 0)
+    with open(dayFile) as f:
+        assert f.read() == "left behind\n"
+    spool.close()
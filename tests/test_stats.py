@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from RmaReceivingApplication import SessionStats
+
+
+@pytest.mark.parametrize("p, expected", [(0, 1), (1, 1), (50, 50), (95, 95), (95.5, 96), (99, 99), (100, 100)])
+def test_nearest_rank_percentile(p, expected):
+    assert SessionStats.percentile(list(range(1, 101)), p) == expected
+
+
+def test_percentile_of_few_durations():
+    assert SessionStats.percentile([0.5], 50) == 0.5
+    assert SessionStats.percentile([0.1, 0.2], 50) == 0.1
+    assert SessionStats.percentile([0.1, 0.2], 51) == 0.2
+    assert SessionStats.percentile([0.1, 0.2, 0.3, 0.4], 95) == 0.4
+
+
+def test_report():
+    stats = SessionStats()
+    for ms in (30, 10, 20, 40):
+        stats.add("navigate", ms / 1000)
+    stats.add("day file", 0.005)
+    other = SessionStats()
+    other.add("navigate", 0.05)
+    other.count("keystrokes", 3)
+    stats.merge(other)
+
+    report = stats.report()
+    assert list(report) == ["navigate", "day file"]
+    assert report["navigate"] == {"count": 5, "total": pytest.approx(0.15), "p50": 0.03, "p95": 0.05, "max": 0.05}
+    assert report["day file"]["p95"] == report["day file"]["max"] == 0.005
+    assert stats.counters == {"keystrokes": 3}
+
+
+def test_export_appends_one_json_line_per_session(tmp_path):
+    path = tmp_path / "timings" / "stage_timings.jsonl"
+    stats = SessionStats()
+    stats.add("navigate", 0.02)
+    stats.count("screen reads", 5)
+    record = stats.export(str(path), rma="RMA100000", serials=1)
+    stats.export(str(path), rma="RMA100001", serials=0)
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    first = json.loads(lines[0])
+    assert first == record
+    assert list(first) == ["finished_at", "rma", "serials", "counters", "stages"]
+    assert first["rma"] == "RMA100000" and first["serials"] == 1
+    assert first["counters"] == {"screen reads": 5}
+    assert first["stages"] == {"navigate": {"count": 1, "total": 0.02, "p50": 0.02, "p95": 0.02, "max": 0.02}}
+    assert json.loads(lines[1])["rma"] == "RMA100001"
@@ -0,0 +1,185 @@
+import io
+
+import pytest
+
+import tn5250
+from RmaReceivingApplication import BatchProcessor
+from tn5250 import Tn5250Terminal
+from conftest import open_list, receive
+
+
+def test_receive_rma_over_tn5250(host, dirs, tn5250_address):
+    terminal = Tn5250Terminal(*tn5250_address)
+    backend, serials = open_list(terminal, dirs, "RMA100001")
+    done, errors = receive(backend, serials, lookAhead=True)
+    assert errors == []
+    assert len(done) == 30
+    assert all(host.serials[serial]["other"] for serial in serials)
+    assert host.state == "menu"
+
+
+def test_rmas_over_tn5250_sessions(host, dirs, tn5250_address):
+    batch = BatchProcessor(output=io.StringIO(), shareRoot=dirs[0], localDir=dirs[1],
+                           sessions=[Tn5250Terminal(*tn5250_address) for _ in range(2)])
+    batch.run(["RMA100000", "RMA100001"])
+    assert [result["Status"] for result in batch.results] == ["Done", "Done"]
+    assert all(record["other"] for record in host.serials.values())
+
+
+def test_auto_sign_on(tn5250_server):
+    server, address = tn5250_server(password="SECRET")
+    terminal = Tn5250Terminal(*address, user="receiver", password="SECRET")
+    assert "Failure Analysis Menu" in terminal.read_screen()
+    terminal.close()
+
+
+def test_sign_on_screen(tn5250_server):
+    server, address = tn5250_server(password="SECRET", autoSignOn=False)
+    terminal = Tn5250Terminal(*address, user="receiver", password="SECRET")
+    assert "Failure Analysis Menu" in terminal.read_screen()
+    terminal.close()
+
+
+@pytest.mark.parametrize("autoSignOn", [True, False])
+def test_sign_on_refused(tn5250_server, autoSignOn):
+    server, address = tn5250_server(password="SECRET", autoSignOn=autoSignOn, extended=True)
+    with pytest.raises(ConnectionError, match="CPF1107"):
+        Tn5250Terminal(*address, user="receiver", password="WRONG")
+
+
+def test_sign_on_needs_a_user(tn5250_server):
+    server, address = tn5250_server(password="SECRET")
+    with pytest.raises(ConnectionError, match="a user and password are needed"):
+        Tn5250Terminal(*address)
+
+
+def test_receive_rma_over_the_extended_stream(host, dirs, tn5250_server):
+    server, address = tn5250_server(password="SECRET", extended=True)
+    terminal = Tn5250Terminal(*address, user="RECEIVER", password="SECRET")
+    backend, serials = open_list(terminal, dirs)
+    assert len(serials) == 30  # Three pages, each after a Roll
+    done, errors = receive(backend, serials)
+    assert errors == []
+    assert len(done) == 30
+    assert all(host.serials[serial]["other"] for serial in serials)
+    assert server.saved
+
+
+def test_error_message_on_the_message_line(tn5250_server):
+    server, address = tn5250_server(extended=True)
+    terminal = Tn5250Terminal(*address)
+    terminal.write_field(21, 6, "9")
+    terminal.send_keys("return")  # Comes back as Write Error Code
+    assert terminal.read_screen().split("\n")[-1].strip() == "Option 9 is not valid."
+    assert not terminal.locked
+
+
+class Stream:
+    """
+    Stands in for the telnet stream of an offline terminal, keeps the records sent.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def send_record(self, record):
+        self.records.append(record)
+
+
+def offline():
+    """
+    A Tn5250Terminal without a connection, the data stream is fed to process() by the test.
+    """
+    terminal = Tn5250Terminal.__new__(Tn5250Terminal)
+    terminal.stream = Stream()
+    terminal.screen = [" "] * (tn5250.ROWS * tn5250.COLS)
+    terminal.fields = []
+    terminal.cursor = 0
+    terminal.locked = True
+    return terminal
+
+
+def ebcdic(text):
+    return text.encode(tn5250.CODEPAGE)
+
+
+def wtd(*orders, unlock=True):
+    cc2 = tn5250.CC2_UNLOCK_KEYBOARD if unlock else 0x00
+    return bytes([tn5250.ESC, tn5250.CMD_CLEAR_UNIT, tn5250.ESC, tn5250.CMD_WRITE_TO_DISPLAY, 0x00, cc2]) + b"".join(orders)
+
+
+def row(terminal, n):
+    return terminal.read_screen().split("\n")[n]
+
+
+def test_skipped_orders_keep_their_lengths():
+    terminal = offline()
+    terminal.process(wtd(
+        bytes([tn5250.ORDER_SOH, 3, 0x00, 0x00, 0x00]),
+        bytes([tn5250.ORDER_WDSF, 0x00, 0x08, 0xD9, 0x51, 0x00, 0x00, 0x11, 0x13]),  # Holds bytes that look like orders
+        bytes([tn5250.ORDER_SBA, 2, 3, tn5250.ORDER_WEA, 0x01, 0x22]) + ebcdic("Sign On"),
+        bytes([tn5250.ORDER_SBA, 3, 1, tn5250.ORDER_TD, 0x00, 0x05]) + ebcdic("A\x00B  "),
+        bytes([tn5250.ORDER_SBA, 5, 9, tn5250.ORDER_SF]) + tn5250.FFW_INPUT + bytes([tn5250.ATTR_UNDERLINE, 0x00, 0x0A]),
+        bytes([tn5250.ORDER_IC, 1, 1, tn5250.ORDER_MC, 5, 10]),
+    ))
+    assert not terminal.locked
+    assert row(terminal, 1) == "  Sign On".ljust(80)
+    assert row(terminal, 2).startswith("A B  ")
+    assert [(field.row, field.col, field.length) for field in terminal.fields] == [(4, 9, 10)]
+    assert terminal.cursor == 4 * 80 + 9  # Move Cursor after Insert Cursor
+
+
+def test_write_error_code():
+    terminal = offline()
+    terminal.process(wtd(bytes([tn5250.ORDER_SBA, 24, 1]) + ebcdic("old message"), unlock=False))
+    assert terminal.locked
+    terminal.process(bytes([tn5250.ESC, tn5250.CMD_WRITE_ERROR_CODE]) + ebcdic("Position to value not valid."))
+    assert row(terminal, 23) == "Position to value not valid.".ljust(80)
+    assert not terminal.locked
+
+
+@pytest.mark.parametrize("control, expected", [
+    (2, ["row 4", "", ""]),                             # Up two rows
+    (tn5250.ROLL_DOWN | 1, ["", "row 2", "row 3"]),     # Down one row
+    (tn5250.ROLL_DOWN | 9, ["", "", ""]),               # More rows than the area has
+])
+def test_roll(control, expected):
+    terminal = offline()
+    terminal.process(wtd(*(bytes([tn5250.ORDER_SBA, n, 1]) + ebcdic(f"row {n}") for n in range(1, 6))))
+    terminal.process(bytes([tn5250.ESC, tn5250.CMD_ROLL, control, 2, 4]))  # Rows 2 to 4
+    assert [row(terminal, n).strip() for n in range(5)] == ["row 1"] + expected + ["row 5"]
+
+
+def test_save_and_restore_screen():
+    terminal = offline()
+    terminal.process(wtd(
+        bytes([tn5250.ORDER_SBA, 1, 2]) + ebcdic("Failure Analysis Menu"),
+        bytes([tn5250.ORDER_SBA, 22, 6, tn5250.ORDER_SF]) + tn5250.FFW_INPUT + bytes([tn5250.ATTR_UNDERLINE, 0x00, 0x14]),
+        bytes([tn5250.ORDER_IC, 22, 7]),
+    ))
+    terminal.write_field(21, 6, "02")
+    screen, fields = terminal.read_screen(), [(field.start(), field.length, field.modified) for field in terminal.fields]
+
+    terminal.process(bytes([tn5250.ESC, tn5250.CMD_SAVE_SCREEN]))
+    record, = terminal.stream.records
+    opcode, saved = tn5250.split_record(record)
+    assert opcode == tn5250.OPCODE_SAVE_SCREEN
+
+    terminal.process(wtd(bytes([tn5250.ORDER_SBA, 5, 5]) + ebcdic("A window over the screen")))
+    terminal.locked = True
+    terminal.process(bytes([tn5250.ESC, tn5250.CMD_RESTORE_SCREEN]) + saved)
+    assert terminal.read_screen() == screen
+    assert [(field.start(), field.length, field.modified) for field in terminal.fields] == fields
+    assert terminal.cursor == 21 * 80 + 6 and terminal.locked  # Restored, the keyboard stays locked
+
+
+def test_unknown_command():
+    with pytest.raises(ConnectionError, match="Unsupported 5250 command"):
+        offline().process(bytes([tn5250.ESC, 0xF3, 0x00, 0x05, 0xD9, 0x70, 0x00]))
+
+
+def test_environ_round_trip():
+    variables = [(tn5250.ENV_VAR, "USER", "RECEIVER"), (tn5250.ENV_USERVAR, "IBMSUBSPW", "a\x01b\x02"),
+                 (tn5250.ENV_VAR, "EMPTY", None)]
+    data = tn5250.build_environ(tn5250.ENV_IS, variables)
+    assert tn5250.split_environ(data) == {"USER": "RECEIVER", "IBMSUBSPW": "a\x01b\x02", "EMPTY": None}
@@ -0,0 +1,51 @@
+import pytest
+
+from RmaReceivingApplication import WindowLocator
+from as400_simulator import SimulatedWindowSystem
+
+
+def test_window_is_found_once():
+    windows = SimulatedWindowSystem()
+    locator = WindowLocator(windows)
+    hwnd = locator.locate()
+    assert windows.title(hwnd) == "AS400 Session A"
+
+    for _ in range(5):
+        assert locator.locate() == hwnd
+    assert windows.enumerations == 1
+
+
+def test_closed_window_is_found_again():
+    windows = SimulatedWindowSystem()
+    locator = WindowLocator(windows)
+    first = locator.locate()
+    windows.close(first)
+    second = windows.open("AS400 Session B")
+
+    assert locator.locate() == second
+    assert windows.enumerations == 2
+
+
+def test_renamed_window_is_found_again():
+    windows = SimulatedWindowSystem()
+    locator = WindowLocator(windows)
+    hwnd = locator.locate()
+    windows.windows[hwnd] = "Untitled - Notepad"  # The handle was reused by another window
+    other = windows.open("as400 session c")
+
+    assert locator.locate() == other
+
+
+def test_invalidate_enumerates_again():
+    windows = SimulatedWindowSystem()
+    locator = WindowLocator(windows)
+    locator.locate()
+    locator.invalidate()
+    locator.locate()
+    assert windows.enumerations == 2
+
+
+def test_no_window():
+    locator = WindowLocator(SimulatedWindowSystem(("Inbox - Outlook",)))
+    with pytest.raises(RuntimeError):
+        locator.locate()
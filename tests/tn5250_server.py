@@ -0,0 +1,186 @@
+import argparse
+import os
+import socketserver
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from as400_simulator import SimulatedAS400
+import tn5250
+
+"""
+TN5250 Test Server
+==================
+
+Description:
+Serves the simulated AS400 of `as400_simulator.py` over TN5250, so the client in `tn5250.py` (and the program with
+`--tn5250`) can be run without an AS400. The tests start one per test on a free port.
+
+With a password the sessions start on the Sign On screen, unless the client signs on with NEW-ENVIRON. With
+`extended` the screens also carry what a real host sends that the Failure Analysis screens don't need: a header
+(SOH), extended attributes (WEA), a structured field (WDSF), the title as transparent data (TD), the cursor set with
+Move Cursor, messages as Write Error Code, a Save Screen / Restore Screen round trip on every attention key and a
+Roll before every page of the FA02 list.
+
+Usage:
+    python tests/tn5250_server.py --port 2323   (then: python RmaReceivingApplication.py --tn5250 localhost:2323)
+    python tests/tn5250_server.py --port 2323 --password SECRET   (then: AS400_PASSWORD=SECRET python
+        RmaReceivingApplication.py --tn5250 localhost:2323 --user RECEIVER)
+"""
+
+
+class Tn5250Server:
+    """
+    Serves the simulated AS400 over TN5250 on a local socket. Every connection gets its own session of the host.
+    """
+
+    AID_KEYS = {0xF1: "enter", 0xF5: "pagedown", 0xF4: "pageup", 0x33: "f3", 0x3C: "f12"}
+
+    def __init__(self, host=None, address=("127.0.0.1", 0), password=None, extended=False, autoSignOn=True):
+        """
+        Args:
+            host (SimulatedAS400): The host to serve, a generated one if not given
+            address (tuple): (interface, port) to listen on, port 0 picks a free port
+            password (str): Password of the receiver, the sessions start on the Sign On screen if given
+            extended (bool): Also send the orders and commands the screens don't need, see the module description
+            autoSignOn (bool): Ask the client for its user and password with NEW-ENVIRON (when there is a password)
+
+        Returns: Nothing
+        """
+        self.host = host if host is not None else SimulatedAS400.generate()
+        self.password = password
+        self.extended = extended
+        self.autoSignOn = autoSignOn and password is not None
+        self.saved = []  # Screens the clients sent back for Save Screen
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(handler):
+                self.serve_session(handler.request)
+
+        self.server = socketserver.ThreadingTCPServer(address, Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+    def start(self):
+        """
+        Starts accepting connections in a background thread.
+
+        Returns:
+            tuple: The (interface, port) the server listens on
+        """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.address
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_session(self, sock):
+        """
+        Runs one 5250 session: send the screen, read the attention key and the modified fields, repeat.
+        """
+        session = self.host.session(self.password)
+        stream = tn5250.TelnetStream(sock, server=True)
+        stream.negotiate(environ=self.autoSignOn)
+        try:
+            stream.wait_for(lambda: stream.terminalType is not None and (
+                not self.autoSignOn or stream.environ is not None or tn5250.OPT_NEW_ENVIRON in stream.refused))
+        except ConnectionError:
+            return
+        if stream.environ:
+            session.sign_on(stream.environ.get("USER") or "", stream.environ.get("IBMSUBSPW"))
+            session.render()
+
+        restore = None  # Sent after Restore Screen, None to go straight to the next screen
+        while True:
+            try:
+                if restore is not None:
+                    self.save_and_restore(stream, restore)
+                stream.send_record(tn5250.build_record(self.write_screen(session)))
+                opcode, data = tn5250.split_record(stream.read_record())
+            except ConnectionError:
+                return
+
+            values = session.values()
+            fields = {(field.row, field.col): field.name for field in session.fields}
+            starts = [i for i in range(3, len(data)) if data[i] == tn5250.ORDER_SBA]
+            for n, i in enumerate(starts):
+                end = starts[n + 1] if n + 1 < len(starts) else len(data)
+                name = fields.get((data[i + 1] - 1, data[i + 2] - 1))
+                if name is not None:
+                    values[name] = data[i + 3:end].decode(tn5250.CODEPAGE).rstrip()
+
+            key = self.AID_KEYS.get(data[2])
+            if key is not None:
+                top = session.top if session.state == "list" else None
+                session.aid(key, values)
+                if self.extended:
+                    # Like a window put over the screen while the host works, then taken away again
+                    restore = b""
+                    if top is not None and session.state == "list" and session.top != top:
+                        lines = session.page_size
+                        restore = bytes([tn5250.ESC, tn5250.CMD_ROLL, lines, 9, 8 + lines])  # Roll the list up
+
+    def save_and_restore(self, stream, restore):
+        """
+        Sends Save Screen, keeps the screen the client sends back and restores it followed by the `restore` commands.
+        """
+        stream.send_record(tn5250.build_record(bytes([tn5250.ESC, tn5250.CMD_SAVE_SCREEN])))
+        opcode, saved = tn5250.split_record(stream.read_record())
+        if opcode != tn5250.OPCODE_SAVE_SCREEN:
+            raise ConnectionError(f"Expected the saved screen, got a record with opcode {opcode:#04x}")
+        self.saved.append(saved)
+        stream.send_record(tn5250.build_record(bytes([tn5250.ESC, tn5250.CMD_RESTORE_SCREEN]) + saved + restore))
+
+    def write_screen(self, session):
+        """
+        Encodes the current screen of a session as Clear Unit, Write To Display and Read MDT Fields.
+
+        Returns:
+            bytes: The 5250 data for the record
+        """
+        data = bytearray([tn5250.ESC, tn5250.CMD_CLEAR_UNIT,
+                          tn5250.ESC, tn5250.CMD_WRITE_TO_DISPLAY, 0x00, tn5250.CC2_UNLOCK_KEYBOARD])
+        lines = list(session.lines)
+        message = lines[-1].strip() if self.extended else ""
+        if self.extended:
+            lines[-1] = " " * len(lines[-1])  # Sent as Write Error Code instead
+            data += bytes([tn5250.ORDER_SOH, 3, 0x00, 0x00, 0x00])
+            data += bytes([tn5250.ORDER_WDSF, 0x00, 0x06, 0xD9, 0x5F, 0x00, 0x00])  # Remove GUI constructs
+            title = lines[0].encode(tn5250.CODEPAGE)
+            data += bytes([tn5250.ORDER_SBA, 1, 1, tn5250.ORDER_WEA, 0x01, 0x20, tn5250.ORDER_TD])
+            data += len(title).to_bytes(2, "big") + title
+            lines[0] = None
+        for row, line in enumerate(lines):
+            if line is not None:
+                data += bytes([tn5250.ORDER_SBA, row + 1, 1]) + line.encode(tn5250.CODEPAGE)
+        for field in session.fields:
+            # The attribute byte sits in the position before the first character of the field
+            data += bytes([tn5250.ORDER_SBA, field.row + 1, field.col, tn5250.ORDER_SF]) + tn5250.FFW_INPUT
+            data += bytes([tn5250.ATTR_UNDERLINE]) + field.length.to_bytes(2, "big") + field.value.encode(tn5250.CODEPAGE)
+        if session.fields:
+            cursor = session.fields[session.cursorField]
+            if self.extended:  # Insert Cursor somewhere else first, Move Cursor puts it in place
+                data += bytes([tn5250.ORDER_IC, 1, 1, tn5250.ORDER_MC, cursor.row + 1, cursor.col + 1])
+            else:
+                data += bytes([tn5250.ORDER_IC, cursor.row + 1, cursor.col + 1])
+        if message:
+            data += bytes([tn5250.ESC, tn5250.CMD_WRITE_ERROR_CODE, tn5250.ORDER_SBA, 24, 2]) + message.encode(tn5250.CODEPAGE)
+        data += bytes([tn5250.ESC, tn5250.CMD_READ_MDT_FIELDS, 0x00, 0x00])
+        return bytes(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the simulated AS400 over TN5250")
+    parser.add_argument("--port", type=int, default=2323, help="Port to listen on")
+    parser.add_argument("--rmas", type=int, default=3, help="Number of RMAs to generate")
+    parser.add_argument("--serials", type=int, default=30, help="Number of serials in every RMA")
+    parser.add_argument("--password", help="Start every session on the Sign On screen, RECEIVER signs on with this password")
+    parser.add_argument("--extended", action="store_true", help="Also send the orders and commands the screens don't need")
+    args = parser.parse_args()
+
+    server = Tn5250Server(SimulatedAS400.generate(args.rmas, args.serials), ("127.0.0.1", args.port),
+                          password=args.password, extended=args.extended)
+    print(f"Simulated AS400 listening on {server.address[0]}:{server.address[1]}, RMAs RMA100000 to RMA{100000 + args.rmas - 1}")
+    server.server.serve_forever()
@@ -0,0 +1,698 @@
+import socket
+import time
+
+from terminal_driver import TerminalDriver
+
+"""
+TN5250 Client
+=============
+
+Description:
+Talks to the AS400 directly over a TN5250 (telnet 5250 data stream) connection instead of synthesizing keystrokes
+into the emulator window and scraping the clipboard. The screen buffer is built straight from the Write To Display
+data the host sends, fields are written by address, and after an attention key (Enter, Page Down, ...) the client
+waits for the host to unlock the keyboard instead of sleeping for a fixed time.
+
+Only the part of the 5250 data stream a sign on and the Failure Analysis screens use is implemented: Clear Unit,
+Write To Display (SBA, SF, IC, MC, RA, TD orders; SOH, WEA and WDSF are skipped), Write Error Code, Save Screen,
+Restore Screen, Roll, Read MDT Fields / Read Input Fields and the AID keys in `Tn5250Terminal.AID_KEYS`.
+
+Given a user and password the client signs on by itself: with the NEW-ENVIRON telnet option (RFC 4777 auto sign-on,
+the password is sent as clear text) or, when the host shows the Sign On screen anyway, by filling that screen in.
+
+`tests/tn5250_server.py` serves the simulated AS400 over this protocol so the client can be run locally.
+"""
+
+ROWS = 24
+COLS = 80
+CODEPAGE = "cp037"  # EBCDIC code page of the AS400 session
+
+# Telnet commands and options (RFC 854, 1091, 885, 856)
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+EOR = 239
+OPT_BINARY = 0
+OPT_TTYPE = 24
+OPT_EOR = 25
+OPT_NEW_ENVIRON = 39
+TTYPE_IS = 0
+TTYPE_SEND = 1
+TERMINAL_TYPE = b"IBM-3179-2"
+ENV_IS = 0
+ENV_SEND = 1
+ENV_VAR = 0
+ENV_VALUE = 1
+ENV_ESC = 2
+ENV_USERVAR = 3
+
+# 5250 data stream (RFC 1205)
+RECORD_TYPE = b"\x12\xa0"
+OPCODE_PUT_GET = 0x03
+OPCODE_SAVE_SCREEN = 0x04
+ESC = 0x04
+CMD_CLEAR_UNIT = 0x40
+CMD_WRITE_TO_DISPLAY = 0x11
+CMD_WRITE_ERROR_CODE = 0x21
+CMD_SAVE_SCREEN = 0x02
+CMD_RESTORE_SCREEN = 0x12
+CMD_ROLL = 0x23
+CMD_READ_INPUT_FIELDS = 0x42
+CMD_READ_MDT_FIELDS = 0x52
+ORDER_SOH = 0x01
+ORDER_RA = 0x02
+ORDER_TD = 0x10
+ORDER_SBA = 0x11
+ORDER_WEA = 0x12
+ORDER_IC = 0x13
+ORDER_MC = 0x14
+ORDER_WDSF = 0x15
+ORDER_SF = 0x1D
+CC2_UNLOCK_KEYBOARD = 0x08
+ROLL_DOWN = 0x80
+ATTR_NORMAL = 0x20
+ATTR_UNDERLINE = 0x24
+FFW_INPUT = b"\x40\x00"
+FFW_MDT = 0x08  # Modified data tag, in the first byte of the field format word
+SIGN_ON_TITLE = "Sign On"
+
+
+def build_record(data, opcode=OPCODE_PUT_GET):
+    """
+    Puts the 5250 record header in front of the data.
+
+    Args:
+        data (bytes): The 5250 commands and orders
+        opcode (int): The operation code of the record
+
+    Returns:
+        bytes: The record, ready to send with `TelnetStream.send_record`
+    """
+    length = 10 + len(data)
+    return length.to_bytes(2, "big") + RECORD_TYPE + b"\x00\x00" + bytes([4, 0, 0, opcode]) + data
+
+
+def build_environ(command, variables):
+    """
+    Encodes a NEW-ENVIRON subnegotiation (RFC 1572), without the IAC SB / IAC SE around it.
+
+    Args:
+        command (int): ENV_IS or ENV_SEND
+        variables (list): (ENV_VAR or ENV_USERVAR, name, value) for every variable, value None to only name it
+
+    Returns:
+        bytes: The subnegotiation data
+    """
+    def escape(text):
+        return b"".join(bytes([ENV_ESC, byte]) if byte <= ENV_USERVAR else bytes([byte]) for byte in text.encode("ascii"))
+
+    data = bytearray([OPT_NEW_ENVIRON, command])
+    for kind, name, value in variables:
+        data += bytes([kind]) + escape(name)
+        if value is not None:
+            data += bytes([ENV_VALUE]) + escape(value)
+    return bytes(data)
+
+
+def split_environ(data):
+    """
+    Decodes the variables of a NEW-ENVIRON subnegotiation built by build_environ().
+
+    Args:
+        data (bytes): The subnegotiation data
+
+    Returns:
+        dict: Variable name -> value (None if the variable has no value)
+    """
+    variables = {}
+    name = value = None
+    current = None
+    i = 2
+    while i <= len(data):
+        byte = data[i] if i < len(data) else ENV_VAR  # A last marker ends the last variable
+        if byte in (ENV_VAR, ENV_USERVAR):
+            if name is not None:
+                variables[name.decode("ascii")] = None if value is None else value.decode("ascii")
+            name, value = bytearray(), None
+            current = name
+        elif byte == ENV_VALUE:
+            value = bytearray()
+            current = value
+        else:
+            if byte == ENV_ESC:
+                i += 1
+                byte = data[i]
+            current.append(byte)
+        i += 1
+    return variables
+
+
+def split_record(record):
+    """
+    Splits a 5250 record into its operation code and data.
+
+    Args:
+        record (bytes): A record read with `TelnetStream.read_record`
+
+    Returns:
+        tuple: (opcode (int), data (bytes))
+    """
+    if len(record) < 10 or record[2:4] != RECORD_TYPE:
+        raise ConnectionError("Received data that is not a 5250 record")
+    header = 6 + record[6]
+    return record[9], record[header:]
+
+
+class TelnetStream:
+    """
+    Telnet framing over a socket. Data records end with IAC EOR, IAC bytes inside the data are doubled and telnet
+    option negotiation is answered as it arrives.
+    """
+
+    def __init__(self, sock, server=False, environ=None):
+        """
+        Args:
+            sock (socket.socket): The connected socket
+            server (bool): True when this end is the host, the host asks for the terminal type instead of sending it
+            environ (list): (ENV_VAR or ENV_USERVAR, name, value) the client sends when the host asks for its
+                environment, e.g. the user and password of an auto sign on. NEW-ENVIRON is refused if not given.
+
+        Returns: Nothing
+        """
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Records are small, don't hold them back
+        self.server = server
+        self.buffer = bytearray()
+        self.terminalType = None
+        self.environ = environ  # On the host: the variables the client sent, None until it sent them
+        self.refused = set()    # On the host: options the client refused
+
+    def send(self, data):
+        self.sock.sendall(bytes(data))
+
+    def send_command(self, command, option):
+        self.send([IAC, command, option])
+
+    def send_record(self, record):
+        """
+        Sends one 5250 record followed by IAC EOR.
+        """
+        self.send(record.replace(bytes([IAC]), bytes([IAC, IAC])) + bytes([IAC, EOR]))
+
+    def negotiate(self, environ=False):
+        """
+        Starts the option negotiation from the host side: terminal type, end of record and binary transmission.
+
+        Args:
+            environ (bool): Also ask for the client's environment (NEW-ENVIRON), which carries an auto sign on
+        """
+        self.send([IAC, DO, OPT_TTYPE, IAC, SB, OPT_TTYPE, TTYPE_SEND, IAC, SE])
+        for option in (OPT_EOR, OPT_BINARY):
+            self.send([IAC, DO, option, IAC, WILL, option])
+        if environ:
+            self.send_command(DO, OPT_NEW_ENVIRON)
+
+    def wait_for(self, condition):
+        """
+        Answers the telnet negotiation until condition() is true. Only used before the first data record.
+        """
+        while not condition():
+            if not self.buffer:
+                self.fill()
+            elif self.buffer[0] != IAC:
+                raise ConnectionError("Received data before the telnet negotiation ended")
+            else:
+                self.command(bytearray())
+
+    def read_record(self):
+        """
+        Reads until a full data record has arrived, answering any telnet negotiation on the way.
+
+        Returns:
+            bytes: The record without the IAC EOR
+        """
+        record = bytearray()
+        while True:
+            iac = self.buffer.find(IAC)
+            if iac < 0:
+                record += self.buffer
+                self.buffer.clear()
+                self.fill()
+                continue
+
+            record += self.buffer[:iac]
+            del self.buffer[:iac]
+            if self.command(record):
+                return bytes(record)
+
+    def command(self, record):
+        """
+        Handles the telnet command at the start of the buffer.
+
+        Args:
+            record (bytearray): The record being read, a doubled IAC is a data byte of it
+
+        Returns:
+            bool: True if the command ends the record
+        """
+        self.fill_at_least(2)
+        command = self.buffer[1]
+        if command == IAC:
+            record.append(IAC)
+            del self.buffer[:2]
+        elif command == EOR:
+            del self.buffer[:2]
+            return True
+        elif command == SB:
+            while self.buffer.find(bytes([IAC, SE])) < 0:
+                self.fill()
+            end = self.buffer.find(bytes([IAC, SE]))
+            self.subnegotiation(bytes(self.buffer[2:end]))
+            del self.buffer[:end + 2]
+        elif command in (DO, DONT, WILL, WONT):
+            self.fill_at_least(3)
+            self.option(command, self.buffer[2])
+            del self.buffer[:3]
+        else:
+            del self.buffer[:2]
+        return False
+
+    def fill_at_least(self, count):
+        while len(self.buffer) < count:
+            self.fill()
+
+    def fill(self):
+        data = self.sock.recv(4096)
+        if not data:
+            raise ConnectionError("The 5250 session was closed")
+        self.buffer += data
+
+    def option(self, command, option):
+        """
+        Agrees to terminal type, end of record and binary transmission, and to NEW-ENVIRON when there is an environment
+        to send. Refuses every other option. The host asks for the environment once the client agrees to send it.
+        """
+        supported = option in (OPT_TTYPE, OPT_EOR, OPT_BINARY) or (option == OPT_NEW_ENVIRON and self.environ is not None)
+        if self.server:
+            if command == WONT:
+                self.refused.add(option)
+            elif command == WILL and option == OPT_NEW_ENVIRON:
+                self.send(bytes([IAC, SB]) + build_environ(ENV_SEND, [(ENV_VAR, "USER", None),
+                                                                      (ENV_USERVAR, "IBMSUBSPW", None)]) + bytes([IAC, SE]))
+            return
+        if command == DO:
+            self.send_command(WILL if supported else WONT, option)
+        elif command == WILL:
+            self.send_command(DO if supported else DONT, option)
+
+    def subnegotiation(self, data):
+        if data[:1] == bytes([OPT_NEW_ENVIRON]):
+            if self.server and data[1:2] == bytes([ENV_IS]):
+                self.environ = split_environ(data)
+            elif not self.server and data[1:2] == bytes([ENV_SEND]) and self.environ is not None:
+                self.send(bytes([IAC, SB]) + build_environ(ENV_IS, self.environ) + bytes([IAC, SE]))
+            return
+        if data[:1] != bytes([OPT_TTYPE]):
+            return
+        if self.server and data[1:2] == bytes([TTYPE_IS]):
+            self.terminalType = data[2:].decode("ascii")
+        elif not self.server and data[1:2] == bytes([TTYPE_SEND]):
+            self.send(bytes([IAC, SB, OPT_TTYPE, TTYPE_IS]) + TERMINAL_TYPE + bytes([IAC, SE]))
+
+
+class Tn5250Field:
+    """
+    An input field in the client screen buffer.
+    """
+
+    def __init__(self, row, col, length):
+        """
+        Args:
+            row (int): Row of the first character of the field (0 based)
+            col (int): Column of the first character of the field (0 based)
+            length (int): Number of characters in the field
+
+        Returns: Nothing
+        """
+        self.row = row
+        self.col = col
+        self.length = length
+        self.modified = False  # Modified data tag, only modified fields are sent back to the host
+
+    def start(self):
+        return self.row * COLS + self.col
+
+    def contains(self, address):
+        return self.start() <= address < self.start() + self.length
+
+
+class Tn5250Terminal(TerminalDriver):
+    """
+    TerminalDriver that speaks the 5250 data stream over a socket.
+
+    Keys are handled the same way the simulator handles them: typing fills the field under the cursor and moves to
+    the next field when it is full, down/tab and up move between input fields, right/left move inside a field and
+    end erases to the end of the field. Attention keys send the modified fields to the host and wait for the keyboard
+    to unlock.
+    """
+
+    supports_fields = True
+    owns_screen = True
+
+    AID_KEYS = {"return": 0xF1, "enter": 0xF1, "pagedown": 0xF5, "pageup": 0xF4, "f3": 0x33, "f12": 0x3C}
+
+    def __init__(self, host, port=23, timeout=10.0, user=None, password=None):
+        """
+        Connects to the host, signs on if a user is given and waits for the first screen.
+
+        Args:
+            host (str): Name or address of the AS400
+            port (int): Telnet port of the AS400
+            timeout (float): Seconds to wait for the host to unlock the keyboard before giving up
+            user (str): User profile to sign on with, the host's own Sign On screen is left to the caller if not given
+            password (str): Password of the user profile
+
+        Returns: Nothing
+
+        Raises:
+            ConnectionError: If the host refused the sign on, or asks for one and no user is given
+        """
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        # Auto sign on (RFC 4777): the host skips the Sign On screen when the user and password are valid
+        environ = None if user is None else [(ENV_VAR, "USER", user.upper()), (ENV_USERVAR, "IBMSUBSPW", password or "")]
+        self.stream = TelnetStream(self.sock, environ=environ)
+
+        self.screen = [" "] * (ROWS * COLS)
+        self.fields = []
+        self.cursor = 0
+        self.locked = True
+        try:
+            self.wait_for_unlock()
+            if self.on_sign_on():
+                self.sign_on(user, password)
+        except Exception:
+            self.sock.close()
+            raise
+
+    def close(self):
+        self.sock.close()
+
+    def on_sign_on(self):
+        """
+        Returns:
+            bool: True if the host shows its Sign On screen (the title is on one of the first two rows)
+        """
+        return any(SIGN_ON_TITLE in row for row in self.read_screen().split("\n")[:2])
+
+    def sign_on(self, user, password):
+        """
+        Fills in the Sign On screen (the user and the password are its first two input fields) and presses Enter.
+
+        Raises:
+            ConnectionError: If no user is given or the host shows the Sign On screen again
+        """
+        if user is None:
+            raise ConnectionError("The AS400 asks to sign on, a user and password are needed")
+        if len(self.fields) < 2:
+            raise ConnectionError("The Sign On screen has no user and password fields")
+        for field, text in zip(self.fields, (user.upper(), password or "")):
+            self.write_field(field.row, field.col, text)
+        self.send_aid(self.AID_KEYS["enter"])
+        if self.on_sign_on():
+            message = self.read_screen().split("\n")[ROWS - 1].strip()
+            raise ConnectionError(f"The AS400 refused the sign on: {message or 'no message'}")
+
+    # ----------------------------------------------------------------------------------------------------------
+    # TerminalDriver
+    # ----------------------------------------------------------------------------------------------------------
+
+    def focus(self):
+        pass  # Nothing to bring to the front, the session is a socket
+
+    def send_keys(self, *keys):
+        for key in keys:
+            key = key.lower()
+            field = self.field_at(self.cursor)
+            if key in self.AID_KEYS:
+                self.send_aid(self.AID_KEYS[key])
+            elif key in ("down", "tab"):
+                self.move(1)
+            elif key == "up":
+                self.move(-1)
+            elif key == "right" and field is not None:
+                self.cursor = min(self.cursor + 1, field.start() + field.length - 1)
+            elif key == "left" and field is not None:
+                self.cursor = max(self.cursor - 1, field.start())
+            elif key == "end" and field is not None:  # Erase to the end of the field
+                for address in range(self.cursor, field.start() + field.length):
+                    self.screen[address] = " "
+                field.modified = True
+            elif key == "home" and self.fields:
+                self.cursor = self.fields[0].start()
+
+    def type_text(self, text, interval=0.0):
+        for char in text:
+            field = self.field_at(self.cursor)
+            if field is None:
+                self.move(1)
+                field = self.field_at(self.cursor)
+                if field is None:
+                    return  # No input fields on the screen
+            self.screen[self.cursor] = char
+            field.modified = True
+            self.cursor += 1
+            if not field.contains(self.cursor):  # Field is full, move on to the next one
+                self.cursor = field.start()
+                self.move(1)
+
+    def read_screen(self):
+        text = "".join(self.screen)
+        return "\n".join(text[row * COLS:(row + 1) * COLS] for row in range(ROWS))
+
+    # ----------------------------------------------------------------------------------------------------------
+    # Fields
+    # ----------------------------------------------------------------------------------------------------------
+
+    def field_at(self, address):
+        for field in self.fields:
+            if field.contains(address):
+                return field
+        return None
+
+    def move(self, step):
+        """
+        Moves the cursor to the start of the next (step=1) or previous (step=-1) input field, wrapping around.
+        """
+        if not self.fields:
+            return
+        current = self.field_at(self.cursor)
+        if current is not None:
+            i = (self.fields.index(current) + step) % len(self.fields)
+        elif step > 0:
+            after = [i for i, field in enumerate(self.fields) if field.start() > self.cursor]
+            i = after[0] if after else 0
+        else:
+            before = [i for i, field in enumerate(self.fields) if field.start() < self.cursor]
+            i = before[-1] if before else len(self.fields) - 1
+        self.cursor = self.fields[i].start()
+
+    def write_field(self, row, col, text):
+        """
+        Writes straight into the input field that starts at the given position, no cursor movement needed.
+
+        Args:
+            row (int): Row of the first character of the field (0 based)
+            col (int): Column of the first character of the field (0 based)
+            text (str): New content of the field, cut or padded to the length of the field
+        """
+        field = self.field_at(row * COLS + col)
+        if field is None:
+            raise ValueError(f"There is no input field at row {row}, column {col}")
+        text = text[:field.length].ljust(field.length)
+        self.screen[field.start():field.start() + field.length] = list(text)
+        field.modified = True
+
+    # ----------------------------------------------------------------------------------------------------------
+    # Data stream
+    # ----------------------------------------------------------------------------------------------------------
+
+    def send_aid(self, aid):
+        """
+        Sends an attention key with the cursor position and every modified field, then waits for the next screen.
+        """
+        row, col = divmod(self.cursor, COLS)
+        data = bytearray([row + 1, col + 1, aid])
+        for field in self.fields:
+            if field.modified:
+                text = "".join(self.screen[field.start():field.start() + field.length]).rstrip()
+                data += bytes([ORDER_SBA, field.row + 1, field.col + 1]) + text.encode(CODEPAGE, errors="replace")
+        self.locked = True
+        self.stream.send_record(build_record(bytes(data)))
+        self.wait_for_unlock()
+
+    def wait_for_unlock(self):
+        """
+        Processes records from the host until it unlocks the keyboard.
+
+        Raises:
+            TimeoutError: If the keyboard is still locked after `self.timeout` seconds
+        """
+        deadline = time.monotonic() + self.timeout
+        while self.locked:
+            if time.monotonic() > deadline:
+                raise TimeoutError("The AS400 did not unlock the keyboard")
+            try:
+                record = self.stream.read_record()
+            except socket.timeout:
+                raise TimeoutError("The AS400 did not unlock the keyboard")
+            opcode, data = split_record(record)
+            self.process(data)
+
+    def process(self, data):
+        """
+        Applies the 5250 commands in one record to the screen buffer.
+        """
+        i = 0
+        while i < len(data):
+            if data[i] != ESC:
+                raise ConnectionError(f"Unexpected byte {data[i]:#04x} in the 5250 data stream")
+            command = data[i + 1]
+            i += 2
+            if command == CMD_CLEAR_UNIT:
+                self.screen = [" "] * (ROWS * COLS)
+                self.fields = []
+                self.cursor = 0
+            elif command == CMD_WRITE_TO_DISPLAY:
+                cc2 = data[i + 1]
+                i = self.write_to_display(data, i + 2)
+                if cc2 & CC2_UNLOCK_KEYBOARD:
+                    self.locked = False
+            elif command in (CMD_READ_MDT_FIELDS, CMD_READ_INPUT_FIELDS):
+                i += 2
+                self.locked = False  # The host is waiting for input
+            elif command == CMD_WRITE_ERROR_CODE:
+                # The message goes on the message line. Error Reset is pressed right away: the host waits for the
+                # input to be corrected, the message stays on the screen for the caller to read.
+                message = (ROWS - 1) * COLS
+                self.screen[message:] = [" "] * COLS
+                i = self.write_to_display(data, i, message)
+                self.locked = False
+            elif command == CMD_SAVE_SCREEN:
+                # The host keeps the screen (e.g. under a window) and sends it back with Restore Screen
+                self.stream.send_record(build_record(self.screen_data(), OPCODE_SAVE_SCREEN))
+            elif command == CMD_RESTORE_SCREEN:
+                pass  # The saved screen follows as ordinary commands
+            elif command == CMD_ROLL:
+                self.roll(data[i], data[i + 1], data[i + 2])
+                i += 3
+            else:
+                raise ConnectionError(f"Unsupported 5250 command {command:#04x}")
+
+    def screen_data(self):
+        """
+        Encodes the screen buffer, the input fields and the cursor as the commands that draw them again. It is what
+        the host gets back for Save Screen, the keyboard stays locked when it is restored.
+
+        Returns:
+            bytes: The 5250 data
+        """
+        data = bytearray([ESC, CMD_CLEAR_UNIT, ESC, CMD_WRITE_TO_DISPLAY, 0x00, 0x00])
+        for row in range(ROWS):
+            text = "".join(self.screen[row * COLS:(row + 1) * COLS])
+            data += bytes([ORDER_SBA, row + 1, 1]) + text.encode(CODEPAGE, errors="replace")
+        for field in self.fields:
+            row, col = divmod(field.start() - 1, COLS)  # The attribute byte in front of the field
+            ffw = bytes([FFW_INPUT[0] | (FFW_MDT if field.modified else 0), FFW_INPUT[1]])
+            text = "".join(self.screen[field.start():field.start() + field.length])
+            data += bytes([ORDER_SBA, row + 1, col + 1, ORDER_SF]) + ffw + bytes([ATTR_UNDERLINE])
+            data += field.length.to_bytes(2, "big") + text.encode(CODEPAGE, errors="replace")
+        row, col = divmod(self.cursor, COLS)
+        data += bytes([ORDER_IC, row + 1, col + 1])
+        return bytes(data)
+
+    def roll(self, control, top, bottom):
+        """
+        Rolls the rows from top to bottom (1 based) up or down, the rows rolled in are blank. Input fields stay where
+        they are.
+
+        Args:
+            control (int): ROLL_DOWN for down, plus the number of rows in the low 5 bits
+            top (int): First row of the area
+            bottom (int): Last row of the area
+        """
+        lines = control & 0x1F
+        if not control & ROLL_DOWN:
+            lines = -lines
+        rows = [self.screen[row * COLS:(row + 1) * COLS] for row in range(top - 1, bottom)]
+        for n in range(len(rows)):
+            source = n - lines
+            row = rows[source] if 0 <= source < len(rows) else [" "] * COLS
+            self.screen[(top - 1 + n) * COLS:(top + n) * COLS] = row
+
+    def write_to_display(self, data, i, address=0):
+        """
+        Applies the orders and characters of a Write To Display (or Write Error Code) command.
+
+        Args:
+            data (bytes): The 5250 data of the record
+            i (int): Position in `data` of the first order
+            address (int): Screen position the first characters go to
+
+        Returns:
+            int: Position in `data` of the next command
+        """
+        while i < len(data) and data[i] != ESC:
+            byte = data[i]
+            if byte == ORDER_SBA:
+                address = (data[i + 1] - 1) * COLS + data[i + 2] - 1
+                i += 3
+            elif byte in (ORDER_IC, ORDER_MC):  # Insert Cursor / Move Cursor
+                self.cursor = (data[i + 1] - 1) * COLS + data[i + 2] - 1
+                i += 3
+            elif byte == ORDER_SOH:  # Start Of Header: length, then the header (error line, function keys allowed)
+                i += 2 + data[i + 1]
+            elif byte == ORDER_WEA:  # Write Extended Attribute: type and value, colors and such
+                i += 3
+            elif byte == ORDER_WDSF:  # Write To Display Structured Field (GUI windows, scroll bars): length includes itself
+                i += 1 + int.from_bytes(data[i + 1:i + 3], "big")
+            elif byte == ORDER_TD:  # Transparent Data: length, then characters shown as they are
+                length = int.from_bytes(data[i + 1:i + 3], "big")
+                for char in data[i + 3:i + 3 + length]:
+                    self.screen[address] = bytes([char]).decode(CODEPAGE) if char >= 0x40 else " "
+                    address += 1
+                i += 3 + length
+            elif byte == ORDER_RA:
+                end = (data[i + 1] - 1) * COLS + data[i + 2] - 1
+                char = bytes([data[i + 3]]).decode(CODEPAGE) if data[i + 3] >= 0x40 else " "
+                while address <= end:
+                    self.screen[address] = char
+                    address += 1
+                i += 4
+            elif byte == ORDER_SF:
+                i += 1
+                input_field = (data[i] & 0xC0) == 0x40  # Field format word present
+                modified = input_field and bool(data[i] & FFW_MDT)
+                if input_field:
+                    i += 2
+                    while 0x80 <= data[i] <= 0x9F:  # Field control words
+                        i += 2
+                self.screen[address] = " "  # The attribute byte shows as a blank
+                address += 1
+                length = int.from_bytes(data[i + 1:i + 3], "big")
+                i += 3
+                if input_field:
+                    self.fields = [field for field in self.fields if field.start() != address]
+                    field = Tn5250Field(address // COLS, address % COLS, length)
+                    field.modified = modified
+                    self.fields.append(field)
+                    self.fields.sort(key=Tn5250Field.start)
+            else:
+                self.screen[address] = bytes([byte]).decode(CODEPAGE) if byte >= 0x40 else " "
+                address += 1
+                i += 1
+        return i